@@ -0,0 +1,147 @@
+"""对比 A2S 响应解码的两种实现
+
++ steam : steam 库解析成 dict，再复制字段、构造 pydantic 模型（原来的做法）
++ a2s : querypool.a2s 直接解码缓冲区，跳过 pydantic 校验（现在的做法）
+
+两者都从内存中的数据包解码，不涉及网络，运行：
+
+    python benchmarks/bench_a2s.py
+"""
+import random
+import struct
+import sys
+from pathlib import Path
+from timeit import repeat
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent / "tests"))
+
+import steam.game_servers as gs  # noqa: E402
+from test_a2s import (  # noqa: E402
+    info_packet,
+    players_packet,
+    random_rules,
+    rules_packet,
+    split,
+)
+
+from fancy_source_query.querypool import a2s  # noqa: E402
+from fancy_source_query.querypool.infos import PlayerInfo, ServerInfo  # noqa: E402
+
+
+class FakeSocket:
+    """按顺序返回预先准备好的数据包，代替 steam 使用的 UDP socket"""
+
+    packets: list[bytes] = []
+
+    def __init__(self, *args) -> None:
+        self._packets = iter(FakeSocket.packets)
+
+    def connect(self, addr):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, data):
+        pass
+
+    def recv(self, size):
+        return next(self._packets)
+
+    def close(self):
+        pass
+
+
+gs.socket.socket = FakeSocket
+ADDR = ("127.0.0.1", 27015)
+
+
+def steam_info(packet: bytes) -> ServerInfo:
+    FakeSocket.packets = [packet]
+    info = gs.a2s_info(ADDR)
+    info_ = {
+        "name": info["name"],
+        "players": info["players"],
+        "max_players": info["max_players"],
+        "map": info["map"],
+        "vac": True if info["vac"] == 1 else False,
+        "ping": info["_ping"],
+    }
+    if info_["name"].startswith("\ufeff"):
+        info_["name"] = info_["name"].strip("\ufeff")
+    return ServerInfo(**info_)
+
+
+def a2s_info(packet: bytes) -> ServerInfo:
+    info = a2s.parse_info(packet)
+    name = info.name
+    if name.startswith("\ufeff"):
+        name = name.strip("\ufeff")
+    return ServerInfo.construct(
+        name=name,
+        players=info.players,
+        max_players=info.max_players,
+        map=info.map,
+        vac=info.vac,
+        ping=0.0,
+    )
+
+
+def steam_players(packet: bytes) -> list[PlayerInfo]:
+    FakeSocket.packets = [packet]
+    info = gs.a2s_players(ADDR)
+    return sorted([PlayerInfo(**i) for i in info], key=lambda o: -o.score)
+
+
+def a2s_players(packet: bytes) -> list[PlayerInfo]:
+    players = a2s.parse_players(packet)
+    players.sort(key=lambda p: -p.score)
+    return [
+        PlayerInfo.construct(
+            name=p.name, score=p.score, duration=p.duration, index=p.index
+        )
+        for p in players
+    ]
+
+
+def steam_rules(packets: list[bytes]):
+    FakeSocket.packets = [a2s.SINGLE + b"A" + struct.pack("<l", 1), *packets]
+    return tuple(sorted(gs.a2s_rules(ADDR).items()))
+
+
+def a2s_rules(packets: list[bytes]):
+    asm = a2s.SplitAssembler()
+    for p in packets:
+        data = asm.feed(p)
+    return tuple(sorted(a2s.parse_rules(data)))
+
+
+def bench(name: str, func, arg, number: int):
+    best = min(repeat(lambda: func(arg), number=number, repeat=5))
+    print(f"{name:<16}{best / number * 1e6:10.2f} us")
+
+
+def main():
+    rng = random.Random(0)
+    info = info_packet("\ufeff[CN] 服务器 #1", "c2m1_highway", 7, 8, 1)
+    players = players_packet(
+        [(i, f"玩家{i}", rng.randint(0, 300), rng.random() * 3600) for i in range(32)]
+    )
+    rules = split(rules_packet(random_rules(rng, 300)), 1200)
+    assert steam_info(info).name == a2s_info(info).name
+    assert [p.name for p in steam_players(players)] == [
+        p.name for p in a2s_players(players)
+    ]
+    assert len(steam_rules(rules)) == len(a2s_rules(rules))
+
+    bench("steam info", steam_info, info, 20000)
+    bench("a2s info", a2s_info, info, 20000)
+    bench("steam players", steam_players, players, 2000)
+    bench("a2s players", a2s_players, players, 2000)
+    bench("steam rules", steam_rules, rules, 500)
+    bench("a2s rules", a2s_rules, rules, 500)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""合并重复请求、限制请求频率
+
+群里经常有多人在几秒内发送相同的查询，这些请求没有必要各自查询、格式化、渲染和发送：
+
++ `Coalescer` : 相同 key 的计算在进行中时共享同一个结果，完成后 window 秒内直接复用
++ `SessionDebouncer` : 同一会话中相同的请求在回复发出前合并为一条回复
++ `RateLimiter` : 每个会话在一段时间内最多处理的请求数，默认不限制
+"""
+import asyncio
+from collections import deque
+from time import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class Coalescer:
+    """合并相同 key 的异步计算，出错的结果不复用"""
+
+    window: float
+    # key => (完成时间，进行中为 None, 结果)
+    _entries: dict[Hashable, tuple[float | None, asyncio.Future]]
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self._entries = dict()
+
+    def _prune(self, now: float):
+        expired = [
+            k
+            for k, (done_at, _) in self._entries.items()
+            if done_at is not None and now - done_at > self.window
+        ]
+        for k in expired:
+            del self._entries[k]
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        now = time()
+        self._prune(now)
+        entry = self._entries.get(key, None)
+        if entry is not None:
+            return await asyncio.shield(entry[1])
+        fut = asyncio.get_running_loop().create_future()
+        # 没有其它等待者时也不要报告未读取的异常
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._entries[key] = (None, fut)
+        try:
+            result = await compute()
+        except BaseException as e:
+            self._entries.pop(key, None)
+            if isinstance(e, Exception):
+                fut.set_exception(e)
+            else:
+                fut.cancel()
+            raise
+        self._entries[key] = (time(), fut)
+        fut.set_result(result)
+        return result
+
+
+class SessionDebouncer:
+    """同一会话中相同的请求只回复一次
+
+    第一个请求负责回复（`join` 返回 True），
+    回复发出前到达的相同请求合并进来，由 `finish` 返回所有请求者，一起 @；
+    回复发出后的相同请求重新开始，会再次得到回复。
+    """
+
+    # 回复迟迟没有发出（例如处理时出错）时，超过这个时间的请求不再合并
+    stale: float
+    # key => (开始时间, 请求者列表)
+    _entries: dict[Hashable, tuple[float, list[str]]]
+
+    def __init__(self, stale: float = 60.0) -> None:
+        self.stale = stale
+        self._entries = dict()
+
+    def _prune(self, now: float):
+        expired = [
+            k for k, (started, _) in self._entries.items() if now - started > self.stale
+        ]
+        for k in expired:
+            del self._entries[k]
+
+    def join(self, key: Hashable, user: str) -> bool:
+        now = time()
+        self._prune(now)
+        entry = self._entries.get(key, None)
+        if entry is None:
+            self._entries[key] = (now, [user])
+            return True
+        if user not in entry[1]:
+            entry[1].append(user)
+        return False
+
+    def finish(self, key: Hashable) -> list[str]:
+        """标记已回复，返回需要 @ 的请求者"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return []
+        return list(entry[1])
+
+    def discard(self, key: Hashable):
+        self._entries.pop(key, None)
+
+
+class RateLimiter:
+    """滑动窗口限流：每个会话在 period 秒内最多 limit 次，limit 为 0 时不限制。
+    不限制时仍然记录各会话的请求时间，供 `active` 使用"""
+
+    limit: int
+    period: float
+    _history: dict[str, deque[float]]
+    # 会话 => 上次提示请求过于频繁的时间
+    _warned: dict[str, float]
+
+    def __init__(self, limit: int, period: float) -> None:
+        self.limit = limit
+        self.period = period
+        self._history = dict()
+        self._warned = dict()
+
+    def allow(self, session: str) -> bool:
+        now = time()
+        history = self._history.setdefault(session, deque())
+        while history and now - history[0] > self.period:
+            history.popleft()
+        if self.limit > 0 and len(history) >= self.limit:
+            return False
+        history.append(now)
+        return True
+
+    def warn(self, session: str) -> bool:
+        """被限流的会话在每个 period 内只提示一次，返回本次是否需要提示"""
+        now = time()
+        if now - self._warned.get(session, 0.0) <= self.period:
+            return False
+        self._warned[session] = now
+        return True
+
+    def active(self) -> list[str]:
+        """最近 period 秒内查询过的会话"""
+        now = time()
+        return [s for s, h in self._history.items() if h and now - h[-1] <= self.period]
@@ -1,6 +1,7 @@
 import logging
 from os import getenv
 from pathlib import Path
+from typing import Literal
 
 import toml
 from nonebot import get_driver
@@ -29,17 +30,64 @@ class ServerGroupConfig(BaseModel, extra=Extra.ignore):
     related_sessions: list[str]
 
 
+class DiscoveryConfig(BaseModel, extra=Extra.ignore):
+    "通过主服务器发现服务器，自动加入服务器组"
+    # 加入的服务器组
+    group: str
+    # 发现的服务器的名称为前缀加序号，为空时使用组名；已发现的服务器刷新后名称不变
+    name_prefix: str = ""
+    # 主服务器地址
+    master: str = "hl2master.steampowered.com:27011"
+    # 区域代码，255 为全部区域
+    region: int = 255
+    # 游戏目录，例如 left4dead2
+    gamedir: str = ""
+    # 服务器名称，支持 * 通配符
+    name_match: str = ""
+    # 其它过滤条件，按主服务器协议的格式书写，例如 \empty\1
+    filter: str = ""
+    # 最多加入的服务器数量
+    max_servers: int = 64
+
+
 class FmtConfig(BaseModel, extra=Extra.ignore):
     "设置格式化模板"
     server_info: str = "{name}\n==({players:>2d}/{max_players:>2d})[{mapname}]"
     player_info: str = ">>[{score}]({minutes:.1f}min){name}"
     rule_info: str = "({key} = {value})"
+    group_info: str = "==== {name} ({players}) ===="
     players_count: str = "Players: {players}"
     query_time: str = "----{time}"
+    # 在线玩家中找不到时，玩家名录中的记录
+    seen_info: str = "{name} 最后出现在 {server}：{last_seen}（累计 {hours:.1f}h）"
     # strftime 格式符
     time: str = "%Y-%m-%d %H:%M:%S"
 
 
+class ImageConfig(BaseModel, extra=Extra.ignore):
+    "设置查询结果图片的编码和发送方式"
+    # 图片格式，png 或 webp
+    format: Literal["png", "webp"] = "png"
+    # 颜色模式，rgb 为原图；palette 为调色板，文字图片颜色很少，体积小得多；1bit 为黑白
+    mode: Literal["rgb", "palette", "1bit"] = "palette"
+    # palette 模式的颜色数
+    colors: int = 64
+    # png 的压缩级别，0~9，越大越慢
+    compress_level: int = 6
+    # webp 是否无损压缩，有损时使用 webp_quality
+    webp_lossless: bool = True
+    webp_quality: int = 80
+    # 发送方式，base64 为内嵌在消息中；file 为本地文件路径，要求 OneBot 实现与本插件在同一台机器上；
+    # http 为本插件提供的 HTTP 地址，要求使用 FastAPI 驱动器
+    delivery: Literal["base64", "file", "http"] = "base64"
+    # file / http 方式保存图片的目录，相对于 nonebot 进程工作目录
+    directory: str = "fsq_images"
+    # file / http 方式的图片保留时间，s
+    keep_seconds: int = 600
+    # http 方式中 OneBot 实现访问本插件的地址，例如 http://127.0.0.1:8080
+    http_base: str = "http://127.0.0.1:8080"
+
+
 class FancySourceQueryConfig(BaseModel, extra=Extra.ignore):
     """插件的主要配置"""
 
@@ -47,10 +95,44 @@ class FancySourceQueryConfig(BaseModel, extra=Extra.ignore):
     timeout: int = 5
     # 默认查询池缓存 20s
     cache_delay: int = 20
+    # 服务器域名解析结果的缓存时间，过期后在后台重新解析，默认 300s
+    dns_ttl: int = 300
+    # 服务器规则很少变化，单独设置缓存时间，默认 600s
+    rules_cache_delay: int = 600
+    # 人数和地图历史记录的长度（点数），分别为原始采样、每分钟、每小时，
+    # 修改后只对新记录的服务器生效
+    history_raw_size: int = 360
+    history_minute_size: int = 1440
+    history_hour_size: int = 1344
+    # 查询池的缓存后端，memory 为进程内缓存，sqlite 为同一台机器上多个进程共享的缓存文件
+    cache_backend: Literal["memory", "sqlite"] = "memory"
+    # sqlite 缓存文件的路径，相对于 nonebot 进程工作目录
+    cache_path: str = "fsq_cache.sqlite3"
+    # 守护进程定时轮询所有服务器时使用的工作进程数，服务器按地址的一致性哈希分配，0 表示在本进程中轮询
+    query_shards: int = 0
+    # 是否将查询到的玩家记录到玩家名录中，搜索不到在线玩家时回答其最后出现的服务器和时间
+    player_directory: bool = False
+    # 玩家名录的路径，相对于 nonebot 进程工作目录
+    player_directory_path: str = "fsq_players.sqlite3"
+    # 玩家名录批量写入的间隔，s
+    player_directory_flush: float = 10.0
     # 默认限制文本输出 5 行，超过 5 行的转成图片输出
     output_max_lines: int = 5
+    # 超过 output_max_lines 的两倍时分页渲染，每页的行数（折行后）
+    output_page_lines: int = 40
+    # 分页渲染的最大页数，超出的部分被截断
+    output_max_pages: int = 8
+    # 本地渲染图片的线程数，各页在不同线程中并发渲染
+    render_workers: int = 2
+    # 同一群组中相同的查询在多少秒内共享查询结果（每次仍会回复），0 表示只合并进行中的查询
+    reply_coalesce_window: float = 10.0
+    # 每个会话（群或私聊）在 rate_limit_period 秒内最多处理的查询数，超出时提示查询过于频繁，0 表示不限制
+    rate_limit: int = 0
+    rate_limit_period: float = 60.0
     # 一次性随机抽取三方图的最大数量
     map_choices_max_counts: int = 15
+    # 抽图时每个服务器组记住最近抽到的地图数量，这些地图不会被再次抽到
+    map_no_repeat: int = 10
     # Fancy Source Query 可以配置地图数据库，方便将地图代码转换成人类可读的地图名
     # 该路径相对于 nonebot 进程工作目录
     mapnames_db: list[str] = [DEFAULT_MAPNAMES_PATH_OFFICIAL, DEFAULT_MAPNAMES_PATH]
@@ -58,11 +140,35 @@ class FancySourceQueryConfig(BaseModel, extra=Extra.ignore):
     default_server_group: str
     # 转图片时的字号
     fontsize = 16
+    # 订阅（玩家进入、满人、换图）的轮询间隔，s
+    subscription_interval: int = 30
+    # 订阅的保存路径，相对于 nonebot 进程工作目录
+    subscription_path: str = "fsq_subscriptions.json"
+    # 每个群或私聊最多的订阅数量
+    subscription_max_per_session: int = 10
+    # 守护进程的 Unix socket 路径，设置后 Nonebot 插件将查询和渲染交给守护进程
+    daemon_socket: str | None = None
+    # 是否在 Nonebot 的 FastAPI 驱动器上提供只读的 HTTP 查询接口
+    http_api: bool = False
+    # HTTP 查询接口的路径前缀
+    http_prefix: str = "/fsq"
+    # 通过主服务器发现服务器的间隔，s，0 表示只在启动和刷新配置时发现
+    discovery_interval: int = 600
+    # 发现服务器时同时探测的服务器数量
+    discovery_concurrency: int = 64
+    # 启动和刷新配置后是否在后台预热所有服务器的缓存，最近活跃和关联会话多的组优先
+    warmup: bool = True
+    # 预热时每秒最多开始查询的服务器数量，0 表示不限制
+    warmup_rate: float = 20.0
+    # 预热时同时查询的服务器数量
+    warmup_concurrency: int = 16
 
     impaper: ImPaperConfig
     fmt: FmtConfig
+    image: ImageConfig = ImageConfig()
     server_groups: list[ServerGroupConfig]
     servers: list[ServerConfig]
+    discovery: list[DiscoveryConfig] = []
 
 
 class NonebotConfig(BaseModel, extra=Extra.ignore):
@@ -112,3 +218,5 @@ class Mapname(BaseModel, extra=Extra.ignore):
     name: str
     name_zh: str | None = None
     maps: list[str]
+    # 抽图时的权重，0 表示不参与抽图
+    weight: float = 1.0
@@ -0,0 +1,96 @@
+"""通过 Valve 主服务器发现服务器
+
+按 `DiscoveryConfig` 向主服务器分页查询候选地址，并发探测 A2S_INFO，
+把有响应的服务器转换成 `ServerConfig`，由 `FancySourceQuery.refresh_discovery`
+增量合并到服务器组的查找树中。
+"""
+import asyncio
+import logging
+from typing import Container
+
+from .config import DiscoveryConfig, ServerConfig
+from .exceptions import MasterProtocolError
+from .querypool.master import build_filter, probe, query_master
+
+
+class Discovery:
+    """发现服务器并为其分配名称
+
+    已发现的服务器刷新后保持原来的名称，新服务器的名称跳过已被占用的名称（例如配置文件中的服务器），
+    某个配置的主服务器查询失败时沿用其上一次的结果。
+    """
+
+    # (组名, host, port) => 服务器名
+    names: dict[tuple[str, str, int], str]
+    # 名称前缀 => 已分配的最大序号
+    counters: dict[str, int]
+    # 配置 => 上一次发现的服务器
+    _last: dict[str, list[ServerConfig]]
+
+    def __init__(self) -> None:
+        self.names = dict()
+        self.counters = dict()
+        self._last = dict()
+
+    def name_of(
+        self, conf: DiscoveryConfig, host: str, port: int, taken: Container[str] = ()
+    ) -> str:
+        key = (conf.group, host, port)
+        name = self.names.get(key, None)
+        if name is None:
+            prefix = conf.name_prefix or conf.group
+            while True:
+                self.counters[prefix] = self.counters.get(prefix, 0) + 1
+                name = f"{prefix}{self.counters[prefix]}"
+                if name not in taken:
+                    break
+            self.names[key] = name
+        return name
+
+    async def discover(
+        self,
+        conf: DiscoveryConfig,
+        timeout: float,
+        concurrency: int,
+        taken: Container[str] = (),
+    ) -> list[ServerConfig]:
+        host, _, port = conf.master.rpartition(":")
+        filter_ = build_filter(conf.gamedir, conf.name_match, conf.filter)
+        addrs = await query_master(
+            host, int(port), filter_, conf.region, timeout, conf.max_servers
+        )
+        alive = await probe(addrs, timeout, concurrency)
+        logging.info(
+            f"discovered {len(alive)}/{len(addrs)} servers for group {conf.group!r}"
+        )
+        return [
+            ServerConfig(
+                group=conf.group, name=self.name_of(conf, h, p, taken), host=h, port=p
+            )
+            for (h, p), _ in alive
+        ]
+
+    async def discover_all(
+        self,
+        confs: list[DiscoveryConfig],
+        timeout: float,
+        concurrency: int,
+        taken: Container[str] = (),
+    ) -> list[ServerConfig]:
+        """按各配置发现服务器，新服务器不使用 taken 中的名称"""
+        result = []
+        for conf in confs:
+            key = conf.json()
+            try:
+                self._last[key] = await self.discover(conf, timeout, concurrency, taken)
+            # Python 3.10 中 asyncio.TimeoutError 不是内置 TimeoutError 的子类
+            except (
+                asyncio.TimeoutError,
+                TimeoutError,
+                OSError,
+                ValueError,
+                MasterProtocolError,
+            ) as e:
+                logging.warning(f"discovery from {conf.master!r} failed: {e!r}")
+            result.extend(self._last.get(key, []))
+        return result
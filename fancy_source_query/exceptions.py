@@ -16,3 +16,15 @@ class ObjectNotFound(FancySourceQueryError):
 
 class ServerRestarting(ConnectionRefusedError, FancySourceQueryError):
     pass
+
+
+class DaemonError(FancySourceQueryError):
+    pass
+
+
+class A2SProtocolError(FancySourceQueryError):
+    pass
+
+
+class MasterProtocolError(FancySourceQueryError):
+    pass
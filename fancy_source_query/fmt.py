@@ -3,19 +3,34 @@ from time import localtime, strftime
 
 from .config import FmtConfig
 from .guess_map import Mapname, guess_map
-from .querypool.infos import PlayerInfo, RuleInfo, ServerInfo, ServerPair, ServerTriple
+from .querypool.infos import (
+    GroupResult,
+    PlayerInfo,
+    RuleInfo,
+    SeenInfo,
+    ServerInfo,
+    ServerPair,
+    ServerTriple,
+)
 
 
 def fmt_time(t: float) -> str:
     return strftime("%Y-%m-%d %H:%M:%S", localtime(t))
 
 
+# 规则格式化结果的缓存上限
+RULES_TEXT_CACHE_SIZE = 1024
+
+
 class InfoFormatter:
     _fmt: FmtConfig
     _rlookup: dict[str, Mapname]
+    # 规则摘要 => 格式化后的规则文本
+    _rules_text: dict[str, str]
 
     def __init__(self) -> None:
         self._fmt = FmtConfig()
+        self._rules_text = dict()
 
     def config(
         self, fmt: FmtConfig | None = None, rlookup: dict[str, Mapname] | None = None
@@ -23,12 +38,20 @@ class InfoFormatter:
         if fmt:
             logging.debug("updated InfoFormatter's config.")
             self._fmt = fmt
+            self._rules_text.clear()
         if rlookup:
             logging.debug("updated InfoFormatter's map rlookup.")
             self._rlookup = rlookup
 
     def format(
-        self, info: ServerInfo | PlayerInfo | RuleInfo | ServerPair | ServerTriple
+        self,
+        info: ServerInfo
+        | PlayerInfo
+        | RuleInfo
+        | ServerPair
+        | ServerTriple
+        | GroupResult
+        | SeenInfo,
     ) -> str:
         "通用的格式化方法，会判断传入类型并具体分配实际方法"
         if isinstance(info, ServerInfo):
@@ -41,6 +64,10 @@ class InfoFormatter:
             return self.fmt_rule_info(info)
         elif isinstance(info, ServerTriple):
             return self.fmt_server_triple(info)
+        elif isinstance(info, GroupResult):
+            return self.fmt_group_result(info)
+        elif isinstance(info, SeenInfo):
+            return self.fmt_seen_info(info)
 
     def fmt_server_info(self, info: ServerInfo) -> str:
         code = info.map
@@ -82,9 +109,36 @@ class InfoFormatter:
         sfmt = self.fmt_server_info(info.server)
         sorted_p = sorted(info.players, key=lambda x: x.score, reverse=True)
         pfmt = [self.fmt_player_info(p) for p in sorted_p]
-        sorted_r = sorted(info.rules, key=lambda x: x.name)
-        rfmt = [self.fmt_rule_info(r) for r in sorted_r]
-        return "{}\n{}\n{}".format(sfmt, "\n".join(pfmt), "\n".join(rfmt))
+        rfmt = self.fmt_rules(info.rules, info.rules_digest)
+        return "{}\n{}\n{}".format(sfmt, "\n".join(pfmt), rfmt)
+
+    def fmt_rules(self, rules: list[RuleInfo], digest: str = "") -> str:
+        """格式化规则列表，摘要相同的规则直接使用上次的格式化结果"""
+        if digest and (text := self._rules_text.get(digest)) is not None:
+            return text
+        sorted_r = sorted(rules, key=lambda x: x.name)
+        text = "\n".join(self.fmt_rule_info(r) for r in sorted_r)
+        if digest:
+            if len(self._rules_text) >= RULES_TEXT_CACHE_SIZE:
+                self._rules_text.clear()
+            self._rules_text[digest] = text
+        return text
+
+    def fmt_group_result(self, info: GroupResult) -> str:
+        "组标题在前，组内各服务器的格式化结果在后"
+        gfmt = self._fmt.group_info.format(name=info.name, players=info.players)
+        rfmt = [self.format(r) for r in info.result]
+        return "{}\n{}".format(gfmt, "\n".join(rfmt))
+
+    def fmt_seen_info(self, info: SeenInfo) -> str:
+        fmt = self._fmt.seen_info.format(
+            name=info.name,
+            server=info.server,
+            last_seen=self.fmt_time(info.last_seen),
+            first_seen=self.fmt_time(info.first_seen),
+            hours=info.duration / 3600,
+        )
+        return fmt
 
     def guess_map(self, code: str) -> str | None:
         "如果能查询到则返回对应名称，否则返回 None"
@@ -4,29 +4,57 @@
 
 + nonebot: Nonebot 接口
 + cli: 命令行接口
++ web: HTTP 接口
 
 此接口导出一个 FancySourceQuery 对象，其成员函数提供了对应的功能。
 """
 import asyncio
 import logging
 import re
-import socket
-from typing import Literal
+from collections import Counter
+from time import perf_counter
+from typing import Iterable, Literal
 
 import toml
 from pydantic import BaseModel
 
 from impaper.draw import TextDrawer
 
-from ..config import MAPNAMES_PATH_PREFIX, FancySourceQueryConfig, Mapname, load_config
+from ..config import (
+    MAPNAMES_PATH_PREFIX,
+    FancySourceQueryConfig,
+    Mapname,
+    ServerConfig,
+    load_config,
+)
+from ..discovery import Discovery
 from ..exceptions import ObjectNotFound
 from ..fmt import InfoFormatter
 from ..guess_map import build_rlookup
-from ..querypool import QueryPool
-from ..querypool.infos import PlayerInfo, ServerInfo, ServerPair
-from ..server_group import Server, ServerGroup, build_server_group_graph
+from ..map_pool import CUSTOM, MapChooser
+from ..querypool import LEASE_MARGIN, QueryPool, is_placeholder
+from ..querypool.cache import build_cache_backend
+from ..querypool.directory import PlayerDirectory
+from ..querypool.history import TIER_SECONDS, Sample, map_popularity, peak_hours
+from ..querypool.shard import ShardPool, players_from_tuples, server_from_tuple
+from ..querypool.infos import (
+    GroupResult,
+    PlayerInfo,
+    SeenInfo,
+    ServerInfo,
+    ServerPair,
+    ServerTriple,
+)
+from ..server_group import (
+    Server,
+    ServerGroup,
+    build_server_group_graph,
+    merge_servers,
+)
 
 WHITESPACE = re.compile("[ \u2002\u2003]")
+# 以此作为组名时查询所有服务器组
+ALL_GROUPS = "*"
 
 
 class QueryResult(BaseModel):
@@ -36,14 +64,30 @@ class QueryResult(BaseModel):
         + o : overview
         + s : only server
         + sp : server and players
+        + spr : server, players and rules
         + spm : server and players multi
         + p : search player
+        + ao : overview of all groups
+        + ap : search player in all groups
+        + ls : last seen, from the player directory
     """
 
-    tag: Literal["o", "s", "sp", "spm", "p"]
+    tag: Literal["o", "s", "sp", "spr", "spm", "p", "ao", "ap", "ls"]
     # query time
     qtime: float
-    result: None | list[ServerPair] | list[ServerInfo] | ServerPair | ServerInfo
+    # 结果所基于的快照版本，快照不变时版本不变；0 表示不是由快照生成的结果
+    version: int = 0
+    result: (
+        None
+        | list[GroupResult]
+        | list[ServerPair]
+        | list[ServerInfo]
+        | list[SeenInfo]
+        # ServerTriple 必须在 ServerPair 之前，否则会被当作 ServerPair 解析
+        | ServerTriple
+        | ServerPair
+        | ServerInfo
+    )
 
 
 class FancySourceQuery:
@@ -51,10 +95,20 @@ class FancySourceQuery:
     格式化为文本是 cli 或 nonebot 接口的工作。
 
     + `update_config` : 刷新配置项（本体配置、服务器组配置）
-    + `update_mapnames` : 刷新地图名反查表
+    + `update_mapnames` : 刷新地图名反查表和抽图用的地图池
+    + `choose_maps` : 随机抽取地图
+    + `poll_all`(async): 查询所有服务器，刷新缓存，可以分片给多个工作进程
+    + `warm_up`(async): 按组的优先级错峰查询所有服务器，预热缓存
+    + `refresh_discovery`(async): 通过主服务器发现服务器，增量更新服务器组
     + `find_server` : 在指定的服务器组中根据名称寻找服务器
     + `find_group` : 根据名称寻找指定的服务器组
     + `query_server`(async): 查询服务器信息，返回查询时间 和 Server Info
+    + `query_all_overview`(async): 查询所有服务器组的概况
+    + `search_player_all`(async): 在所有服务器组中搜索玩家
+    + `last_seen`(async): 在玩家名录中查找玩家最后出现的服务器和时间
+    + `peak_hours` : 根据历史记录统计服务器组每天各时段的平均人数
+    + `map_popularity` : 根据历史记录统计服务器组各地图的热度
+    + `player_trend` : 读取某个服务器的人数历史记录
     """
 
     config: FancySourceQueryConfig
@@ -66,36 +120,217 @@ class FancySourceQuery:
     servers: dict[str, Server]
     # session_id => server_group name
     session_group: dict[str, str]
+    discovery: Discovery
+    map_chooser: MapChooser
+    # 分片轮询的工作进程，未启用时为 None
+    shards: ShardPool | None
+    # 通过主服务器发现的服务器，刷新配置后重新合并到服务器组
+    discovered: list[ServerConfig]
     qstr_pat_overview: re.Pattern
     qstr_pat_server_name: re.Pattern
+    qstr_pat_server_rules: re.Pattern
     # text to graphic 引擎，按需加载
     t2g: TextDrawer | None
+    # 当前缓存后端的 (类型, 路径)，配置变化时才重建缓存后端
+    cache_spec: tuple[str, str] | None
 
     def __init__(self) -> None:
         self.query_pool = QueryPool()
         self.ifmt = InfoFormatter()
         self.t2g = None
+        self.cache_spec = None
+        self.discovery = Discovery()
+        self.map_chooser = MapChooser()
+        self.shards = None
+        self.discovered = []
 
     def update_config(self, path: str | None = None):
         self.config = load_config(path)
-        self.query_pool.config(self.config.cache_delay)
+        self.query_pool.config(
+            self.config.cache_delay,
+            lease=self.config.timeout + LEASE_MARGIN,
+            rules_expire=self.config.rules_cache_delay,
+            timeout=self.config.timeout,
+        )
+        self.query_pool.resolver.config(ttl=self.config.dns_ttl)
+        self.query_pool.history.config(
+            {
+                "raw": self.config.history_raw_size,
+                "minute": self.config.history_minute_size,
+                "hour": self.config.history_hour_size,
+            }
+        )
+        cache_spec = (self.config.cache_backend, self.config.cache_path)
+        if cache_spec != self.cache_spec:
+            self.query_pool.config(backend=build_cache_backend(*cache_spec))
+            self.cache_spec = cache_spec
+        self.update_directory()
+        self.update_shards()
+        self.map_chooser.history_size = self.config.map_no_repeat
         self.ifmt.config(fmt=self.config.fmt)
         groups, servers = build_server_group_graph(
             self.config.server_groups, self.config.servers
         )
+        merge_servers(groups, servers, [], self.discovered)
         self.server_group = groups
         self.servers = servers
         self.session_group = {
             s: g.name for g in self.config.server_groups for s in g.related_sessions
         }
         self.qstr_pat_overview = re.compile(r"^(?:人数)?$")
-        all_server_names = "|".join(self.servers.keys())
-        self.qstr_pat_server_name = re.compile(f"^(?:{all_server_names})$")
-        socket.setdefaulttimeout(self.config.timeout)
+        self.compile_server_patterns()
         if self.t2g is not None:
             self.t2g.conf = self.config.impaper
             self.t2g.fontsize = self.config.fontsize
 
+    def update_directory(self):
+        """按配置打开、关闭或更换玩家名录"""
+        directory = self.query_pool.directory
+        path = (
+            self.config.player_directory_path if self.config.player_directory else None
+        )
+        if directory is not None and directory.path != path:
+            directory.close()
+            self.query_pool.directory = directory = None
+        if path is not None:
+            if directory is None:
+                directory = self.query_pool.directory = PlayerDirectory(path)
+            directory.flush_interval = self.config.player_directory_flush
+
+    def update_shards(self):
+        """工作进程数变化时结束原有的工作进程，下次轮询时按新的数量启动"""
+        if self.shards is not None and self.shards.workers != self.config.query_shards:
+            self.close_shards()
+        if self.shards is not None:
+            self.shards.timeout = self.config.timeout
+
+    def close_shards(self):
+        if self.shards is not None:
+            self.shards.close()
+            self.shards = None
+
+    async def poll_all(self) -> list[Exception]:
+        """查询所有服务器的信息和玩家，刷新缓存，返回查询中出现的异常。
+        启用分片轮询时分给各工作进程查询，服务器列表变化时重新分配分片"""
+        addrs = self.unique_addresses()
+        if self.config.query_shards > 0:
+            if self.shards is None:
+                self.shards = ShardPool(self.config.query_shards, self.config.timeout)
+                self.shards.start()
+            self.shards.rebalance(addrs)
+            for host, port, qtime, sinfo, pinfo in await self.shards.poll():
+                self.query_pool.merge(
+                    host,
+                    port,
+                    qtime,
+                    server_from_tuple(sinfo) if sinfo is not None else None,
+                    players_from_tuples(pinfo) if pinfo is not None else None,
+                )
+            return []
+        results = await asyncio.gather(
+            *(self.query_pool.server_info(h, p) for h, p in addrs),
+            *(self.query_pool.players_info(h, p) for h, p in addrs),
+            return_exceptions=True,
+        )
+        return [e for e in results if isinstance(e, Exception)]
+
+    def warmup_order(
+        self, active_sessions: Iterable[str] = ()
+    ) -> list[tuple[str, int]]:
+        """预热的服务器顺序：最近活跃的会话多的组优先，其次是关联会话多的组，
+        同一地址只出现一次"""
+        active = Counter(
+            self.session_group.get(s, self.config.default_server_group)
+            for s in active_sessions
+        )
+        groups = sorted(
+            self.server_group.values(),
+            key=lambda g: (active[g.name], len(g.related_sessions)),
+            reverse=True,
+        )
+        peek = self.query_pool.resolver.peek
+        addrs = ((peek(s.host), s.port) for g in groups for s in g.servers.values())
+        return list(dict.fromkeys(addrs))
+
+    async def warm_up(
+        self, active_sessions: Iterable[str] = ()
+    ) -> tuple[int, int, float]:
+        """预热所有服务器的缓存，返回 (服务器数量, 失败数量, 耗时)。
+        每秒最多开始 warmup_rate 个服务器，同时最多查询 warmup_concurrency 个，
+        按 `warmup_order` 的顺序开始。总在本进程中查询，不启动分片轮询的工作进程"""
+        start = perf_counter()
+        addrs = self.warmup_order(active_sessions)
+        semaphore = asyncio.Semaphore(max(self.config.warmup_concurrency, 1))
+        rate = self.config.warmup_rate
+        # 每完成约 10% 报告一次进度
+        step = max(len(addrs) // 10, 1)
+        done, failed = 0, 0
+
+        async def warm(i: int, host: str, port: int):
+            nonlocal done, failed
+            if rate > 0:
+                await asyncio.sleep(i / rate)
+            async with semaphore:
+                try:
+                    _, sinfo = await self.query_pool.server_info(host, port)
+                    if is_placeholder(sinfo):
+                        # 服务器没有响应，不再等待一次玩家查询超时
+                        failed += 1
+                        logging.warning(f"warm up {host}:{port} failed: {sinfo.name}")
+                    else:
+                        await self.query_pool.players_info(host, port)
+                except Exception as e:
+                    failed += 1
+                    logging.warning(f"warm up {host}:{port} failed: {e!r}")
+            done += 1
+            if done % step == 0 or done == len(addrs):
+                logging.info(
+                    f"warm up {done}/{len(addrs)} servers, "
+                    f"{perf_counter() - start:.1f}s"
+                )
+
+        await asyncio.gather(*(warm(i, h, p) for i, (h, p) in enumerate(addrs)))
+        seconds = perf_counter() - start
+        logging.info(
+            f"warm up finished: {len(addrs)} servers, {failed} failed, {seconds:.1f}s"
+        )
+        return len(addrs), failed, seconds
+
+    def compile_server_patterns(self):
+        all_server_names = "|".join(self.servers.keys())
+        self.qstr_pat_server_name = re.compile(f"^(?:{all_server_names})$")
+        self.qstr_pat_server_rules = re.compile(f"^({all_server_names})\\s+规则$")
+
+    async def refresh_discovery(self) -> tuple[int, int]:
+        """通过主服务器重新发现服务器，只增删有变化的服务器，返回 (新增数量, 删除数量)"""
+        if not self.config.discovery and not self.discovered:
+            return 0, 0
+        discovered = await self.discovery.discover_all(
+            self.config.discovery,
+            self.config.timeout,
+            self.config.discovery_concurrency,
+            # 新发现的服务器跳过已有服务器（包括配置文件中的）使用的名称
+            self.servers,
+        )
+        added, removed = merge_servers(
+            self.server_group, self.servers, self.discovered, discovered
+        )
+        self.discovered = discovered
+        if added or removed:
+            self.compile_server_patterns()
+        return added, removed
+
+    async def keep_discovering(self):
+        """每隔 discovery_interval 秒发现一次服务器，间隔为 0 时只发现一次"""
+        while True:
+            try:
+                await self.refresh_discovery()
+            except Exception:
+                logging.exception("server discovery failed")
+            if self.config.discovery_interval <= 0:
+                return
+            await asyncio.sleep(self.config.discovery_interval)
+
     def update_mapnames(self):
         mapnames_lists = [toml.load(i) for i in self.config.mapnames_db]
         mapnames_list = []
@@ -104,8 +339,34 @@ class FancySourceQuery:
         self.mapnames = [Mapname.parse_obj(x) for x in mapnames_list]
         self.map_rlookup = build_rlookup(self.mapnames)
         self.ifmt.config(rlookup=self.map_rlookup)
+        self.map_chooser.update(self.mapnames)
         logging.debug("mapnames refreshed")
 
+    def running_maps(self, gname: str | None) -> set[str]:
+        """组内服务器正在运行的地图（地图数据中的名称），只读取缓存，不产生网络查询"""
+        group = self.find_group(gname)
+        names = set()
+        for s in group.servers.values():
+            sinfo = self.query_pool.peek_server_info(s.host, s.port)
+            if sinfo is None:
+                continue
+            mapname = self.map_rlookup.get(sinfo.map.lower(), None)
+            if mapname is not None:
+                names.add(mapname.name)
+        return names
+
+    def choose_maps(
+        self, gname: str | None, k: int, category: str = CUSTOM
+    ) -> list[Mapname]:
+        """随机抽取 k 张地图，排除组内最近抽过的和组内服务器正在运行的地图"""
+        running = self.running_maps(gname) if gname in self.server_group else ()
+        return self.map_chooser.choose(gname, k, category, running)
+
+    async def resolve_hosts(self) -> dict[str, str]:
+        """解析配置中所有服务器的域名，应在加载配置后调用，之后的查询不必等待 DNS"""
+        hosts = [s.host for s in self.servers.values()]
+        return await self.query_pool.resolver.resolve_all(hosts)
+
     def find_server(self, sname: str, gname: str | None) -> Server:
         """在指定的服务器组中寻找服务器"""
         group = self.find_group(gname)
@@ -148,6 +409,26 @@ class FancySourceQuery:
         r = QueryResult(tag="sp", qtime=qtime, result=spair)
         return r
 
+    async def query_server_full(self, sname: str, gname: str | None) -> QueryResult:
+        """根据服务器组和服务器的名称查询服务器信息、玩家信息和规则，
+        返回查询时间 和 ServerTriple"""
+        server = self.find_server(sname, gname)
+        host, port = server.host, server.port
+        (qtime1, sinfo), (qtime2, pinfo), (qtime3, ruleset) = await asyncio.gather(
+            self.query_pool.server_info(host, port),
+            self.query_pool.players_info(host, port),
+            self.query_pool.rules_info(host, port),
+        )
+        triple = ServerTriple(
+            server=sinfo,
+            players=pinfo,
+            rules=ruleset.rules,
+            rules_digest=ruleset.digest,
+        )
+        qtime = max(qtime1, qtime2, qtime3)
+        r = QueryResult(tag="spr", qtime=qtime, result=triple)
+        return r
+
     async def query_server_and_players_multi(
         self, snames: list[str], gname: str | None
     ) -> QueryResult:
@@ -160,87 +441,230 @@ class FancySourceQuery:
                 logging.warning("object not found, but skiped.")
                 continue
         # servers = [self.find_server(sname, gname) for sname in snames]
-        sinfos = await asyncio.gather(
-            *(self.query_pool.server_info(s.host, s.port) for s in servers)
+        snap = await self.query_pool.snapshot(
+            [(s.host, s.port) for s in servers], players=True
         )
-        pinfos = await asyncio.gather(
-            *(self.query_pool.players_info(s.host, s.port) for s in servers)
+        # 快照中的对象不再修改，跳过校验直接引用
+        r = QueryResult.construct(
+            tag="spm", qtime=snap.qtime, version=snap.version, result=list(snap.pairs)
         )
-        qtime = max([r[0] for r in sinfos] + [r[0] for r in pinfos])
-        pairs = [
-            ServerPair(server=r[0][1], players=r[1][1]) for r in zip(sinfos, pinfos)
-        ]
-        r = QueryResult(tag="spm", qtime=qtime, result=pairs)
         return r
 
+    async def query_addresses(
+        self, addrs: list[tuple[str, int]], players: bool
+    ) -> QueryResult:
+        """按地址查询服务器，结果与 addrs 一一对应。
+        players 为真时返回最晚查询时间和 list[ServerPair]，否则为 list[ServerInfo]"""
+        # 经过守护进程转发时地址是列表
+        snap = await self.query_pool.snapshot([(h, p) for h, p in addrs], players)
+        if players:
+            return QueryResult.construct(
+                tag="spm",
+                qtime=snap.qtime,
+                version=snap.version,
+                result=list(snap.pairs),
+            )
+        return QueryResult.construct(
+            tag="o", qtime=snap.qtime, version=snap.version, result=list(snap.servers)
+        )
+
     async def query_servers_overview(self, gname: str | None) -> QueryResult:
         """查询某服务器组内的服务器信息，返回最晚查询时间和 `list[ServerInfo]`
 
         + `sgroup` 服务器组名
         """
         group = self.find_group(gname)
-        servers = group.servers.values()
-        results = await asyncio.gather(
-            *[self.query_pool.server_info(s.host, s.port) for s in servers]
+        snap = await self.query_pool.snapshot(
+            [(s.host, s.port) for s in group.servers.values()]
+        )
+        r = QueryResult.construct(
+            tag="o", qtime=snap.qtime, version=snap.version, result=list(snap.servers)
         )
-        qtime = max(r[0] for r in results)
-        sinfos = [r[1] for r in results]
-        r = QueryResult(tag="o", qtime=qtime, result=sinfos)
         return r
 
     async def search_player(self, player_regex: str, gname: str | None) -> QueryResult:
         """在某个组中查找某些玩家，只要玩家名中含有 `player` 的片段，
         便会认为是查找目标。
         返回最晚查询时间和相关的服务器与玩家信息。
-        如果未找到则返回无意义的时间戳和None。
+        不在线时如果玩家名录中有记录，则返回 `last_seen` 的结果，
+        否则返回无意义的时间戳和None。
         """
         group = self.find_group(gname)
-        servers = group.servers.values()
-        stasks = await asyncio.gather(
-            *[self.query_pool.server_info(s.host, s.port) for s in servers]
-        )
-        ptasks = await asyncio.gather(
-            *[self.query_pool.players_info(s.host, s.port) for s in servers]
+        snap = await self.query_pool.snapshot(
+            [(s.host, s.port) for s in group.servers.values()], players=True
         )
         total = [
-            (max(qt1, qt2), sinfo, pinfo)
-            for (qt1, sinfo), (qt2, pinfo) in zip(stasks, ptasks)
+            (max(stamp), sinfo, pinfo)
+            for stamp, sinfo, pinfo in zip(snap.stamps, snap.servers, snap.players)
         ]
         total: list[tuple[float, ServerInfo, list[PlayerInfo]]]
         pat = re.compile(player_regex, re.IGNORECASE)
-        # index of total => player info
-        occursins: dict[int, list[PlayerInfo]] = {}
-        qtime = 0.0
-        for i, (qt, si, pi) in enumerate(total):
-            for p in pi:
-                # 忽略空白字符
-                if pat.search(WHITESPACE.sub("", p.name)):
-                    qtime = max(qtime, qt)
-                    if i not in occursins:
-                        occursins[i] = [p]
-                    else:
-                        occursins[i].append(p)
-        if len(occursins) == 0:
-            return QueryResult(tag="p", qtime=qtime, result=None)
-        pairs = [
-            ServerPair(server=total[i][1], players=p) for (i, p) in occursins.items()
+        qtime, pairs = match_players(pat, total)
+        if len(pairs) == 0:
+            # 不在线的玩家，查找玩家名录中的记录
+            seen = await self.last_seen(player_regex, gname, pattern=pat)
+            if seen.result is not None:
+                return seen
+            return QueryResult(tag="p", qtime=qtime, version=snap.version, result=None)
+        r = QueryResult(tag="p", qtime=qtime, version=snap.version, result=pairs)
+        return r
+
+    async def last_seen(
+        self,
+        name: str,
+        gname: str | None,
+        limit: int = 5,
+        pattern: re.Pattern | None = None,
+    ) -> QueryResult:
+        """在玩家名录中查找名称含有 name 的玩家最后一次出现在组内哪个服务器，
+        不产生网络查询。未启用玩家名录或找不到时 result 为 None。
+        给出 pattern 时与在线玩家的搜索一样按正则表达式匹配（忽略空白字符），
+        name 不含正则元字符时仍然经过全文索引。查找在玩家名录的线程中进行"""
+        group = self.find_group(gname)
+        directory = self.query_pool.directory
+        if directory is None:
+            return QueryResult(tag="ls", qtime=0.0, result=None)
+        peek = self.query_pool.resolver.peek
+        snames = {(peek(s.host), s.port): s.name for s in group.servers.values()}
+        if pattern is not None and re.escape(name) != name:
+            sightings = await directory.last_seen_matching(
+                lambda n: pattern.search(WHITESPACE.sub("", n)), set(snames), limit
+            )
+        else:
+            sightings = await directory.last_seen(name, set(snames), limit)
+        if len(sightings) == 0:
+            return QueryResult(tag="ls", qtime=0.0, result=None)
+        result = [
+            SeenInfo(
+                name=s.name,
+                server=snames[(s.host, s.port)],
+                first_seen=s.first_seen,
+                last_seen=s.last_seen,
+                duration=s.duration,
+            )
+            for s in sightings
+        ]
+        return QueryResult(tag="ls", qtime=sightings[0].last_seen, result=result)
+
+    def group_addresses(self) -> list[tuple[ServerGroup, list[tuple[str, int]]]]:
+        """各服务器组及组内服务器的地址，已解析的域名替换为 IP。
+        查询前先取得地址，查询过程中完成的域名解析不影响结果与服务器的对应关系"""
+        peek = self.query_pool.resolver.peek
+        return [
+            (g, [(peek(s.host), s.port) for s in g.servers.values()])
+            for g in self.server_group.values()
         ]
-        r = QueryResult(tag="p", qtime=qtime, result=pairs)
+
+    def unique_addresses(self) -> list[tuple[str, int]]:
+        """所有服务器组中出现过的服务器地址，同一 host:port 只出现一次，保持配置顺序。
+        已解析的域名替换为 IP，指向同一服务器的不同域名只出现一次"""
+        addrs = (a for _, gaddrs in self.group_addresses() for a in gaddrs)
+        return list(dict.fromkeys(addrs))
+
+    async def query_all_overview(self) -> QueryResult:
+        """查询所有服务器组的概况，每个地址只查询一次，
+        再按组分发结果，返回最晚查询时间和 `list[GroupResult]`"""
+        group_addrs = self.group_addresses()
+        addrs = list(dict.fromkeys(a for _, gaddrs in group_addrs for a in gaddrs))
+        results = await asyncio.gather(
+            *[self.query_pool.server_info(h, p) for h, p in addrs]
+        )
+        by_addr = dict(zip(addrs, results))
+        qtime = max((r[0] for r in results), default=0.0)
+        groups = []
+        for group, gaddrs in group_addrs:
+            sinfos = [by_addr[a][1] for a in gaddrs]
+            players = sum(s.players for s in sinfos)
+            groups.append(GroupResult(name=group.name, players=players, result=sinfos))
+        r = QueryResult(tag="ao", qtime=qtime, result=groups)
+        return r
+
+    async def search_player_all(self, player_regex: str) -> QueryResult:
+        """在所有服务器组中查找玩家，每个地址只查询一次，
+        再按组分发结果，返回最晚查询时间和 `list[GroupResult]`。
+        如果未找到则返回无意义的时间戳和None。
+        """
+        group_addrs = self.group_addresses()
+        addrs = list(dict.fromkeys(a for _, gaddrs in group_addrs for a in gaddrs))
+        stasks = await asyncio.gather(
+            *[self.query_pool.server_info(h, p) for h, p in addrs]
+        )
+        ptasks = await asyncio.gather(
+            *[self.query_pool.players_info(h, p) for h, p in addrs]
+        )
+        by_addr = {
+            addr: (max(qt1, qt2), sinfo, pinfo)
+            for addr, (qt1, sinfo), (qt2, pinfo) in zip(addrs, stasks, ptasks)
+        }
+        pat = re.compile(player_regex, re.IGNORECASE)
+        qtime = 0.0
+        groups = []
+        for group, gaddrs in group_addrs:
+            total = [by_addr[a] for a in gaddrs]
+            gqtime, pairs = match_players(pat, total)
+            if len(pairs) == 0:
+                continue
+            qtime = max(qtime, gqtime)
+            players = sum(len(p.players) for p in pairs)
+            groups.append(GroupResult(name=group.name, players=players, result=pairs))
+        if len(groups) == 0:
+            return QueryResult(tag="ap", qtime=qtime, result=None)
+        r = QueryResult(tag="ap", qtime=qtime, result=groups)
         return r
 
+    def group_samples(
+        self, gname: str | None, tier: str, since: float = 0.0
+    ) -> list[list[Sample]]:
+        """读取服务器组内每个服务器的历史记录，不产生网络查询"""
+        group = self.find_group(gname)
+        history = self.query_pool.history
+        peek = self.query_pool.resolver.peek
+        return [
+            history.samples(peek(s.host), s.port, tier, since)
+            for s in group.servers.values()
+        ]
+
+    def peak_hours(self, gname: str | None, since: float = 0.0) -> list[float]:
+        """统计服务器组在每天 0~23 时的平均总人数，下标即小时"""
+        return peak_hours(self.group_samples(gname, "hour", since))
+
+    def map_popularity(
+        self, gname: str | None, tier: str = "hour", since: float = 0.0
+    ) -> list[tuple[str, float]]:
+        """统计服务器组内各地图的“人·小时”数，按从多到少排序"""
+        samples = self.group_samples(gname, tier, since)
+        return map_popularity(samples, TIER_SECONDS[tier] or self.config.cache_delay)
+
+    def player_trend(
+        self, sname: str, gname: str | None, tier: str = "minute", since: float = 0.0
+    ) -> list[Sample]:
+        """读取某个服务器的人数、地图历史记录，按时间排序"""
+        server = self.find_server(sname, gname)
+        host = self.query_pool.resolver.peek(server.host)
+        return self.query_pool.history.samples(host, server.port, tier, since)
+
     async def query(self, gname: str | None, qstr: str) -> QueryResult:
         """根据 qstr 内容进行查询：
 
         1. qstr 是空字符串或“人数” - 调用 `query_servers_overview`
         2. qstr 是已知的服务器名 - 调用 `query_server_and_players`
-        3. qstr 是空格分隔的服务器名 - 调用 `query_server_and_players_multi`
-        4. qstr 是其它情况 - 调用 `search_player`
+        3. qstr 是服务器名加“规则” - 调用 `query_server_full`
+        4. qstr 是空格分隔的服务器名 - 调用 `query_server_and_players_multi`
+        5. qstr 是其它情况 - 调用 `search_player`
+
+        如果 gname 为 `ALL_GROUPS`，则只区分概况查询和玩家搜索，对所有服务器组进行查询。
         """
         qstr = qstr.strip()
+        if gname == ALL_GROUPS:
+            if self.qstr_pat_overview.fullmatch(qstr):
+                return await self.query_all_overview()
+            return await self.search_player_all(qstr)
         if self.qstr_pat_overview.fullmatch(qstr):
             return await self.query_servers_overview(gname)
         if self.qstr_pat_server_name.fullmatch(qstr):
             return await self.query_server_and_players(qstr, gname)
+        if m := self.qstr_pat_server_rules.fullmatch(qstr):
+            return await self.query_server_full(m[1], gname)
         # 先尝试是不是查询多个服务器
         if " " in qstr:
             # 忽略不认识的
@@ -264,8 +688,29 @@ class FancySourceQuery:
         self.t2g.fontsize = self.config.fontsize
 
 
+def match_players(
+    pat: re.Pattern, total: list[tuple[float, ServerInfo, list[PlayerInfo]]]
+) -> tuple[float, list[ServerPair]]:
+    """从 (查询时间, 服务器信息, 玩家信息) 列表中筛选名称匹配 pat 的玩家，
+    返回匹配到的玩家的最晚查询时间和按服务器归类的结果"""
+    # index of total => player info
+    occursins: dict[int, list[PlayerInfo]] = {}
+    qtime = 0.0
+    for i, (qt, si, pi) in enumerate(total):
+        for p in pi:
+            # 忽略空白字符
+            if pat.search(WHITESPACE.sub("", p.name)):
+                qtime = max(qtime, qt)
+                if i not in occursins:
+                    occursins[i] = [p]
+                else:
+                    occursins[i].append(p)
+    pairs = [ServerPair(server=total[i][1], players=p) for (i, p) in occursins.items()]
+    return qtime, pairs
+
+
 async def fmt_qresult(fsq: FancySourceQuery, r: QueryResult, qstr: str) -> str:
-    if r.tag == "p" and r.result is None:
+    if r.tag in ("p", "ap", "ls") and r.result is None:
         if r.result is None:
             return f"【{qstr}】不在哦~😥"
 
@@ -275,7 +720,7 @@ async def fmt_qresult(fsq: FancySourceQuery, r: QueryResult, qstr: str) -> str:
     else:
         body.append(fsq.ifmt.format(r.result))
     body.append("\n")
-    if isinstance(r.result, list):
+    if isinstance(r.result, list) and r.tag != "ls":
         players = 0
         for rr in r.result:
             if r.tag == "p":
@@ -284,6 +729,8 @@ async def fmt_qresult(fsq: FancySourceQuery, r: QueryResult, qstr: str) -> str:
                 players += rr.server.players
             elif isinstance(rr, ServerInfo):
                 players += rr.players
+            elif isinstance(rr, GroupResult):
+                players += rr.players
         tplayers = fsq.ifmt.fmt_players_count(players)
         body.append(tplayers)
     ttime = fsq.ifmt.fmt_query_time(r.qtime)
@@ -7,10 +7,47 @@
 """
 import asyncio
 import os
+import sys
 from argparse import ArgumentParser
 from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel
 
 from . import FancySourceQuery, QueryResult, fmt_qresult
+from .daemon import DaemonClient, DaemonServer
+from .image import CachedTextDrawer
+
+
+# 每次刷新缓存都会变化的字段，watch 模式判断结果是否变化时忽略：
+# 查询时间、快照版本、延迟、玩家的在线时长
+VOLATILE_FIELDS = {"qtime", "version", "ping", "duration"}
+
+
+def stable_fields(value: Any) -> Any:
+    """去掉 VOLATILE_FIELDS 后的结果，用于比较前后两次查询"""
+    if isinstance(value, dict):
+        return {
+            k: stable_fields(v) for k, v in value.items() if k not in VOLATILE_FIELDS
+        }
+    if isinstance(value, list):
+        return [stable_fields(v) for v in value]
+    return value
+
+
+class QueryRecord(BaseModel):
+    """一条查询的输出记录，用于 json / ndjson 输出
+
+    + group : 服务器组名
+    + qstr : 查询内容
+    + result : 查询结果，出错时为 None
+    + error : 出错信息，成功时为 None
+    """
+
+    group: str
+    qstr: str
+    result: QueryResult | None = None
+    error: str | None = None
 
 
 def cli_parser():
@@ -20,12 +57,143 @@ def cli_parser():
         usage="query source server's info",
         description="查询 Valve Source 服务器的信息和其中的玩家信息",
     )
-    p.add_argument("GROUP", help="服务器组名")
+    p.add_argument("GROUP", help="服务器组名", default=None, nargs="?")
     p.add_argument("QSTR", help="查询内容，可以是服务器名、“人数”、或玩家名", default="", nargs="?")
     p.add_argument("-c", default=None, help="设置工作目录，即加载配置文件的路径")
+    p.add_argument(
+        "-q",
+        "--query",
+        action="append",
+        nargs="+",
+        default=[],
+        metavar=("GROUP", "QSTR"),
+        help="追加一条查询，可以多次使用，所有查询共用一个查询池并发执行",
+    )
+    p.add_argument(
+        "-f",
+        "--file",
+        default=None,
+        help="从文件中读取查询，每行一条，格式同 -q，以 # 开头的行被忽略",
+    )
+    p.add_argument(
+        "-w",
+        "--watch",
+        type=float,
+        default=None,
+        metavar="INTERVAL",
+        help="每隔 INTERVAL 秒重复查询，只输出发生变化的结果",
+    )
+    p.add_argument(
+        "--daemon",
+        default=None,
+        metavar="SOCKET",
+        help="以守护进程模式运行，在 Unix socket SOCKET 上提供查询服务",
+    )
+    p.add_argument(
+        "--connect",
+        default=None,
+        metavar="SOCKET",
+        help="不在本进程中查询，而是交给 SOCKET 上的守护进程",
+    )
+    p.add_argument(
+        "-o",
+        "--output",
+        choices=["text", "json", "ndjson"],
+        default="text",
+        help="输出格式，watch 模式下 json 按 ndjson 输出",
+    )
     return p
 
 
+def collect_queries(args) -> list[tuple[str, str]]:
+    """汇总位置参数、-q 和 -f 指定的查询，返回 (组名, 查询内容) 列表"""
+    queries = []
+    if args.GROUP is not None:
+        queries.append((args.GROUP, args.QSTR))
+    for group, *qstr in args.query:
+        queries.append((group, " ".join(qstr)))
+    if args.file:
+        with open(args.file, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                group, _, qstr = line.partition(" ")
+                queries.append((group, qstr.strip()))
+    return queries
+
+
+async def run_queries(
+    app: FancySourceQuery | DaemonClient, queries: list[tuple[str, str]]
+) -> list[QueryRecord]:
+    """并发执行所有查询，单条查询出错不影响其它查询"""
+    results = await asyncio.gather(
+        *(app.query(group, qstr) for group, qstr in queries), return_exceptions=True
+    )
+    records = []
+    for (group, qstr), r in zip(queries, results):
+        if isinstance(r, Exception):
+            records.append(QueryRecord(group=group, qstr=qstr, error=repr(r)))
+        else:
+            records.append(QueryRecord(group=group, qstr=qstr, result=r))
+    return records
+
+
+async def fmt_record(
+    app: FancySourceQuery | DaemonClient, record: QueryRecord, header: bool
+) -> str:
+    """将一条查询记录格式化为文本，header 为真时在前面加上查询标题"""
+    if record.error is not None:
+        text = f"error: {record.error}"
+    elif isinstance(app, DaemonClient):
+        text = await app.fmt(record.result, record.qstr)
+    else:
+        text = await fmt_qresult(app, record.result, record.qstr)
+    if header:
+        text = f"# {record.group} {record.qstr}".rstrip() + f"\n{text}"
+    return text
+
+
+async def print_records(
+    app: FancySourceQuery | DaemonClient,
+    records: list[QueryRecord],
+    output: str,
+    header: bool,
+):
+    if output == "text":
+        for record in records:
+            print(await fmt_record(app, record, header))
+    elif output == "json":
+        print("[{}]".format(",".join(r.json() for r in records)))
+    else:
+        for record in records:
+            print(record.json())
+    sys.stdout.flush()
+
+
+async def watch(
+    app: FancySourceQuery | DaemonClient,
+    queries: list[tuple[str, str]],
+    interval: float,
+    output: str,
+):
+    """持续查询，每条查询只在结果（忽略 VOLATILE_FIELDS）变化时输出"""
+    if output == "json":
+        output = "ndjson"
+    last: dict[int, Any] = {}
+    while True:
+        records = await run_queries(app, queries)
+        changed = []
+        for i, record in enumerate(records):
+            key = stable_fields(record.dict())
+            if last.get(i) != key:
+                last[i] = key
+                changed.append(record)
+        if changed:
+            await print_records(app, changed, output, header=True)
+        await asyncio.sleep(interval)
+
+
 async def cli_main_async():
     p = cli_parser()
     args = p.parse_args()
@@ -33,16 +201,37 @@ async def cli_main_async():
     if args.c:
         cwd = Path(args.c).absolute().as_posix()
         os.chdir(cwd)
-    app = FancySourceQuery()
-    gname = args.GROUP
-    qstr = args.QSTR
-    qresult: QueryResult = await app.query(gname, qstr)
-    text = await fmt_qresult(app, qresult, qstr)
-    print(text)
+    if args.daemon:
+        app = FancySourceQuery()
+        app.update_config()
+        app.update_mapnames()
+        app.lazy_load_t2g(CachedTextDrawer())
+        await app.resolve_hosts()
+        await DaemonServer(app, args.daemon).serve()
+        return
+    queries = collect_queries(args)
+    if not queries:
+        p.error("at least one query is required")
+    if args.connect:
+        app = DaemonClient(args.connect)
+    else:
+        app = FancySourceQuery()
+        app.update_config()
+        app.update_mapnames()
+        await app.refresh_discovery()
+        await app.resolve_hosts()
+    if args.watch:
+        await watch(app, queries, args.watch, args.output)
+        return
+    records = await run_queries(app, queries)
+    await print_records(app, records, args.output, header=len(records) > 1)
 
 
 def cli_main():
-    asyncio.run(cli_main_async())
+    try:
+        asyncio.run(cli_main_async())
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""Fancy Source Query 的守护进程接口
+
+其它接口：
+
++ interfaces : Python 接口
++ nonebot : Nonebot 接口
++ cli : 命令行接口
+
+守护进程持有 `FancySourceQuery`（查询池、定时刷新、文本转图片），
+通过 Unix domain socket 对外提供查询，Nonebot 插件和命令行都可以作为轻量的客户端。
+
+协议：每一帧是 4 字节大端长度 + msgpack 数据，
+
++ 请求：`[id, method, args]`
++ 响应：`[id, error, result]`，成功时 error 为 None，
+    失败时 error 为 `[异常类型名, 异常参数]`
+
+同一个连接上可以同时发出多个请求，响应按完成顺序返回，由 id 对应。
+"""
+import asyncio
+import logging
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import msgpack
+
+from ..exceptions import DaemonError, ObjectNotFound
+from . import FancySourceQuery, QueryResult, fmt_qresult
+from .image import ImageEncoder
+
+FRAME_HEADER = struct.Struct("!I")
+# 单帧最大长度，防止异常数据耗尽内存
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# 直接转发给 FancySourceQuery 的查询方法，均返回 QueryResult
+QUERY_METHODS = {
+    "query",
+    "query_server",
+    "query_server_and_players",
+    "query_server_full",
+    "query_server_and_players_multi",
+    "query_addresses",
+    "query_servers_overview",
+    "query_all_overview",
+    "search_player",
+    "search_player_all",
+}
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Any | None:
+    """读取一帧并解码，连接关闭时返回 None"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        (size,) = FRAME_HEADER.unpack(header)
+        if size > MAX_FRAME_SIZE:
+            raise DaemonError("frame too large", size)
+        body = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+    return msgpack.unpackb(body, raw=False)
+
+
+def pack_frame(obj: Any) -> bytes:
+    body = msgpack.packb(obj, use_bin_type=True)
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+class DaemonServer:
+    """在 Unix domain socket 上提供 FancySourceQuery 的查询服务
+
+    + `serve`(async) : 开始服务，直到被取消
+    """
+
+    fsq: FancySourceQuery
+    path: str
+    # 文本转图片在单独的线程中进行，避免阻塞查询
+    _render_pool: ThreadPoolExecutor
+
+    def __init__(self, fsq: FancySourceQuery, path: str) -> None:
+        self.fsq = fsq
+        self.path = path
+        self._render_pool = ThreadPoolExecutor(max_workers=1)
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        logging.info(f"fsq daemon listening on {self.path!r}")
+        scheduler = asyncio.create_task(self.keep_warm())
+        discovering = asyncio.create_task(self.fsq.keep_discovering())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            scheduler.cancel()
+            discovering.cancel()
+            self.fsq.close_shards()
+            self._render_pool.shutdown(wait=False)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def keep_warm(self):
+        """定时查询所有服务器，使客户端的查询总能命中缓存，
+        配置了 query_shards 时由多个工作进程分片查询"""
+        while True:
+            for e in await self.fsq.poll_all():
+                logging.warning(f"daemon refresh failed: {e!r}")
+            await asyncio.sleep(self.fsq.config.cache_delay)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while (frame := await read_frame(reader)) is not None:
+                task = asyncio.create_task(self._dispatch(frame, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, DaemonError) as e:
+            logging.warning(f"daemon connection dropped: {e!r}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _dispatch(
+        self, frame: list, writer: asyncio.StreamWriter, lock: asyncio.Lock
+    ):
+        rid, method, args = frame
+        try:
+            result = await self.call(method, args)
+            response = [rid, None, result]
+        except Exception as e:
+            logging.exception(f"daemon call {method!r} failed")
+            response = [rid, [type(e).__name__, [str(a) for a in e.args]], None]
+        async with lock:
+            writer.write(pack_frame(response))
+            await writer.drain()
+
+    async def call(self, method: str, args: list) -> Any:
+        if method in QUERY_METHODS:
+            r: QueryResult = await getattr(self.fsq, method)(*args)
+            return r.dict()
+        elif method == "fmt":
+            qresult, qstr = args
+            return await fmt_qresult(self.fsq, QueryResult.parse_obj(qresult), qstr)
+        elif method == "render":
+            (text,) = args
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._render_pool, self._render, text)
+        elif method == "reload":
+            self.fsq.update_config()
+            self.fsq.update_mapnames()
+            await self.fsq.refresh_discovery()
+            await self.fsq.resolve_hosts()
+            return None
+        raise DaemonError("unknown method", method)
+
+    def _render(self, text: str) -> bytes:
+        return ImageEncoder(self.fsq.config.image).encode(self.fsq.t2g.draw(text))
+
+
+class DaemonClient:
+    """守护进程的客户端，查询方法与 FancySourceQuery 同名，返回 QueryResult。
+    首次调用时才连接，守护进程重启后自动重连。
+
+    + `fmt`(async) : 在守护进程中格式化查询结果
+    + `render`(async) : 在守护进程中将文本转换成图片，按守护进程的 image 配置编码
+    + `reload`(async) : 让守护进程重新加载配置和地图数据
+    """
+
+    path: str
+    _reader: asyncio.StreamReader | None
+    _writer: asyncio.StreamWriter | None
+    _pending: dict[int, asyncio.Future]
+    _next_id: int
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._pending = dict()
+        self._next_id = 0
+        self._connect_lock = asyncio.Lock()
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            self._reader, self._writer = reader, writer
+            asyncio.create_task(self._read_responses(reader))
+
+    async def _read_responses(self, reader: asyncio.StreamReader):
+        try:
+            while (frame := await read_frame(reader)) is not None:
+                rid, error, result = frame
+                fut = self._pending.pop(rid, None)
+                if fut is None or fut.done():
+                    continue
+                if error is None:
+                    fut.set_result(result)
+                elif error[0] == ObjectNotFound.__name__:
+                    fut.set_exception(ObjectNotFound(*error[1]))
+                elif error[0] == re.error.__name__:
+                    # 玩家搜索的正则表达式有误
+                    fut.set_exception(re.error(*error[1][:1]))
+                else:
+                    fut.set_exception(DaemonError(*error))
+        except (ConnectionError, DaemonError) as e:
+            logging.warning(f"daemon connection dropped: {e!r}")
+        finally:
+            self._writer = None
+            pending, self._pending = self._pending, dict()
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(DaemonError("daemon connection closed"))
+
+    async def call(self, method: str, *args) -> Any:
+        await self._connect()
+        rid = self._next_id
+        self._next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        self._writer.write(pack_frame([rid, method, list(args)]))
+        await self._writer.drain()
+        return await fut
+
+    async def _query(self, method: str, *args) -> QueryResult:
+        return QueryResult.parse_obj(await self.call(method, *args))
+
+    async def query(self, gname: str | None, qstr: str) -> QueryResult:
+        return await self._query("query", gname, qstr)
+
+    async def query_servers_overview(self, gname: str | None) -> QueryResult:
+        return await self._query("query_servers_overview", gname)
+
+    async def query_server_and_players(
+        self, sname: str, gname: str | None
+    ) -> QueryResult:
+        return await self._query("query_server_and_players", sname, gname)
+
+    async def query_server_full(self, sname: str, gname: str | None) -> QueryResult:
+        return await self._query("query_server_full", sname, gname)
+
+    async def query_all_overview(self) -> QueryResult:
+        return await self._query("query_all_overview")
+
+    async def query_addresses(
+        self, addrs: list[tuple[str, int]], players: bool
+    ) -> QueryResult:
+        return await self._query("query_addresses", addrs, players)
+
+    async def search_player(self, player_regex: str, gname: str | None) -> QueryResult:
+        return await self._query("search_player", player_regex, gname)
+
+    async def search_player_all(self, player_regex: str) -> QueryResult:
+        return await self._query("search_player_all", player_regex)
+
+    async def fmt(self, r: QueryResult, qstr: str) -> str:
+        return await self.call("fmt", r.dict(), qstr)
+
+    async def render(self, text: str) -> bytes:
+        return await self.call("render", text)
+
+    async def reload(self):
+        await self.call("reload")
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,293 @@
+"""查询结果图片的编码工具，不依赖 Nonebot，供 nonebot 接口和守护进程共用
+
++ `ImageEncoder` : 按配置编码图片，记录编码耗时和体积
++ `ImageStore` : 将编码后的图片保存为文件，供 file / http 方式发送
++ `paginate` : 将过长的文本分页，每页单独渲染
++ `CachedTextDrawer` : 缓存每行渲染结果的文本转图片引擎
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter, time
+from typing import Callable
+
+from PIL import Image, ImageDraw, ImageFont
+
+from impaper import SimpleTextDrawer
+
+from ..config import ImageConfig
+
+# ImageStore 中的文件名：摘要 + 扩展名
+IMAGE_NAME = re.compile(r"^[0-9a-f]{32}\.(?:png|webp)$")
+
+
+def paginate(lines: list[str], page_lines: int, max_pages: int) -> list[str]:
+    """将折行后的文本按每页 page_lines 行分页，最多 max_pages 页，
+    超出的部分被截断，并在最后一页末尾注明"""
+    page_lines, max_pages = max(1, page_lines), max(1, max_pages)
+    pages = [
+        "\n".join(lines[i : i + page_lines]) for i in range(0, len(lines), page_lines)
+    ]
+    if len(pages) > max_pages:
+        omitted = len(lines) - page_lines * max_pages
+        pages = pages[:max_pages]
+        pages[-1] += f"\n……还有 {omitted} 行未显示"
+    return pages
+
+
+class ImageEncoder:
+    """按配置编码图片
+
+    文字图片只有背景色、文字颜色和抗锯齿产生的少量中间色，
+    转换成调色板或黑白图片后体积小得多，压缩也快得多。
+    """
+
+    conf: ImageConfig
+
+    def __init__(self, conf: ImageConfig | None = None) -> None:
+        self.conf = conf or ImageConfig()
+
+    @property
+    def suffix(self) -> str:
+        return f".{self.conf.format}"
+
+    def convert(self, im: Image.Image) -> Image.Image:
+        if self.conf.mode == "palette":
+            # FASTOCTREE 比默认的中位切分快数倍，对颜色很少的图片效果相同
+            return im.convert("RGB").quantize(
+                self.conf.colors, method=Image.Quantize.FASTOCTREE
+            )
+        elif self.conf.mode == "1bit":
+            return im.convert("1")
+        return im
+
+    def encode(self, im: Image.Image) -> bytes:
+        start = perf_counter()
+        im = self.convert(im)
+        with BytesIO() as buf:
+            if self.conf.format == "webp":
+                im.save(
+                    buf,
+                    format="webp",
+                    lossless=self.conf.webp_lossless,
+                    quality=self.conf.webp_quality,
+                )
+            else:
+                im.save(buf, format="png", compress_level=self.conf.compress_level)
+            data = buf.getvalue()
+        logging.info(
+            f"encode {im.size[0]}x{im.size[1]} {self.conf.mode} {self.conf.format}: "
+            f"{len(data)} bytes in {(perf_counter() - start) * 1000:.1f}ms"
+        )
+        return data
+
+
+class ImageStore:
+    """以内容摘要为文件名保存图片，保存时每隔 PRUNE_INTERVAL 秒删除一次超过保留时间的文件
+
+    + `save` : 保存图片，返回文件名，会读写磁盘，应当在线程池中调用
+    + `path` : 根据文件名返回文件路径，文件名不合法或文件不存在时返回 None
+    """
+
+    directory: Path
+    keep_seconds: float
+    # 上次清理过期文件的时间
+    pruned_at: float
+
+    def __init__(self, directory: str, keep_seconds: float) -> None:
+        self.directory = Path(directory).absolute()
+        self.keep_seconds = keep_seconds
+        self.pruned_at = 0.0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def save(self, data: bytes, suffix: str) -> str:
+        if time() - self.pruned_at > min(PRUNE_INTERVAL, self.keep_seconds):
+            self.pruned_at = time()
+            self.prune()
+        name = blake2b(data, digest_size=16).hexdigest() + suffix
+        path = self.directory / name
+        try:
+            # 再次保存同一图片时刷新修改时间，刚发出的图片不会被清理
+            os.utime(path)
+        except FileNotFoundError:
+            # 临时文件名各不相同，多个线程同时保存同一图片时互不影响
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return name
+
+    def path(self, name: str) -> Path | None:
+        if not IMAGE_NAME.fullmatch(name):
+            return None
+        path = self.directory / name
+        return path if path.exists() else None
+
+    def prune(self):
+        """删除过期的图片，以及异常退出时遗留的临时文件"""
+        deadline = time() - self.keep_seconds
+        for path in self.directory.iterdir():
+            try:
+                if (
+                    IMAGE_NAME.fullmatch(path.name) or path.suffix == ".tmp"
+                ) and path.stat().st_mtime < deadline:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# 两次清理 ImageStore 中过期文件的最短间隔（秒）
+PRUNE_INTERVAL = 60.0
+# 一行或一个字的渲染结果：(字形遮罩, 相对起点的 x 偏移, y 偏移)，空白的遮罩为 None
+LineMask = tuple[Image.Image | None, int, int]
+# 一个字的渲染结果和步进宽度
+GlyphMask = tuple[Image.Image | None, int, int, float]
+
+
+class LineCache:
+    """行和字形渲染结果的缓存，可以在多个线程的 CachedTextDrawer 之间共享
+
+    + 行内容 => LineMask，LRU，最多 size 行
+    + 字符 => GlyphMask，字符集很小，不限数量
+
+    只保存当前字体（路径, 字号）的结果，字体变化时清空。
+    """
+
+    size: int
+    font: tuple[str, int] | None
+    hits: int
+    misses: int
+    glyphs: dict[str, GlyphMask]
+    _lines: OrderedDict[str, LineMask]
+
+    def __init__(self, size: int = 4096) -> None:
+        self.size = size
+        self.font = None
+        self.hits = 0
+        self.misses = 0
+        self.glyphs = dict()
+        self._lines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _switch(self, font: tuple[str, int]):
+        """字体变化时清空缓存，调用时应持有锁"""
+        if font != self.font:
+            self._lines.clear()
+            self.glyphs = dict()
+            self.font = font
+
+    def get(
+        self, font: tuple[str, int], line: str, render: Callable[[str], LineMask]
+    ) -> LineMask:
+        with self._lock:
+            self._switch(font)
+            mask = self._lines.get(line, None)
+            if mask is not None:
+                self._lines.move_to_end(line)
+                self.hits += 1
+                return mask
+        # 渲染时不持有锁，其它线程可以同时读取缓存
+        mask = render(line)
+        with self._lock:
+            self.misses += 1
+            if font == self.font:
+                self._lines[line] = mask
+                if len(self._lines) > self.size:
+                    self._lines.popitem(last=False)
+        return mask
+
+    def glyph(
+        self, font: tuple[str, int], char: str, render: Callable[[str], GlyphMask]
+    ) -> GlyphMask:
+        """与 `get` 相同，缓存单字的渲染结果"""
+        with self._lock:
+            self._switch(font)
+            glyph = self.glyphs.get(char, None)
+            if glyph is not None:
+                return glyph
+        glyph = render(char)
+        with self._lock:
+            # 渲染期间字体变化时，不把旧字体的字形放进新字体的缓存
+            if font == self.font:
+                self.glyphs[char] = glyph
+        return glyph
+
+
+class CachedTextDrawer(SimpleTextDrawer):
+    """缓存渲染结果的 SimpleTextDrawer，输出与 SimpleTextDrawer 相同
+
+    回复中很多行是重复的（服务器标题、模板前缀、分隔线等），字符集也很小。
+    每行只渲染一次字形遮罩，之后绘制时按遮罩把文字颜色贴到画布上；
+    新的行由缓存的单字遮罩拼成，每个字只用 FreeType 渲染一次。
+    只有在 basic 排版引擎、步进宽度为整数（例如默认的等宽字体）时才拼字，
+    否则整行交给 FreeType 渲染，保证输出不变。
+    """
+
+    cache: LineCache
+
+    def __init__(self, cache: LineCache | None = None) -> None:
+        super().__init__()
+        self.cache = cache if cache is not None else LineCache()
+
+    def render_text(self, text: str) -> LineMask:
+        font = self.font
+        left, top, right, bottom = font.getbbox(text)
+        if right <= left or bottom <= top:
+            return (None, 0, 0)
+        mask = Image.new("L", (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, fill=0xFF, font=font)
+        return (mask, left, top)
+
+    def render_glyph(self, char: str) -> GlyphMask:
+        return (*self.render_text(char), self.font.getlength(char))
+
+    def glyph(self, char: str) -> GlyphMask:
+        font = (self.conf.font.path, self.fontsize)
+        return self.cache.glyph(font, char, self.render_glyph)
+
+    def render_line(self, line: str) -> LineMask:
+        if self.font.layout_engine != ImageFont.Layout.BASIC:
+            return self.render_text(line)
+        placed = []
+        pen = 0
+        for char in line:
+            mask, dx, dy, advance = self.glyph(char)
+            if not advance.is_integer():
+                return self.render_text(line)
+            if mask is not None:
+                placed.append((mask, pen + dx, dy))
+            pen += int(advance)
+        if not placed:
+            return (None, 0, 0)
+        left = min(x for _, x, _ in placed)
+        top = min(y for _, _, y in placed)
+        right = max(x + m.width for m, x, _ in placed)
+        bottom = max(y + m.height for m, _, y in placed)
+        canvas = Image.new("L", (right - left, bottom - top), 0)
+        for mask, x, y in placed:
+            x, y = x - left, y - top
+            canvas.paste(0xFF, (x, y, x + mask.width, y + mask.height), mask)
+        return (canvas, left, top)
+
+    def draw(self, text: str) -> Image.Image:
+        lines = self.ts.wrap_text(text)
+        canvas_size = self.canvas_size(self._text_size_list(lines))
+        canvas = Image.new("L", canvas_size, self.bg_color)
+        left, up = self.text_position()
+        _, fh = self.fontbox_size()
+        spacing = self.conf.layout.spacing
+        font = (self.conf.font.path, self.fontsize)
+        for i, line in enumerate(lines):
+            mask, dx, dy = self.cache.get(font, line, self.render_line)
+            if mask is None:
+                continue
+            x = left + dx
+            y = up + fh * i + i * spacing + dy
+            canvas.paste(self.fg_color, (x, y, x + mask.width, y + mask.height), mask)
+        return canvas
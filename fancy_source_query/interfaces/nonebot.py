@@ -4,15 +4,18 @@
 
 + interfaces : Python 接口
 + cli : 命令行接口
++ web : HTTP 接口
 """
+import asyncio
 import logging
 import re
+import threading
 from base64 import b64encode
-from io import BytesIO
-from random import shuffle
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
 import exrex
-from nonebot import get_driver, on_command
+from nonebot import get_bot, get_driver, on_command
 from nonebot.adapters.onebot.v11 import (
     GROUP_ADMIN,
     GROUP_OWNER,
@@ -21,26 +24,78 @@ from nonebot.adapters.onebot.v11 import (
     Message,
     MessageSegment,
 )
+from nonebot.drivers.fastapi import Driver as FastAPIDriver
 from nonebot.exception import ActionFailed
+from nonebot.matcher import Matcher
 from nonebot.params import CommandArg
 from nonebot.permission import SUPERUSER
 from nonebot.rule import to_me
-from PIL.Image import Image
 
 from impaper import SimpleTextDrawer
 
+from ..coalesce import Coalescer, RateLimiter, SessionDebouncer
 from ..config import NonebotConfig
-from . import FancySourceQuery, QueryResult, ServerInfo, ServerPair, fmt_qresult
+from ..map_pool import CUSTOM, OFFICIAL
+from ..profiling import MemoryTracer, sample_for
+from ..subscription import Subscription, SubscriptionManager
+from . import (
+    ALL_GROUPS,
+    FancySourceQuery,
+    QueryResult,
+    ServerInfo,
+    ServerPair,
+    fmt_qresult,
+)
+from .daemon import DaemonClient
+from .image import CachedTextDrawer, ImageEncoder, ImageStore, paginate
+from .web import setup_images, setup_web
 
 _global_config = get_driver().config
 _nonebot_config = NonebotConfig.parse_obj(_global_config)
 FSQ = FancySourceQuery()
 FSQ.update_config(_nonebot_config.fancy_source_query_config)
-FSQ.lazy_load_t2g(SimpleTextDrawer())
+FSQ.lazy_load_t2g(CachedTextDrawer())
+SUBSCRIPTIONS = SubscriptionManager(FSQ.config.subscription_path)
+# 配置了守护进程时，查询、格式化和文本转图片都交给守护进程
+DAEMON = DaemonClient(FSQ.config.daemon_socket) if FSQ.config.daemon_socket else None
+BACKEND: FancySourceQuery | DaemonClient = DAEMON if DAEMON is not None else FSQ
+
+ENCODER = ImageEncoder(FSQ.config.image)
+# 图片的发送方式在启动时确定，刷新配置只影响编码参数
+DELIVERY = FSQ.config.image.delivery
+# 以文件或 http 方式发送图片时保存图片
+IMAGES: ImageStore | None = None
+# 本地渲染图片的线程池，每个线程使用自己的 TextDrawer，共用行和字形缓存
+RENDER_POOL = ThreadPoolExecutor(
+    max_workers=max(1, FSQ.config.render_workers), thread_name_prefix="fsq-render"
+)
+_render_local = threading.local()
+
+if FSQ.config.http_api:
+    if isinstance(get_driver(), FastAPIDriver):
+        setup_web(FSQ, get_driver().server_app, FSQ.config.http_prefix, BACKEND)
+    else:
+        logging.warning("http_api needs nonebot's fastapi driver, skipped.")
+if DELIVERY != "base64":
+    IMAGES = ImageStore(FSQ.config.image.directory, FSQ.config.image.keep_seconds)
+    if DELIVERY == "http":
+        if isinstance(get_driver(), FastAPIDriver):
+            setup_images(IMAGES, get_driver().server_app, FSQ.config.http_prefix)
+        else:
+            logging.warning("image delivery via http needs fastapi driver, use file.")
+            DELIVERY = "file"
 
 ALL_ADMINS = SUPERUSER | GROUP_OWNER | GROUP_ADMIN
 
 query = on_command("query", aliases=set(exrex.generate("查[查询]?")), rule=to_me())
+query_all = on_command(
+    "query_all",
+    aliases={
+        "查询全部",
+    },
+    rule=to_me(),
+    permission=SUPERUSER,
+)
 refresh = on_command(
     "refresh",
     aliases={
@@ -55,87 +110,364 @@ choose_map = on_command(
     rule=to_me(),
     permission=ALL_ADMINS,
 )
+subscribe = on_command("subscribe", aliases={"订阅"}, rule=to_me())
+unsubscribe = on_command("unsubscribe", aliases={"取消订阅"}, rule=to_me())
+profile = on_command("profile", aliases={"性能分析"}, rule=to_me(), permission=SUPERUSER)
+memprofile = on_command(
+    "memprofile", aliases={"内存分析"}, rule=to_me(), permission=SUPERUSER
+)
 __RE_CQAT = re.compile(r"\[CQ:at,qq=([1-9]([0-9]{4,}))\]")
 __RE_SESSION = re.compile(r"group_([1-9]([0-9]{4,}))_([1-9]([0-9]{4,}))")
 __RE_COUNTS = re.compile(r"(\d+)[张]?")
+__SUBSCRIPTION_KINDS = {"玩家": "player", "满人": "full", "换图": "map"}
+# 性能分析的默认和最长采样时间，s
+__PROFILE_SECONDS = (10.0, 60.0)
+__PROFILING = asyncio.Lock()
+MEMORY = MemoryTracer()
+# 合并重复的查询，限制每个会话的查询频率
+REPLIES = Coalescer(FSQ.config.reply_coalesce_window)
+DEBOUNCER = SessionDebouncer()
+RATE_LIMITER = RateLimiter(FSQ.config.rate_limit, FSQ.config.rate_limit_period)
+
+
+class Reply(NamedTuple):
+    """渲染好的回复，可以发送给多个会话：
+    text 为文本或单张图片的 CQ 码，pages 不为空时为分页图片的 CQ 码"""
+
+    text: str
+    pages: list[str]
 
 
 @query.handle()
 async def _query(bot: Bot, ev: Event, qstr: Message = CommandArg()):
-    """自动根据群号加载服务器组"""
+    """自动根据群号加载服务器组
+
+    同一群组中相同的查询共享查询、格式化和渲染的结果；
+    同一会话中相同的查询在回复发出前只回复一次，回复发出前到达的请求者一起 @"""
+    session, user, private = parse_session(ev)
+    if not RATE_LIMITER.allow(session):
+        logging.info(f"query from {session} rate limited.")
+        # 每个限流周期只提示一次，避免提示本身刷屏
+        if RATE_LIMITER.warn(session):
+            await query.finish("查询太频繁了，请稍后再试~")
+        await query.finish()
+    gname = FSQ.find_gname_from_session(session)
+    maybe_at = " ".join(str(qstr).split())
+    if __RE_CQAT.fullmatch(maybe_at):
+        # 群名片因群而异，只在同一个群内共享
+        key = (gname, session, maybe_at)
+    else:
+        key = (gname, maybe_at)
+    session_key = (session, *key)
+    if not DEBOUNCER.join(session_key, user):
+        await query.finish()
+    try:
+        reply = await REPLIES.get(
+            key, lambda: _build_query_reply(bot, session, gname, maybe_at)
+        )
+    except BaseException:
+        DEBOUNCER.discard(session_key)
+        raise
+    users = DEBOUNCER.finish(session_key)
+    await send_reply(query, bot, session, users, private, reply)
+
+
+async def _build_query_reply(bot: Bot, session: str, gname: str, qstr: str) -> Reply:
+    if m := __RE_CQAT.fullmatch(qstr):
+        target_qq = m[1]
+        name = await get_group_member_name(bot, session, target_qq)
+        qresult: QueryResult = await search_user_by_qq_name(gname, name)
+        qstr = name
+    else:
+        qresult: QueryResult = await BACKEND.query(gname, qstr)
+    text = await fmt_text(qresult, qstr)
+    return await build_reply(text)
+
+
+@query_all.handle()
+async def _query_all(bot: Bot, ev: Event, qstr: Message = CommandArg()):
+    """查询所有服务器组，相同地址的服务器只查询一次"""
+    session, user, private = parse_session(ev)
+    qstr = str(qstr).strip()
+    qresult: QueryResult = await BACKEND.query(ALL_GROUPS, qstr)
+    text = await fmt_text(qresult, qstr)
+    await reply_text(query_all, bot, session, user, private, text)
+
+
+def parse_session(ev: Event) -> tuple[str, str, bool]:
+    """解析会话，返回 (群号或私聊QQ号, 发送者QQ号, 是否私聊)"""
     session = ev.get_session_id()
     logging.debug(f"{session=!r}")
     m = __RE_SESSION.fullmatch(session)
     if m:
         # 群聊环境
-        session = m[1]
-        user = ev.get_user_id()
-        private = False
+        return m[1], ev.get_user_id(), False
     else:
         # 私聊环境
-        session = ev.get_user_id()
-        user = ev.get_user_id()
-        private = True
-    gname = FSQ.find_gname_from_session(session)
-    maybe_at = str(qstr).strip()
-    if m := __RE_CQAT.fullmatch(maybe_at):
-        target_qq = m[1]
-        name = await get_group_member_name(bot, session, target_qq)
-        qresult: QueryResult = await search_user_by_qq_name(gname, name)
-        qstr = name
-    else:
-        qresult: QueryResult = await FSQ.query(gname, str(qstr))
-    text = await fmt_qresult(FSQ, qresult, qstr)
+        return ev.get_user_id(), ev.get_user_id(), True
+
+
+async def build_reply(text: str) -> Reply:
+    """将查询结果转换成回复，过长的文本转成图片，图片也过长时分页渲染"""
     lines = text.count("\n")
+    if lines > FSQ.config.output_max_lines * 2:
+        images = [await image2cqcode(b) for b in await render_pages(text)]
+        logging.info(
+            f"build {len(images)} pages, cq code length = {sum(map(len, images))}."
+        )
+        return Reply("", images)
     if lines > FSQ.config.output_max_lines:
-        im = FSQ.t2g.draw(text)
-        text = im2cqcode(im)
+        text = await image2cqcode(await render_image(text))
         logging.info(f"build image, cq code length = {len(text)}.")
     else:
         # 以文本模式输出时去除标签
         t2g: SimpleTextDrawer = FSQ.t2g
         text = t2g._labels_re.sub("", text)
-    if private:
-        msg = Message(text)
-    else:
-        if lines > FSQ.config.output_max_lines * 2:
-            # 即便转成图片也很长，则收集到合并转发消息中
-            at_ = Message(f"[CQ:at,qq={user}]\n图片太长，收到合并转发里了")
+    return Reply(text, [])
+
+
+async def send_reply(
+    matcher: type[Matcher],
+    bot: Bot,
+    session: str,
+    users: list[str],
+    private: bool,
+    reply: Reply,
+):
+    """发送回复，群聊中 @ 所有请求者，分页图片作为合并转发消息的节点发送"""
+    at_ = "".join(f"[CQ:at,qq={user}]" for user in users)
+    if reply.pages:
+        if private:
+            msg = Message("".join(reply.pages))
+        else:
             msg = Message(
-                MessageSegment.node_custom(user_id=user, nickname="这谁？", content=text)
+                [
+                    MessageSegment.node_custom(
+                        user_id=users[0], nickname="这谁？", content=image
+                    )
+                    for image in reply.pages
+                ]
             )
-            await query.send(at_)
+            await matcher.send(Message(f"{at_}\n图片太长，收到合并转发里了"))
             await bot.send_group_forward_msg(group_id=int(session), messages=msg)
             return
-        else:
-            msg = Message(f"[CQ:at,qq={user}]\n{text}")
+    elif private:
+        msg = Message(reply.text)
+    else:
+        msg = Message(f"{at_}\n{reply.text}")
 
     try:
-        await query.finish(msg)
+        await matcher.finish(msg)
     except ActionFailed:
-        logging.error(f"message send failed: {text[:100]!r}")
-        await query.finish()
+        logging.error(f"message send failed: {reply.text[:100]!r}")
+        await matcher.finish()
     return
 
 
+async def reply_text(
+    matcher: type[Matcher],
+    bot: Bot,
+    session: str,
+    user: str,
+    private: bool,
+    text: str,
+):
+    """回复查询结果，过长的文本转成图片，
+    图片也过长时分页渲染，每页作为合并转发消息的一个节点"""
+    reply = await build_reply(text)
+    await send_reply(matcher, bot, session, [user], private, reply)
+
+
+@subscribe.handle()
+async def _subscribe(bot: Bot, ev: Event, arg: Message = CommandArg()):
+    """订阅 玩家/满人/换图 [目标]，不带参数时列出当前会话的订阅"""
+    session, user, private = parse_session(ev)
+    gname = FSQ.find_gname_from_session(session) or FSQ.config.default_server_group
+    kind, _, target = str(arg).strip().partition(" ")
+    target = target.strip()
+    if not kind:
+        subs = SUBSCRIPTIONS.of_session(session)
+        if not subs:
+            await subscribe.finish("还没有订阅哦~")
+        kinds = {v: k for k, v in __SUBSCRIPTION_KINDS.items()}
+        lines = [
+            f"{i}. [{s.group}]{kinds[s.kind]} {s.target}".rstrip()
+            for i, s in enumerate(subs)
+        ]
+        await subscribe.finish("\n".join(lines))
+    if kind not in __SUBSCRIPTION_KINDS:
+        await subscribe.finish("订阅类型只能是：玩家、满人、换图")
+    kind = __SUBSCRIPTION_KINDS[kind]
+    if kind == "player":
+        if not target:
+            await subscribe.finish("要订阅哪个玩家？")
+        try:
+            re.compile(target)
+        except re.error:
+            await subscribe.finish("玩家名不是合法的正则表达式")
+    elif target and target not in FSQ.find_group(gname).servers:
+        await subscribe.finish(f"服务器组 {gname} 里没有 {target}")
+    if (
+        len(SUBSCRIPTIONS.of_session(session))
+        >= FSQ.config.subscription_max_per_session
+    ):
+        await subscribe.finish("订阅太多了，先取消一些吧")
+    SUBSCRIPTIONS.add(
+        Subscription(
+            kind=kind, session=session, private=private, group=gname, target=target
+        )
+    )
+    await subscribe.finish("订阅成功")
+
+
+@unsubscribe.handle()
+async def _unsubscribe(bot: Bot, ev: Event, arg: Message = CommandArg()):
+    """取消订阅 [编号]，不带编号时取消当前会话的全部订阅"""
+    session, user, private = parse_session(ev)
+    arg = str(arg).strip()
+    index = int(arg) if arg.isdigit() else None
+    n = SUBSCRIPTIONS.remove(session, index)
+    await unsubscribe.finish(f"已取消 {n} 条订阅")
+
+
+async def push_notice(session: str, private: bool, text: str):
+    """推送订阅通知"""
+    bot: Bot = get_bot()
+    try:
+        if private:
+            await bot.send_private_msg(user_id=int(session), message=text)
+        else:
+            await bot.send_group_msg(group_id=int(session), message=text)
+    except ActionFailed:
+        logging.error(f"notice send failed: {text[:100]!r}")
+    except ValueError:
+        logging.warning("no bot connected, notice dropped.")
+
+
+_background_tasks: set[asyncio.Task] = set()
+_warmup_task: asyncio.Task | None = None
+
+
+@get_driver().on_startup
+async def _resolve_hosts():
+    # 在后台解析，启动不等待 DNS；同一主机名的解析与预热中的查询共用
+    _background_tasks.add(asyncio.create_task(FSQ.resolve_hosts()))
+
+
+@get_driver().on_startup
+async def _start_subscription_poller():
+    task = asyncio.create_task(
+        SUBSCRIPTIONS.run(FSQ, push_notice, FSQ.config.subscription_interval, DAEMON)
+    )
+    _background_tasks.add(task)
+
+
+@get_driver().on_startup
+async def _start_discovery():
+    # 配置了守护进程时由守护进程发现服务器，本进程只需要会话和组的对应关系
+    if DAEMON is None:
+        _background_tasks.add(asyncio.create_task(FSQ.keep_discovering()))
+
+
+@get_driver().on_startup
+async def _start_warmup():
+    start_warmup()
+
+
+def start_warmup():
+    """在后台预热缓存，不阻塞启动和刷新配置；再次调用时取消尚未完成的预热"""
+    global _warmup_task
+    # 配置了守护进程时由守护进程保持缓存常热
+    if DAEMON is not None or not FSQ.config.warmup:
+        return
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+        _background_tasks.discard(_warmup_task)
+    _warmup_task = asyncio.create_task(FSQ.warm_up(RATE_LIMITER.active()))
+    _background_tasks.add(_warmup_task)
+
+
+@get_driver().on_shutdown
+async def _stop_background_tasks():
+    for task in _background_tasks:
+        task.cancel()
+    RENDER_POOL.shutdown(wait=False)
+    FSQ.close_shards()
+
+
 @refresh.handle()
 async def _refresh(bot: Bot, ev: Event, item: Message = CommandArg()):
     item = str(item).strip()
+    if DAEMON is not None:
+        await DAEMON.reload()
     if item == "配置":
         FSQ.update_config()
+        update_runtime_config()
+        await refresh_discovery()
+        await FSQ.resolve_hosts()
+        start_warmup()
         await refresh.finish("已刷新配置")
     elif item == "地图数据":
         FSQ.update_mapnames()
         await refresh.finish("已刷新地图数据")
     else:
         FSQ.update_config()
+        update_runtime_config()
         FSQ.update_mapnames()
+        await refresh_discovery()
+        await FSQ.resolve_hosts()
+        start_warmup()
         await refresh.finish("已刷新配置和地图数据")
 
 
+def update_runtime_config():
+    """刷新配置后更新编码参数、合并窗口和限流参数"""
+    ENCODER.conf = FSQ.config.image
+    REPLIES.window = FSQ.config.reply_coalesce_window
+    RATE_LIMITER.limit = FSQ.config.rate_limit
+    RATE_LIMITER.period = FSQ.config.rate_limit_period
+
+
+async def refresh_discovery():
+    if DAEMON is None:
+        await FSQ.refresh_discovery()
+
+
+@profile.handle()
+async def _profile(bot: Bot, ev: Event, arg: Message = CommandArg()):
+    """性能分析 [秒数]：采样所有线程（包括事件循环和渲染线程）的调用栈，报告热点函数"""
+    session, user, private = parse_session(ev)
+    default, longest = __PROFILE_SECONDS
+    try:
+        seconds = min(float(str(arg).strip() or default), longest)
+    except ValueError:
+        await profile.finish("采样时间应当是秒数")
+    if __PROFILING.locked():
+        await profile.finish("已经在采样了")
+    async with __PROFILING:
+        await profile.send(f"开始采样 {seconds:g}s")
+        report = await sample_for(seconds)
+    await reply_text(profile, bot, session, user, private, report)
+
+
+@memprofile.handle()
+async def _memprofile(bot: Bot, ev: Event, arg: Message = CommandArg()):
+    """内存分析 [停止]：第一次执行时开始追踪内存分配，之后每次执行报告一次快照"""
+    session, user, private = parse_session(ev)
+    if str(arg).strip() == "停止":
+        MEMORY.stop()
+        await memprofile.finish("已停止内存追踪")
+    if not MEMORY.tracing:
+        MEMORY.start()
+        await memprofile.finish("已开始内存追踪，稍后再次发送“内存分析”查看快照；追踪期间会变慢，用完请发送“内存分析 停止”")
+    # 统计快照较慢，放到线程池中，避免长时间阻塞事件循环
+    report = await asyncio.get_running_loop().run_in_executor(None, MEMORY.snapshot)
+    await reply_text(memprofile, bot, session, user, private, report)
+
+
 @choose_map.handle()
 async def _choose_map(bot: Bot, ev: Event, counts: Message = CommandArg()):
-    """抽取非官方地图，默认3张，若输入数字则抽取对应数量"""
+    """抽取非官方地图，默认3张，若输入数字则抽取对应数量，含有“官”字时抽取官方地图"""
     session = ev.get_session_id()
     logging.debug(f"{session=!r}")
     m = __RE_SESSION.fullmatch(session)
@@ -143,14 +475,14 @@ async def _choose_map(bot: Bot, ev: Event, counts: Message = CommandArg()):
     session = m[1]
     user = ev.get_user_id()
     counts = str(counts).strip()
+    category = OFFICIAL if "官" in counts else CUSTOM
     m2 = __RE_COUNTS.search(counts)
     counts = int(m2[1]) if m2 is not None else 3
     if counts > FSQ.config.map_choices_max_counts:
         counts = FSQ.config.map_choices_max_counts
         await choose_map.send(Message(f"抽这么多，打得完吗？😅\n给你{counts}张。"))
-    candidates = [i for i in FSQ.mapnames if not i.official]
-    shuffle(candidates)
-    selected = candidates[:counts]
+    gname = FSQ.find_gname_from_session(session)
+    selected = FSQ.choose_maps(gname, counts, category)
     names = []
     for i in selected:
         if i.name_zh is not None:
@@ -163,24 +495,62 @@ async def _choose_map(bot: Bot, ev: Event, counts: Message = CommandArg()):
     return
 
 
-def im2png(im: Image) -> bytes:
-    """将 PIL Image 转换成优化的 png 二进制数据"""
-    with BytesIO() as buf:
-        im.save(buf, format="png", optimize=True)
-        return buf.getvalue()
-
-
-def im2cqcode(im: Image) -> str:
-    """将 PIL Image 转换成 CQ Code
-
-    示例：[CQ:image,file=base64://123=,subType=1]
-    """
-    b = im2png(im)
+def png2cqcode(b: bytes) -> str:
+    """将 png 二进制数据转换成 CQ Code"""
     b64 = b64encode(b).decode()
     cqcode = f"[CQ:image,file=base64://{b64},subType=1]"
     return cqcode
 
 
+async def image2cqcode(b: bytes) -> str:
+    """将编码后的图片按配置的发送方式转换成 CQ Code：
+    内嵌 base64、本地文件路径或本插件提供的 http 地址，保存文件在线程池中进行"""
+    if IMAGES is None:
+        return png2cqcode(b)
+    loop = asyncio.get_running_loop()
+    name = await loop.run_in_executor(None, IMAGES.save, b, ENCODER.suffix)
+    if DELIVERY == "http":
+        base = FSQ.config.image.http_base.rstrip("/")
+        url = f"{base}{FSQ.config.http_prefix}/image/{name}"
+    else:
+        url = (IMAGES.directory / name).as_uri()
+    return f"[CQ:image,file={url},subType=1]"
+
+
+async def fmt_text(r: QueryResult, qstr: str) -> str:
+    """格式化查询结果，配置了守护进程时由守护进程格式化"""
+    if DAEMON is not None:
+        return await DAEMON.fmt(r, qstr)
+    return await fmt_qresult(FSQ, r, qstr)
+
+
+async def render_image(text: str) -> bytes:
+    """将文本转换成图片并编码，配置了守护进程时由守护进程渲染，
+    否则在渲染线程池中进行，不阻塞事件循环"""
+    if DAEMON is not None:
+        return await DAEMON.render(text)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(RENDER_POOL, _render_in_thread, text)
+
+
+def _render_in_thread(text: str) -> bytes:
+    t2g = getattr(_render_local, "t2g", None)
+    if t2g is None:
+        t2g = _render_local.t2g = CachedTextDrawer(FSQ.t2g.cache)
+    # 跟随刷新后的配置，字体路径或字号变化时重新加载字体，缓存随之清空
+    t2g.conf = FSQ.t2g.conf
+    t2g.fontsize = FSQ.t2g.fontsize
+    return ENCODER.encode(t2g.draw(text))
+
+
+async def render_pages(text: str) -> list[bytes]:
+    """将文本折行后按 output_page_lines 行分页，各页并发渲染，
+    单张图片的尺寸和内存占用有上限，超过 output_max_pages 页的部分被截断"""
+    lines = FSQ.t2g.ts.wrap_text(text)
+    pages = paginate(lines, FSQ.config.output_page_lines, FSQ.config.output_max_pages)
+    return await asyncio.gather(*(render_image(page) for page in pages))
+
+
 async def get_group_member_name(bot: Bot, group: str, id: str) -> str:
     """查询群聊中成员名称，如果有群名片，则获取群名片，否则获取昵称"""
     info = await bot.get_group_member_info(
@@ -193,9 +563,10 @@ async def get_group_member_name(bot: Bot, group: str, id: str) -> str:
 
 
 async def search_user_by_qq_name(gname: str, name: str) -> QueryResult:
-    """搜索玩家，如果全名找不到，则搜索含任意一个字的名称"""
-    result = await FSQ.search_player(name, gname)
+    """搜索玩家，如果全名找不到，则搜索含任意一个字的名称；
+    玩家名录中有全名的记录时直接回答其最后出现的位置，不再搜索"""
+    result = await BACKEND.search_player(name, gname)
     if result.result is None:
         pat = f"[{name}]"
-        result = await FSQ.search_player(pat, gname)
+        result = await BACKEND.search_player(pat, gname)
     return result
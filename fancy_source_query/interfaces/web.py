@@ -0,0 +1,173 @@
+"""Fancy Source Query 的 HTTP 接口，挂载在 Nonebot 的 FastAPI 驱动器上
+
+其它接口：
+
++ interfaces : Python 接口
++ nonebot : Nonebot 接口
++ cli : 命令行接口
+
+所有接口都是只读的，直接返回 `QueryResult` 的 json，数据来自 `QueryPool` 的缓存；
+配置了守护进程时经过守护进程查询，本进程不另外发出 A2S 请求。
+响应头中带有根据查询时间生成的 ETag 和 Last-Modified，
+客户端带上 If-None-Match / If-Modified-Since 时，缓存未更新则返回 304。
+
++ `GET {prefix}/overview?group=` : 服务器组概况，group 为 `*` 时查询所有组
++ `GET {prefix}/server/{name}?group=&rules=` : 服务器信息和玩家信息，rules=true 时附带规则
++ `GET {prefix}/player?q=&group=` : 搜索玩家，group 为 `*` 时在所有组中搜索
+
+以上接口都支持 `stream=true` 参数，以 ndjson 格式流式输出：
+第一行为 `{"tag": ..., "qtime": ...}`，之后每行是结果列表中的一项。
+
+图片以 http 方式发送时，另外提供：
+
++ `GET {prefix}/image/{name}` : `ImageStore` 中保存的图片
+"""
+import logging
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from time import time
+from typing import Mapping
+
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+
+from ..exceptions import ObjectNotFound
+from . import ALL_GROUPS, FancySourceQuery, QueryResult
+from .daemon import DaemonClient
+from .image import ImageStore
+
+
+def qresult_etag(r: QueryResult) -> str:
+    """根据查询类型和查询时间生成弱 ETag，缓存未刷新时 ETag 不变；
+    由快照生成的结果还带有快照版本"""
+    if r.version:
+        return f'W/"{r.tag}-{r.qtime!r}-v{r.version}"'
+    return f'W/"{r.tag}-{r.qtime!r}"'
+
+
+def not_modified(headers: Mapping[str, str], etag: str, qtime: float) -> bool:
+    """判断客户端缓存是否仍然有效，优先使用 If-None-Match"""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(qtime) <= since
+    return False
+
+
+def qresult_response(
+    fsq: FancySourceQuery, request: Request, r: QueryResult, stream: bool
+) -> Response:
+    etag = qresult_etag(r)
+    # 缓存剩余的有效时间
+    max_age = max(0, int(fsq.config.cache_delay - (time() - r.qtime)))
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(r.qtime, usegmt=True),
+        "Cache-Control": f"max-age={max_age}",
+    }
+    if not_modified(request.headers, etag, r.qtime):
+        return Response(status_code=304, headers=headers)
+    if not stream:
+        return Response(r.json(), media_type="application/json", headers=headers)
+
+    def lines():
+        yield r.json(include={"tag", "qtime"}) + "\n"
+        items = r.result if isinstance(r.result, list) else [r.result]
+        for item in items:
+            if item is not None:
+                yield item.json() + "\n"
+
+    return StreamingResponse(
+        lines(), media_type="application/x-ndjson", headers=headers
+    )
+
+
+def build_router(
+    fsq: FancySourceQuery, backend: FancySourceQuery | DaemonClient | None = None
+) -> APIRouter:
+    """创建只读的查询路由，由调用者挂载到 FastAPI 应用上。
+    查询经过 backend（默认为 fsq 本身），fsq 只提供配置"""
+    router = APIRouter()
+    if backend is None:
+        backend = fsq
+
+    @router.get("/overview")
+    async def overview(
+        request: Request, group: str | None = None, stream: bool = False
+    ):
+        if group == ALL_GROUPS:
+            r = await backend.query_all_overview()
+        else:
+            r = await backend.query_servers_overview(group)
+        return qresult_response(fsq, request, r, stream)
+
+    @router.get("/server/{name}")
+    async def server(
+        request: Request,
+        name: str,
+        group: str | None = None,
+        rules: bool = False,
+        stream: bool = False,
+    ):
+        if rules:
+            r = await backend.query_server_full(name, group)
+        else:
+            r = await backend.query_server_and_players(name, group)
+        return qresult_response(fsq, request, r, stream)
+
+    @router.get("/player")
+    async def player(
+        request: Request, q: str, group: str | None = None, stream: bool = False
+    ):
+        if group == ALL_GROUPS:
+            r = await backend.search_player_all(q)
+        else:
+            r = await backend.search_player(q, group)
+        return qresult_response(fsq, request, r, stream)
+
+    return router
+
+
+async def _object_not_found(request: Request, exc: ObjectNotFound):
+    return JSONResponse({"detail": list(exc.args)}, status_code=404)
+
+
+async def _bad_regex(request: Request, exc: re.error):
+    return JSONResponse({"detail": str(exc)}, status_code=400)
+
+
+def setup_web(
+    fsq: FancySourceQuery,
+    app,
+    prefix: str,
+    backend: FancySourceQuery | DaemonClient | None = None,
+):
+    """将查询路由挂载到 FastAPI 应用 app 的 prefix 路径下，查询经过 backend"""
+    app.include_router(build_router(fsq, backend), prefix=prefix)
+    app.add_exception_handler(ObjectNotFound, _object_not_found)
+    app.add_exception_handler(re.error, _bad_regex)
+    logging.info(f"http query api mounted at {prefix!r}")
+
+
+def setup_images(store: ImageStore, app, prefix: str):
+    """在 prefix 路径下提供 store 中保存的图片，供 OneBot 实现下载"""
+    router = APIRouter()
+
+    @router.get("/image/{name}")
+    async def image(name: str):
+        path = store.path(name)
+        if path is None:
+            return Response(status_code=404)
+        return FileResponse(
+            path, headers={"Cache-Control": f"max-age={int(store.keep_seconds)}"}
+        )
+
+    app.include_router(router, prefix=prefix)
+    logging.info(f"image delivery mounted at {prefix + '/image'!r}")
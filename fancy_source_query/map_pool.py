@@ -0,0 +1,130 @@
+"""抽图用的地图池
+
+`update_mapnames` 时按类别预先建好地图池，每次抽取只需 O(k) 次随机数，
+与地图数据库的大小无关：
+
++ 权重相同时直接随机取下标，否则在累积权重上二分查找
++ 重复抽到的、组内最近抽过的、组内服务器正在运行的地图被拒绝后重抽
++ 可选的地图太少、拒绝次数过多时，才退化为过滤整个地图池
+"""
+import random
+from bisect import bisect
+from collections import deque
+from itertools import accumulate
+from typing import Iterable
+
+from .config import Mapname
+
+OFFICIAL = "official"
+CUSTOM = "custom"
+# 每抽一张图最多拒绝的次数，超过后改为过滤整个地图池
+MAX_REJECTS = 8
+
+
+class MapPool:
+    """一个类别的地图，按权重抽取不重复的若干张"""
+
+    maps: list[Mapname]
+    # 累积权重，所有权重相同时为 None
+    _cum: list[float] | None
+
+    def __init__(self, maps: list[Mapname]) -> None:
+        self.maps = [m for m in maps if m.weight > 0]
+        weights = [m.weight for m in self.maps]
+        if len(set(weights)) > 1:
+            self._cum = list(accumulate(weights))
+        else:
+            self._cum = None
+
+    def __len__(self) -> int:
+        return len(self.maps)
+
+    def _draw(self, rng: random.Random) -> int:
+        if self._cum is None:
+            return rng.randrange(len(self.maps))
+        return bisect(self._cum, rng.random() * self._cum[-1])
+
+    def sample(
+        self, k: int, exclude: set[str] = frozenset(), rng: random.Random = random
+    ) -> list[Mapname]:
+        """抽取 k 张名称不在 exclude 中的地图，可选的地图不足 k 张时全部返回"""
+        if k <= 0 or not self.maps:
+            return []
+        picked: dict[int, None] = dict()
+        rejects = 0
+        while len(picked) < k and rejects <= MAX_REJECTS * k:
+            i = self._draw(rng)
+            if i in picked or self.maps[i].name in exclude:
+                rejects += 1
+                continue
+            picked[i] = None
+        if len(picked) < k:
+            # 可选的地图很少，过滤整个地图池
+            rest = [
+                i
+                for i, m in enumerate(self.maps)
+                if i not in picked and m.name not in exclude
+            ]
+            picked.update(dict.fromkeys(self._weighted_shuffle(rest, rng)))
+        return [self.maps[i] for i in list(picked)[:k]]
+
+    def _weighted_shuffle(self, indexes: list[int], rng: random.Random) -> list[int]:
+        if self._cum is None:
+            rng.shuffle(indexes)
+            return indexes
+        # 按权重的无放回抽样：key = u ** (1 / w)，从大到小排列
+        return sorted(
+            indexes,
+            key=lambda i: rng.random() ** (1 / self.maps[i].weight),
+            reverse=True,
+        )
+
+
+class MapChooser:
+    """按类别保存地图池，并记住每个服务器组最近抽到的地图
+
+    + `update` : 根据地图数据重建地图池
+    + `choose` : 抽取地图，排除组内最近抽过的和正在运行的地图，
+        可选的地图不够时先放宽最近抽过的限制，再放宽正在运行的限制
+    """
+
+    pools: dict[str, MapPool]
+    # 每组记住的最近抽到的地图数量
+    history_size: int
+    # 组名 => 最近抽到的地图名
+    history: dict[str | None, deque[str]]
+
+    def __init__(self, history_size: int = 10) -> None:
+        self.pools = {OFFICIAL: MapPool([]), CUSTOM: MapPool([])}
+        self.history_size = history_size
+        self.history = dict()
+
+    def update(self, mapnames: list[Mapname]):
+        self.pools = {
+            OFFICIAL: MapPool([m for m in mapnames if m.official]),
+            CUSTOM: MapPool([m for m in mapnames if not m.official]),
+        }
+
+    def choose(
+        self,
+        gname: str | None,
+        k: int,
+        category: str = CUSTOM,
+        running: Iterable[str] = (),
+        rng: random.Random = random,
+    ) -> list[Mapname]:
+        pool = self.pools[category]
+        history = self.history.get(gname, None)
+        if history is None or history.maxlen != self.history_size:
+            history = deque(history or (), maxlen=self.history_size)
+            self.history[gname] = history
+        running = set(running)
+        recent = set(history)
+        selected = []
+        for exclude in (running | recent, running, set()):
+            names = {m.name for m in selected}
+            selected += pool.sample(k - len(selected), exclude | names, rng)
+            if len(selected) >= k:
+                break
+        history.extend(m.name for m in selected)
+        return selected
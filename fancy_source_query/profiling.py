@@ -0,0 +1,173 @@
+"""运行中的性能分析：CPU 采样和内存分配快照
+
++ `StackSampler` / `sample_for` : 在后台线程中定时采样所有线程的调用栈，
+    包括事件循环和渲染线程，统计各函数的占比
++ `MemoryTracer` : 基于 tracemalloc 的内存分配快照，对比两次快照之间的增长
+
+两者都只在执行分析命令时才开启，不分析时没有额外开销。
+报告优先列出 `FOCUS_FILES` 中关注的热点：查询池、格式化和文本转图片。
+"""
+import asyncio
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from fnmatch import fnmatch
+from types import FrameType
+
+# 关注的函数和内存分配来源，按文件路径匹配；
+# Python 3.10 的代码对象没有限定名，不能按 `类名.方法名` 匹配
+FOCUS_FILES = (
+    f"*{os.sep}fancy_source_query{os.sep}querypool{os.sep}*",
+    f"*{os.sep}fancy_source_query{os.sep}fmt.py",
+    f"*{os.sep}fancy_source_query{os.sep}interfaces{os.sep}image.py",
+    f"*{os.sep}impaper{os.sep}*",
+)
+# 采样间隔，s
+SAMPLE_INTERVAL = 0.005
+
+
+def _frame_name(frame: FrameType) -> tuple[str, str, int]:
+    code = frame.f_code
+    # co_qualname 在 Python 3.11 才加入，之前的版本只有函数名
+    name = getattr(code, "co_qualname", code.co_name)
+    return (name, code.co_filename, code.co_firstlineno)
+
+
+def _is_focus(filename: str) -> bool:
+    return any(fnmatch(filename, p) for p in FOCUS_FILES)
+
+
+class StackSampler:
+    """定时采样所有线程的调用栈
+
+    + self : 函数位于栈顶（正在执行自身代码）的次数
+    + total : 函数出现在栈中的次数，同一个栈中只计一次
+    """
+
+    interval: float
+    samples: int
+    self_counts: Counter
+    total_counts: Counter
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="fsq-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                self.samples += 1
+                self.self_counts[_frame_name(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    name = _frame_name(frame)
+                    if name not in seen:
+                        seen.add(name)
+                        self.total_counts[name] += 1
+                    frame = frame.f_back
+
+    def report(self, top: int = 10) -> str:
+        if not self.samples:
+            return "没有采样到数据"
+        lines = [f"采样 {self.samples} 次"]
+
+        def fmt(counter: Counter, names) -> list[str]:
+            return [
+                f"{counter[n] / self.samples * 100:5.1f}% {n[0]} "
+                f"({os.path.basename(n[1])}:{n[2]})"
+                for n in names
+            ]
+
+        focus = [n for n, _ in self.total_counts.most_common() if _is_focus(n[1])]
+        lines.append("== 关注的热点（含子调用）==")
+        lines.extend(fmt(self.total_counts, focus[:top]) or ["（无）"])
+        lines.append("== 自身耗时最多的函数 ==")
+        lines.extend(
+            fmt(self.self_counts, [n for n, _ in self.self_counts.most_common(top)])
+        )
+        return "\n".join(lines)
+
+
+async def sample_for(seconds: float, top: int = 10) -> str:
+    """采样 seconds 秒，返回报告文本。采样期间事件循环照常运行"""
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+    return sampler.report(top)
+
+
+class MemoryTracer:
+    """基于 tracemalloc 的内存分配快照
+
+    + `start` : 开始追踪，追踪期间所有内存分配都有额外开销
+    + `snapshot` : 报告当前占用最多的分配位置，以及与上次快照相比增长最多的位置
+    + `stop` : 停止追踪并丢弃快照
+
+    `snapshot` 的耗时与追踪到的分配数量成正比，应当在线程池中调用；
+    即使如此，复制分配记录时持有 GIL，事件循环仍会短暂停顿。
+    """
+
+    nframe: int
+    _last: tracemalloc.Snapshot | None
+
+    def __init__(self, nframe: int = 10) -> None:
+        self.nframe = nframe
+        self._last = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframe)
+        self._last = None
+
+    def stop(self):
+        tracemalloc.stop()
+        self._last = None
+
+    def snapshot(self, top: int = 10) -> str:
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"当前 {current / 1024:.1f} KiB，峰值 {peak / 1024:.1f} KiB"]
+        focus = snapshot.filter_traces(
+            [tracemalloc.Filter(True, p, all_frames=True) for p in FOCUS_FILES]
+        )
+        lines.append("== 关注的分配（查询池、格式化、文本转图片）==")
+        lines.extend(str(s) for s in focus.statistics("lineno")[:top])
+        lines.append("== 占用最多的位置 ==")
+        lines.extend(str(s) for s in snapshot.statistics("lineno")[:top])
+        if self._last is not None:
+            lines.append("== 与上次快照相比增长最多 ==")
+            diff = snapshot.compare_to(self._last, "lineno")
+            lines.extend(str(s) for s in diff[:top] if s.size_diff > 0)
+        self._last = snapshot
+        return "\n".join(lines)
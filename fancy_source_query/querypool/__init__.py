@@ -1,41 +1,164 @@
 """包装 Valve 的 A2S API"""
+import asyncio
 import logging
 from time import time
+from typing import Any, Awaitable, Callable
 
 import fancy_source_query.fmt as fmt
 
 from ..exceptions import QueryTimeout, ServerRestarting
-from .infos import PlayerInfo, ServerInfo, players_info, server_info
+from .cache import CacheBackend, CacheKey, MemoryCache
+from .directory import PlayerDirectory
+from .history import HistoryStore
+from .infos import (
+    A2S_TIMEOUT,
+    PlayerInfo,
+    RuleInfo,
+    RuleSet,
+    ServerInfo,
+    players_info,
+    rules_digest,
+    rules_pairs,
+    server_info,
+)
+from .resolver import Resolver
+from .snapshot import Address, Snapshot, SnapshotStore
+
+# 等待其它进程或协程查询时，检查缓存的间隔
+LEASE_POLL_INTERVAL = 0.05
+# 租约比查询超时时间多出的余量，保证持有者超时后写入的占位结果能被等待者读到
+LEASE_MARGIN = 2.0
+# 查询失败时代替服务器信息的占位结果的名称和地图代码
+TIMEOUT_NAME = "超时"
+RESTARTING_NAME = "换图或重启"
+UNKNOWN_MAP = "unknown"
+
+
+def placeholder(name: str) -> ServerInfo:
+    """查询失败时的占位服务器信息"""
+    return ServerInfo(
+        name=name, players=0, max_players=0, map=UNKNOWN_MAP, vac=False, ping=0.0
+    )
+
+
+def is_placeholder(sinfo: ServerInfo) -> bool:
+    """是否是查询失败时的占位服务器信息"""
+    return sinfo.map == UNKNOWN_MAP and sinfo.name in (TIMEOUT_NAME, RESTARTING_NAME)
 
 
 class QueryPool:
     """缓存查询结果
 
-    (host, port) => (timestamp, value)
+    (kind, host, port) => (timestamp, value)
+
+    缓存存放在可替换的缓存后端中，默认为进程内缓存。
+    缓存过期后，同一时间只有取得租约的一方会重新查询，其它调用者等待其结果。
+    查询失败时占位的结果也写入缓存，有效期内不再重复查询失效的服务器。
 
     提供以下方法：
 
     + `server_info` : 查询服务器信息，会读取缓存
     + `new_server_info` : 查询服务器信息，重新查询
+    + `peek_server_info` : 只读取缓存中的服务器信息
+    + `merge` : 合并其它进程（分片轮询的工作进程）查询到的结果
     + `players_info` : 查询服务器中玩家信息，会读取缓存
     + `new_players_info` : 查询服务器中玩家信息，重新查询
+    + `rules_info` : 查询服务器规则，会读取缓存，规则的缓存时间单独设置
+    + `new_rules_info` : 查询服务器规则，重新查询
+    + `snapshot` : 查询一组服务器，发布为不可变、带版本号的快照
     + `config` : 修改实例配置
+
+    每次成功查询服务器信息时，结果还会记录到 `history` 中；
+    设置了 `directory` 时，每次成功查询玩家信息的结果还会记录到玩家名录中。
+
+    host 可以是域名，查询前先经过 `resolver` 解析，缓存和历史记录都以解析后的 IP 为键，
+    指向同一服务器的不同域名共用缓存。`new_*` 方法不做解析。
+    解析失败时与超时一样返回占位结果（时间为解析失败的时间），不写入缓存。
     """
 
     __expire: float = 20.0
-    # 只缓存一个
-    __server_cache: dict[tuple[str, int], tuple[float, ServerInfo]]
-    __players_cache: dict[tuple[str, int], tuple[float, list[PlayerInfo]]]
+    # 规则很少变化且响应较大，缓存时间更长
+    __rules_expire: float = 600.0
+    # 查询租约的有效期，应当比查询超时时间多出 LEASE_MARGIN
+    __lease: float = 5.0
+    # 单次 A2S 请求的超时时间
+    __timeout: float = A2S_TIMEOUT
+    __cache: CacheBackend
+    history: HistoryStore
+    resolver: Resolver
+    directory: PlayerDirectory | None
+    snapshots: SnapshotStore
 
     def __init__(self) -> None:
-        self.__server_cache = dict()
-        self.__players_cache = dict()
+        self.__cache = MemoryCache()
+        self.history = HistoryStore()
+        self.resolver = Resolver()
+        self.directory = None
+        self.snapshots = SnapshotStore()
 
-    def config(self, expire: float | None = None):
-        """修改缓存过期时间，例如 `.config(expire=60.0)`"""
+    def config(
+        self,
+        expire: float | None = None,
+        backend: CacheBackend | None = None,
+        lease: float | None = None,
+        rules_expire: float | None = None,
+        timeout: float | None = None,
+    ):
+        """修改缓存过期时间、缓存后端、租约有效期、查询超时时间，例如 `.config(expire=60.0)`"""
         if expire:
             logging.debug(f"reset expire to {expire!r}")
             self.__expire = expire
+        if rules_expire:
+            logging.debug(f"reset rules expire to {rules_expire!r}")
+            self.__rules_expire = rules_expire
+        if backend:
+            logging.debug(f"reset cache backend to {backend!r}")
+            self.__cache.close()
+            self.__cache = backend
+        if lease:
+            logging.debug(f"reset lease to {lease!r}")
+            self.__lease = lease
+        if timeout:
+            logging.debug(f"reset query timeout to {timeout!r}")
+            self.__timeout = timeout
+
+    async def _cached(
+        self,
+        key: CacheKey,
+        expire: float,
+        new: Callable[[str, int], Awaitable[tuple[float, Any]]],
+    ) -> tuple[float, Any]:
+        """读取缓存，缓存过期或不存在时取得租约后调用 new 重新查询；
+        租约被他人持有时等待其写入缓存，直到租约失效。"""
+        _, host, port = key
+        deadline = time() + self.__lease
+        while True:
+            cache = self.__cache.get(key)
+            if cache is not None and time() - cache[0] <= self._ttl(cache[1], expire):
+                cache_time, cached = cache
+                logging.debug(f"read cache({fmt.fmt_time(cache_time)}) {cached!r}")
+                return (cache_time, cached)
+            if time() > deadline or self.__cache.acquire(key, self.__lease):
+                break
+            await asyncio.sleep(LEASE_POLL_INTERVAL)
+        try:
+            return await new(host, port)
+        finally:
+            self.__cache.release(key)
+
+    async def _resolve(self, host: str) -> tuple[float, str | None]:
+        """解析主机名，失败时返回 (解析失败的时间, None)"""
+        try:
+            return 0.0, await self.resolver.resolve(host)
+        except OSError as e:
+            logging.debug(f"cannot resolve {host!r}: {e!r}")
+            return self.resolver.failed_at(host) or time(), None
+
+    def _ttl(self, value: Any, expire: float) -> float:
+        """缓存的有效期，规则查询失败的占位结果只按普通缓存的有效期保留"""
+        if isinstance(value, RuleSet) and not value.digest:
+            return min(expire, self.__expire)
+        return expire
 
     async def server_info(self, host: str, port: int) -> tuple[float, ServerInfo]:
         """查询对应服务器的信息，如果当前时间在缓存的有效期内，
@@ -44,50 +167,72 @@ class QueryPool:
         + 读取缓存：返回 (缓存时间, 缓存信息)
         + 重新查询：返回 (查询时间, 查询信息)
         """
-        cache = self.__server_cache.get((host, port), None)
-        if cache is None:
-            # 无缓存内容
-            querytime, sinfo = await self.new_server_info(host, port)
-            return (querytime, sinfo)
-
-        cache_time, cached = cache
-        now = time()
-        if now - cache_time > self.__expire:
-            # 超时，重查
-            querytime, sinfo = await self.new_server_info(host, port)
-            return (querytime, sinfo)
-        logging.debug(f"read cache({fmt.fmt_time(cache_time)}) {cached!r}")
-        return (cache_time, cached)
+        failed_at, host = await self._resolve(host)
+        if host is None:
+            return failed_at, placeholder(TIMEOUT_NAME)
+        key = ("server", host, port)
+        return await self._cached(key, self.__expire, self.new_server_info)
 
     async def new_server_info(self, host: str, port: int) -> tuple[float, ServerInfo]:
         """重新查询服务器信息，将查询结果计入缓存。
-        如果超时，则返回超时信息，但不计入缓存。
+        如果超时，则返回超时信息，同样计入缓存，但不计入历史记录。
         """
+        key = ("server", host, port)
         querytime = time()
         try:
-            sinfo = await server_info(host, port)
+            sinfo = await server_info(host, port, self.__timeout)
         except QueryTimeout:
-            return querytime, ServerInfo(
-                name="超时",
-                players=0,
-                max_players=0,
-                map="unknown",
-                vac=False,
-                ping=0.0,
-            )
+            sinfo = placeholder(TIMEOUT_NAME)
+            self.__cache.set(key, querytime, sinfo)
+            return querytime, sinfo
         except ServerRestarting:
-            return querytime, ServerInfo(
-                name="换图或重启",
-                players=0,
-                max_players=0,
-                map="unknown",
-                vac=False,
-                ping=0.0,
-            )
+            sinfo = placeholder(RESTARTING_NAME)
+            self.__cache.set(key, querytime, sinfo)
+            return querytime, sinfo
         logging.debug(f"new server query({fmt.fmt_time(querytime)}) {sinfo!r}")
-        self.__server_cache[(host, port)] = (querytime, sinfo)
+        self.__cache.set(key, querytime, sinfo)
+        self.history.record(host, port, querytime, sinfo)
         return (querytime, sinfo)
 
+    def merge(
+        self,
+        host: str,
+        port: int,
+        qtime: float,
+        sinfo: ServerInfo | None,
+        pinfo: list[PlayerInfo] | None,
+    ):
+        """合并其它进程查询到的结果，与本进程的查询一样写入缓存、历史记录和玩家名录。
+        查询失败的部分为 None，与本进程查询超时一样只把占位结果写入缓存"""
+        host = self.resolver.peek(host)
+        if sinfo is None:
+            self.__cache.set(("server", host, port), qtime, placeholder(TIMEOUT_NAME))
+        else:
+            self.__cache.set(("server", host, port), qtime, sinfo)
+            self.history.record(host, port, qtime, sinfo)
+        if pinfo is None:
+            self.__cache.set(("players", host, port), qtime, [])
+        else:
+            self.__cache.set(("players", host, port), qtime, pinfo)
+            if self.directory is not None:
+                self.directory.record(host, port, qtime, pinfo)
+
+    async def snapshot(self, addrs: list[Address], players: bool = False) -> Snapshot:
+        """查询一组服务器的信息（players 为真时还有玩家信息），会读取缓存。
+        所有服务器的缓存都没有变化时返回上一个快照本身，否则发布新版本的快照。"""
+        sresults = await asyncio.gather(*(self.server_info(h, p) for h, p in addrs))
+        presults = None
+        if players:
+            presults = await asyncio.gather(
+                *(self.players_info(h, p) for h, p in addrs)
+            )
+        return self.snapshots.publish(tuple(addrs), sresults, presults)
+
+    def peek_server_info(self, host: str, port: int) -> ServerInfo | None:
+        """读取缓存中的服务器信息，不论是否过期，不产生网络查询"""
+        cache = self.__cache.get(("server", self.resolver.peek(host), port))
+        return cache[1] if cache is not None else None
+
     async def players_info(
         self, host: str, port: int
     ) -> tuple[float, list[PlayerInfo]]:
@@ -97,35 +242,66 @@ class QueryPool:
         + 读取缓存：返回 (缓存时间, 缓存信息)
         + 重新查询：返回 (查询时间, 查询信息)
         """
-        cache = self.__players_cache.get((host, port), None)
-        if cache is None:
-            # 无缓存内容
-            querytime, pinfo = await self.new_players_info(host, port)
-            return (querytime, pinfo)
-
-        cache_time, cached = cache
-        now = time()
-        if now - cache_time > self.__expire:
-            # 超时，重查
-            querytime, pinfo = await self.new_players_info(host, port)
-            return (querytime, pinfo)
-        logging.debug(f"read cache({fmt.fmt_time(cache_time)}) {cached!r}")
-        return (cache_time, cached)
+        failed_at, host = await self._resolve(host)
+        if host is None:
+            return failed_at, []
+        key = ("players", host, port)
+        return await self._cached(key, self.__expire, self.new_players_info)
 
     async def new_players_info(
         self, host: str, port: int
     ) -> tuple[float, list[PlayerInfo]]:
         """重新查询服务器信息，将查询结果计入缓存。
-        如果超时，则返回超时信息，但不计入缓存。
+        如果超时，则返回空列表，同样计入缓存，但不计入玩家名录。
         """
         querytime = time()
         try:
-            pinfo = await players_info(host, port)
-        except QueryTimeout:
-            return querytime, []
-        except ServerRestarting:
+            pinfo = await players_info(host, port, self.__timeout)
+        except (QueryTimeout, ServerRestarting):
+            self.__cache.set(("players", host, port), querytime, [])
             return querytime, []
 
         logging.debug(f"new players query({fmt.fmt_time(querytime)}) {pinfo!r}")
-        self.__players_cache[(host, port)] = (querytime, pinfo)
+        self.__cache.set(("players", host, port), querytime, pinfo)
+        if self.directory is not None:
+            self.directory.record(host, port, querytime, pinfo)
         return (querytime, pinfo)
+
+    async def rules_info(self, host: str, port: int) -> tuple[float, RuleSet]:
+        """查询对应服务器的规则，如果当前时间在规则缓存的有效期内，
+        则读取缓存，否则重新查询。
+
+        + 读取缓存：返回 (缓存时间, 缓存规则)
+        + 重新查询：返回 (查询时间, 查询规则)
+        """
+        failed_at, host = await self._resolve(host)
+        if host is None:
+            return failed_at, RuleSet(digest="", rules=[])
+        key = ("rules", host, port)
+        return await self._cached(key, self.__rules_expire, self.new_rules_info)
+
+    async def new_rules_info(self, host: str, port: int) -> tuple[float, RuleSet]:
+        """重新查询服务器规则，将查询结果计入缓存。
+        如果规则的摘要与缓存中的相同，则沿用缓存中已解析的规则列表。
+        如果超时，则返回空规则，同样计入缓存，但只按普通缓存的有效期保留。
+        """
+        key = ("rules", host, port)
+        querytime = time()
+        try:
+            pairs = await rules_pairs(host, port, self.__timeout)
+        except (QueryTimeout, ServerRestarting):
+            ruleset = RuleSet(digest="", rules=[])
+            self.__cache.set(key, querytime, ruleset)
+            return querytime, ruleset
+
+        digest = rules_digest(pairs)
+        cache = self.__cache.get(key)
+        if cache is not None and cache[1].digest == digest:
+            logging.debug(f"rules unchanged({digest}) {host}:{port}")
+            ruleset = cache[1]
+        else:
+            rules = [RuleInfo(name=k, value=v) for k, v in pairs]
+            ruleset = RuleSet(digest=digest, rules=rules)
+        logging.debug(f"new rules query({fmt.fmt_time(querytime)}) {digest}")
+        self.__cache.set(key, querytime, ruleset)
+        return (querytime, ruleset)
@@ -0,0 +1,384 @@
+"""A2S 查询协议的编解码与异步 UDP 客户端
+
+协议说明见 https://developer.valvesoftware.com/wiki/Server_queries
+
+编解码部分不涉及 IO（sans-IO），输入输出都是字节：
+
++ `parse_info` / `parse_players` / `parse_rules` / `parse_challenge` : 解码完整的响应
++ `SplitAssembler` : 重组分片的响应
+
+解码直接在收到的缓冲区上用 `struct.unpack_from` 读取，
+只解码用到的字段，不用的字符串只查找结尾而不解码。
+分片先以 memoryview 保存，收齐后按序号一次性拷贝进预先分配好的 bytearray。
+
+`query_info` / `query_players` / `query_rules` 是基于 asyncio 的 UDP 客户端，
+超时抛出 `asyncio.TimeoutError`（Python 3.11 起即内置的 `TimeoutError`），
+服务器拒绝连接时抛出 `ConnectionRefusedError`。
+"""
+import asyncio
+import bz2
+import struct
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator, NamedTuple
+from zlib import crc32
+
+from ..exceptions import A2SProtocolError
+
+SINGLE = b"\xff\xff\xff\xff"
+SPLIT = b"\xfe\xff\xff\xff"
+
+# 请求
+A2S_INFO = SINGLE + b"TSource Engine Query\x00"
+A2S_PLAYER = SINGLE + b"U"
+A2S_RULES = SINGLE + b"V"
+
+# 响应类型
+S2A_INFO = 0x49
+S2A_INFO_GOLDSRC = 0x6D
+S2A_PLAYER = 0x44
+S2A_RULES = 0x45
+S2C_CHALLENGE = 0x41
+
+HEADER = struct.Struct("<lB")
+INT32 = struct.Struct("<l")
+UINT16 = struct.Struct("<H")
+# app_id, players, max_players, bots, server_type, environment, visibility, vac
+INFO_TAIL = struct.Struct("<2xBB4xB")
+# players, max_players, protocol, server_type, environment, visibility, mod
+INFO_TAIL_GOLDSRC = struct.Struct("<BB4xB")
+# score, duration
+PLAYER_TAIL = struct.Struct("<lf")
+# 分片头：id, total, number
+SPLIT_HEADER = struct.Struct("<4xlBB")
+# 压缩分片的第一个分片额外带有：解压后长度, crc32
+SPLIT_BZ2 = struct.Struct("<lL")
+
+
+class Info(NamedTuple):
+    "A2S_INFO 响应中用到的字段"
+    name: str
+    map: str
+    players: int
+    max_players: int
+    vac: bool
+
+
+class Player(NamedTuple):
+    "A2S_PLAYER 响应中的一名玩家"
+    index: int
+    name: str
+    score: int
+    duration: float
+
+
+def response_type(data: bytes | bytearray) -> int:
+    """检查单包头并返回响应类型"""
+    if len(data) < HEADER.size:
+        raise A2SProtocolError("response too short", len(data))
+    header, kind = HEADER.unpack_from(data)
+    if header != -1:
+        raise A2SProtocolError("bad response header", header)
+    return kind
+
+
+def _skip_cstring(data: bytes | bytearray, pos: int) -> int:
+    end = data.find(b"\x00", pos)
+    if end < 0:
+        raise A2SProtocolError("unterminated string", pos)
+    return end + 1
+
+
+def _cstring(data: bytes | bytearray, view: memoryview, pos: int) -> tuple[str, int]:
+    end = data.find(b"\x00", pos)
+    if end < 0:
+        raise A2SProtocolError("unterminated string", pos)
+    return str(view[pos:end], "utf-8", "replace"), end + 1
+
+
+def parse_challenge(data: bytes | bytearray) -> int:
+    kind = response_type(data)
+    if kind != S2C_CHALLENGE:
+        raise A2SProtocolError("unexpected response type", kind)
+    try:
+        (challenge,) = INT32.unpack_from(data, HEADER.size)
+    except struct.error as e:
+        raise A2SProtocolError("truncated challenge") from e
+    return challenge
+
+
+def parse_info(data: bytes | bytearray) -> Info:
+    """解码 A2S_INFO 响应，支持 Source 和旧的 GoldSrc 格式"""
+    kind = response_type(data)
+    view = memoryview(data)
+    try:
+        if kind == S2A_INFO:
+            # 跳过协议版本
+            name, pos = _cstring(data, view, HEADER.size + 1)
+            map_, pos = _cstring(data, view, pos)
+            pos = _skip_cstring(data, pos)  # folder
+            pos = _skip_cstring(data, pos)  # game
+            players, max_players, vac = INFO_TAIL.unpack_from(data, pos)
+        elif kind == S2A_INFO_GOLDSRC:
+            pos = _skip_cstring(data, HEADER.size)  # address
+            name, pos = _cstring(data, view, pos)
+            map_, pos = _cstring(data, view, pos)
+            pos = _skip_cstring(data, pos)  # folder
+            pos = _skip_cstring(data, pos)  # game
+            players, max_players, mod = INFO_TAIL_GOLDSRC.unpack_from(data, pos)
+            pos += INFO_TAIL_GOLDSRC.size
+            if mod == 1:
+                pos = _skip_cstring(data, pos)  # link
+                pos = _skip_cstring(data, pos)  # download link
+                # NULL, version, size, type, dll
+                pos += 11
+            (vac,) = struct.unpack_from("<B", data, pos)
+        else:
+            raise A2SProtocolError("unexpected response type", kind)
+    except struct.error as e:
+        raise A2SProtocolError("truncated info response") from e
+    return Info(name, map_, players, max_players, vac == 1)
+
+
+def parse_players(data: bytes | bytearray) -> list[Player]:
+    """解码 A2S_PLAYER 响应。
+    人数较多时部分服务器会截断响应，此时只返回完整的部分"""
+    kind = response_type(data)
+    if kind != S2A_PLAYER:
+        raise A2SProtocolError("unexpected response type", kind)
+    view = memoryview(data)
+    size = len(data)
+    if size <= HEADER.size:
+        raise A2SProtocolError("truncated player response")
+    count = data[HEADER.size]
+    pos = HEADER.size + 1
+    players = []
+    try:
+        for _ in range(count):
+            if pos >= size:
+                break
+            index = data[pos]
+            name, pos = _cstring(data, view, pos + 1)
+            score, duration = PLAYER_TAIL.unpack_from(data, pos)
+            pos += PLAYER_TAIL.size
+            players.append(Player(index, name, score, duration))
+    except struct.error as e:
+        raise A2SProtocolError("truncated player response") from e
+    return players
+
+
+def parse_rules(data: bytes | bytearray) -> list[tuple[str, str]]:
+    """解码 A2S_RULES 响应，返回 (name, value) 列表，值保持服务器返回的字符串。
+    部分服务器会截断响应，此时只返回完整的部分"""
+    kind = response_type(data)
+    if kind != S2A_RULES:
+        raise A2SProtocolError("unexpected response type", kind)
+    view = memoryview(data)
+    size = len(data)
+    try:
+        (count,) = UINT16.unpack_from(data, HEADER.size)
+    except struct.error as e:
+        raise A2SProtocolError("truncated rules response") from e
+    pos = HEADER.size + UINT16.size
+    rules = []
+    for _ in range(count):
+        if pos >= size:
+            break
+        name, pos = _cstring(data, view, pos)
+        value, pos = _cstring(data, view, pos)
+        rules.append((name, value))
+    return rules
+
+
+class SplitAssembler:
+    """重组分片的响应
+
+    `feed` 每次接收一个数据包，收齐后返回去掉分片头的完整响应，否则返回 None。
+
+    分片头的长度随引擎不同：GoldSrc 9 字节，Source 10 或 12 字节（部分旧游戏没有分片长度字段）。
+    第 0 个分片的数据以单包头开头，据此确定分片头的长度；在此之前收到的分片暂存起来。
+    """
+
+    id: int | None
+    total: int
+    compressed: bool
+    # 分片头长度，未知时为 0
+    offset: int
+    parts: list[memoryview | None]
+    received: int
+    _early: list[bytes]
+
+    def __init__(self) -> None:
+        self.id = None
+        self.total = 0
+        self.compressed = False
+        self.offset = 0
+        self.parts = list()
+        self.received = 0
+        self._early = list()
+
+    def feed(self, packet: bytes) -> bytearray | None:
+        if len(packet) < SPLIT_HEADER.size or packet[:4] != SPLIT:
+            raise A2SProtocolError("bad split packet header")
+        if self.offset == 0:
+            (pid,) = INT32.unpack_from(packet, 4)
+            if pid < 0:
+                # 最高位表示压缩，只有 Source 引擎使用
+                self.compressed = True
+                self.offset = SPLIT_HEADER.size + 2
+            else:
+                found = packet.find(SINGLE, SPLIT_HEADER.size - 1, 18)
+                if found < 0:
+                    self._early.append(packet)
+                    return None
+                self.offset = found
+            early, self._early = self._early, list()
+            for p in early:
+                self._store(p)
+        return self._store(packet)
+
+    def _store(self, packet: bytes) -> bytearray | None:
+        if self.offset == SPLIT_HEADER.size - 1:
+            # GoldSrc：高 4 位为序号，低 4 位为总数
+            (pid,) = INT32.unpack_from(packet, 4)
+            total, number = packet[8] & 0x0F, packet[8] >> 4
+        else:
+            pid, total, number = SPLIT_HEADER.unpack_from(packet)
+        if self.id is None:
+            if total == 0:
+                raise A2SProtocolError("empty split response")
+            self.id = pid
+            self.total = total
+            self.parts = [None] * total
+        elif pid != self.id or total != self.total:
+            # 上一次请求迟到的分片
+            return None
+        if number >= total:
+            raise A2SProtocolError("bad split packet number", number, total)
+        if self.parts[number] is not None:
+            return None
+        view = memoryview(packet)[self.offset :]
+        if len(view) < SPLIT_BZ2.size and self.compressed and number == 0:
+            raise A2SProtocolError("truncated compressed split packet")
+        self.parts[number] = view
+        self.received += 1
+        if self.received < self.total:
+            return None
+        return self._join()
+
+    def _join(self) -> bytearray:
+        parts = self.parts
+        if self.compressed:
+            size, checksum = SPLIT_BZ2.unpack_from(parts[0])
+            parts = [parts[0][SPLIT_BZ2.size :], *parts[1:]]
+        buf = bytearray(sum(len(p) for p in parts))
+        pos = 0
+        for p in parts:
+            buf[pos : pos + len(p)] = p
+            pos += len(p)
+        if self.compressed:
+            try:
+                buf = bytearray(bz2.decompress(buf))
+            except (OSError, ValueError) as e:
+                raise A2SProtocolError("bad compressed response") from e
+            if len(buf) != size or crc32(buf) != checksum:
+                raise A2SProtocolError("compressed response checksum mismatch")
+        return buf
+
+
+class A2SProtocol(asyncio.DatagramProtocol):
+    """一个服务器的 UDP 连接，`request` 发送请求并等待完整的响应"""
+
+    transport: asyncio.DatagramTransport | None
+    waiter: asyncio.Future | None
+    assembler: SplitAssembler | None
+    # 收到第一个响应包的时间
+    received_at: float
+
+    def __init__(self) -> None:
+        self.transport = None
+        self.waiter = None
+        self.assembler = None
+        self.received_at = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        waiter = self.waiter
+        if waiter is None or waiter.done():
+            return
+        if not self.received_at:
+            self.received_at = perf_counter()
+        try:
+            if data[:4] == SPLIT:
+                if self.assembler is None:
+                    self.assembler = SplitAssembler()
+                data = self.assembler.feed(data)
+                if data is None:
+                    return
+            waiter.set_result(data)
+        except A2SProtocolError as e:
+            waiter.set_exception(e)
+
+    def error_received(self, exc: Exception):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(exc)
+
+    def connection_lost(self, exc: Exception | None):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(exc or ConnectionError("connection lost"))
+
+    async def request(self, payload: bytes, timeout: float) -> bytes | bytearray:
+        self.waiter = asyncio.get_running_loop().create_future()
+        self.assembler = None
+        self.received_at = 0.0
+        self.transport.sendto(payload)
+        return await asyncio.wait_for(self.waiter, timeout)
+
+
+@asynccontextmanager
+async def connect(host: str, port: int) -> AsyncIterator[A2SProtocol]:
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        A2SProtocol, remote_addr=(host, port)
+    )
+    try:
+        yield protocol
+    finally:
+        transport.close()
+
+
+async def _challenged(
+    proto: A2SProtocol, request: bytes, challenge: bytes, timeout: float
+) -> bytes | bytearray:
+    """发送请求，如果服务器要求 challenge，则带上 challenge 重新请求"""
+    data = await proto.request(request + challenge, timeout)
+    if response_type(data) == S2C_CHALLENGE:
+        data = await proto.request(request + INT32.pack(parse_challenge(data)), timeout)
+    return data
+
+
+async def query_info(host: str, port: int, timeout: float) -> tuple[Info, float]:
+    """查询服务器信息，返回 (信息, 延迟毫秒数)"""
+    async with connect(host, port) as proto:
+        start = perf_counter()
+        data = await proto.request(A2S_INFO, timeout)
+        # 以第一次往返计算延迟，不包括 challenge 后的重新请求
+        ping = (proto.received_at - start) * 1000
+        if response_type(data) == S2C_CHALLENGE:
+            challenge = INT32.pack(parse_challenge(data))
+            data = await proto.request(A2S_INFO + challenge, timeout)
+    return parse_info(data), ping
+
+
+async def query_players(host: str, port: int, timeout: float) -> list[Player]:
+    async with connect(host, port) as proto:
+        data = await _challenged(proto, A2S_PLAYER, INT32.pack(-1), timeout)
+    return parse_players(data)
+
+
+async def query_rules(host: str, port: int, timeout: float) -> list[tuple[str, str]]:
+    async with connect(host, port) as proto:
+        data = await _challenged(proto, A2S_RULES, INT32.pack(-1), timeout)
+    return parse_rules(data)
@@ -0,0 +1,179 @@
+"""查询池的缓存后端
+
+缓存的键为 (类型, host, port)，值为 (查询时间, 查询结果)。
+
++ `MemoryCache` : 进程内缓存，默认使用
++ `SQLiteCache` : 基于 SQLite WAL 文件的缓存，同一台机器上的多个进程可以共用
+
+后端同时提供查询租约（`acquire` / `release`），
+同一时间只有取得租约的一方会真正去查询服务器，其它进程或协程等待其写入缓存。
+"""
+import logging
+import os
+import pickle
+import sqlite3
+from abc import ABCMeta, abstractmethod
+from time import time
+from typing import Any
+from uuid import uuid4
+
+# (kind, host, port)
+CacheKey = tuple[str, str, int]
+# SQLite 的忙等待时间（秒）。缓存在事件循环中同步读写，不能长时间阻塞，
+# 数据库被其它进程锁住时放弃本次操作：读取视为没有缓存，写入跳过，租约视为未取得
+BUSY_TIMEOUT = 0.05
+
+
+class CacheBackend(metaclass=ABCMeta):
+    @abstractmethod
+    def get(self, key: CacheKey) -> tuple[float, Any] | None:
+        """读取缓存，返回 (查询时间, 查询结果)，没有缓存时返回 None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: CacheKey, qtime: float, value: Any):
+        """写入缓存"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def acquire(self, key: CacheKey, ttl: float) -> bool:
+        """尝试取得查询 key 的租约，成功返回 True。
+        租约在 ttl 秒后自动失效，防止持有者崩溃后无人查询。"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, key: CacheKey):
+        """释放自己持有的租约"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """进程内缓存，租约只在同一进程的协程之间生效"""
+
+    _cache: dict[CacheKey, tuple[float, Any]]
+    _leases: dict[CacheKey, float]
+
+    def __init__(self) -> None:
+        self._cache = dict()
+        self._leases = dict()
+
+    def get(self, key: CacheKey) -> tuple[float, Any] | None:
+        return self._cache.get(key, None)
+
+    def set(self, key: CacheKey, qtime: float, value: Any):
+        self._cache[key] = (qtime, value)
+
+    def acquire(self, key: CacheKey, ttl: float) -> bool:
+        now = time()
+        if self._leases.get(key, 0.0) > now:
+            return False
+        self._leases[key] = now + ttl
+        return True
+
+    def release(self, key: CacheKey):
+        self._leases.pop(key, None)
+
+
+class SQLiteCache(CacheBackend):
+    """基于 SQLite WAL 文件的缓存，可在同一台机器的多个进程间共享。
+
+    查询结果用 pickle 序列化，缓存文件只应由本机信任的进程读写。
+    数据库被锁住超过 `BUSY_TIMEOUT` 时操作直接失败，不阻塞事件循环。
+    """
+
+    path: str
+    # 租约持有者标识，区分不同进程
+    owner: str
+    _db: sqlite3.Connection
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.owner = f"{os.getpid()}-{uuid4().hex}"
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "kind TEXT, host TEXT, port INTEGER, qtime REAL, value BLOB, "
+            "PRIMARY KEY (kind, host, port))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lease ("
+            "kind TEXT, host TEXT, port INTEGER, owner TEXT, expires REAL, "
+            "PRIMARY KEY (kind, host, port))"
+        )
+        logging.debug(f"open sqlite cache {path!r} as {self.owner!r}")
+
+    def get(self, key: CacheKey) -> tuple[float, Any] | None:
+        try:
+            row = self._db.execute(
+                "SELECT qtime, value FROM cache WHERE kind = ? AND host = ? AND port = ?",
+                key,
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            logging.debug(f"sqlite cache busy, skip reading {key!r}: {e}")
+            return None
+        if row is None:
+            return None
+        qtime, value = row
+        return (qtime, pickle.loads(value))
+
+    def set(self, key: CacheKey, qtime: float, value: Any):
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (*key, qtime, pickle.dumps(value)),
+            )
+        except sqlite3.OperationalError as e:
+            logging.warning(f"sqlite cache busy, skip writing {key!r}: {e}")
+
+    def acquire(self, key: CacheKey, ttl: float) -> bool:
+        now = time()
+        # BEGIN IMMEDIATE 保证检查和写入之间没有其它进程插入
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # 其它进程正在写入，稍后重试
+            return False
+        try:
+            row = self._db.execute(
+                "SELECT expires FROM lease " "WHERE kind = ? AND host = ? AND port = ?",
+                key,
+            ).fetchone()
+            if row is not None and row[0] > now:
+                self._db.execute("COMMIT")
+                return False
+            self._db.execute(
+                "INSERT OR REPLACE INTO lease VALUES (?, ?, ?, ?, ?)",
+                (*key, self.owner, now + ttl),
+            )
+            self._db.execute("COMMIT")
+            return True
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def release(self, key: CacheKey):
+        try:
+            self._db.execute(
+                "DELETE FROM lease WHERE kind = ? AND host = ? AND port = ? AND owner = ?",
+                (*key, self.owner),
+            )
+        except sqlite3.OperationalError as e:
+            # 释放失败时租约到期后自动失效
+            logging.debug(f"sqlite cache busy, lease of {key!r} expires later: {e}")
+
+    def close(self):
+        self._db.close()
+
+
+def build_cache_backend(kind: str, path: str) -> CacheBackend:
+    """根据配置创建缓存后端，kind 为 memory 或 sqlite"""
+    if kind == "memory":
+        return MemoryCache()
+    elif kind == "sqlite":
+        return SQLiteCache(path)
+    raise ValueError(f"unknown cache backend {kind!r}")
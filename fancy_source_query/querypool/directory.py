@@ -0,0 +1,271 @@
+"""持久化的玩家名录
+
+每次成功查询玩家信息时记录在线的玩家，保存在 SQLite 文件中：
+
++ 规范化的玩家名、所在服务器
++ 首次和最后一次出现的时间
++ 累计在线时长
+
+写入先缓存在内存中，每隔 flush_interval 秒或积累 batch_size 条后在一个事务中批量写入。
+玩家名用 FTS5 trigram 分词建立全文索引，可以快速按名称片段查找玩家最后出现的位置和时间，
+不必重新查询服务器。
+
+数据库的读写都在名录自己的线程中进行，不阻塞事件循环；查找是异步方法。
+"""
+import asyncio
+import logging
+import re
+import sqlite3
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Any, Callable, NamedTuple
+
+from .cache import BUSY_TIMEOUT
+from .infos import PlayerInfo
+
+WHITESPACE = re.compile(r"\s+")
+# trigram 分词要求查询至少 3 个字符，更短的片段用 LIKE 扫描
+TRIGRAM = 3
+# 按地址过滤前最多读取的匹配数
+MAX_MATCHES = 1000
+# 按正则表达式等条件查找时最多扫描的记录数，最近出现的在前
+MAX_SCAN = 20000
+
+
+def normalize_name(name: str) -> str:
+    """全角转半角、忽略大小写、去掉空白，与在线玩家的搜索一样不区分空格"""
+    name = unicodedata.normalize("NFKC", name).casefold()
+    return WHITESPACE.sub("", name)
+
+
+class Sighting(NamedTuple):
+    "玩家在某个服务器上的记录"
+    name: str
+    host: str
+    port: int
+    first_seen: float
+    last_seen: float
+    # 累计在线时长，s
+    duration: float
+
+
+class PlayerDirectory:
+    """持久化的玩家名录
+
+    + `record` : 记录一次玩家信息查询的结果，写入会延迟并批量进行
+    + `flush` : 立即写入缓存的记录，等待写入完成
+    + `last_seen`(async) : 按名称片段查找玩家，最近出现的在前
+    + `last_seen_matching`(async) : 按任意条件查找玩家，扫描最近的 MAX_SCAN 条记录
+
+    数据库被其它进程锁住超过 `BUSY_TIMEOUT` 时放弃本次写入或查找。
+    """
+
+    path: str
+    flush_interval: float
+    batch_size: int
+    # (norm, host, port) => [name, first_seen, last_seen, 新增时长]
+    _pending: dict[tuple[str, str, int], list]
+    # (host, port) => {norm: 上次查询时的在线时长}，用于计算累计时长
+    _online: dict[tuple[str, int], dict[str, float]]
+    _last_flush: float
+    _db: sqlite3.Connection
+    # 只有一个线程，数据库操作按提交顺序依次进行
+    _executor: ThreadPoolExecutor
+
+    def __init__(
+        self, path: str, flush_interval: float = 10.0, batch_size: int = 512
+    ) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = dict()
+        self._online = dict()
+        self._last_flush = time()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="fsq-directory"
+        )
+        self._db = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS players ("
+            "id INTEGER PRIMARY KEY, name TEXT, norm TEXT, host TEXT, port INTEGER, "
+            "first_seen REAL, last_seen REAL, duration REAL, "
+            "UNIQUE (norm, host, port))"
+        )
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS players_fts USING fts5("
+            "norm, content='players', content_rowid='id', tokenize='trigram')"
+        )
+        # 同一玩家在同一服务器上只有一行，规范化名称不会更新，只需在插入时同步索引
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS players_ai AFTER INSERT ON players BEGIN "
+            "INSERT INTO players_fts(rowid, norm) VALUES (new.id, new.norm); END"
+        )
+        # 旧版本的规范化名称保留了空格，去掉空格后重建全文索引
+        cursor = self._db.execute(
+            "UPDATE OR IGNORE players SET norm = replace(norm, ' ', '') "
+            "WHERE instr(norm, ' ') > 0"
+        )
+        if cursor.rowcount > 0:
+            self._db.execute("INSERT INTO players_fts(players_fts) VALUES ('rebuild')")
+            logging.info(f"player directory: {cursor.rowcount} names renormalized")
+        logging.debug(f"open player directory {path!r}")
+
+    def record(self, host: str, port: int, qtime: float, players: list[PlayerInfo]):
+        previous = self._online.get((host, port), {})
+        online = dict()
+        for p in players:
+            norm = normalize_name(p.name)
+            # 正在连接的玩家没有名称
+            if not norm:
+                continue
+            online[norm] = p.duration
+            last = previous.get(norm, None)
+            # 上次查询后重新连接的玩家，在线时长从头计算
+            gained = (
+                p.duration if last is None or p.duration < last else p.duration - last
+            )
+            key = (norm, host, port)
+            entry = self._pending.get(key, None)
+            if entry is None:
+                self._pending[key] = [p.name, qtime, qtime, gained]
+            else:
+                entry[0] = p.name
+                entry[2] = qtime
+                entry[3] += gained
+        self._online[(host, port)] = online
+        if (
+            len(self._pending) >= self.batch_size
+            or time() - self._last_flush >= self.flush_interval
+        ):
+            self._submit_write()
+
+    def flush(self):
+        self._submit_write().result()
+
+    def _submit_write(self):
+        """取出缓存的记录，交给名录的线程写入"""
+        self._last_flush = time()
+        rows = [
+            (name, norm, host, port, first, last, gained)
+            for (norm, host, port), (name, first, last, gained) in self._pending.items()
+        ]
+        self._pending = dict()
+        return self._executor.submit(self._write, rows)
+
+    def _write(self, rows: list[tuple]):
+        if not rows:
+            return
+        try:
+            self._db.execute("BEGIN")
+        except sqlite3.OperationalError as e:
+            logging.warning(f"player directory busy, {len(rows)} rows dropped: {e!r}")
+            return
+        try:
+            self._db.executemany(
+                "INSERT INTO players "
+                "(name, norm, host, port, first_seen, last_seen, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (norm, host, port) DO UPDATE SET "
+                "name = excluded.name, last_seen = excluded.last_seen, "
+                "duration = duration + excluded.duration",
+                rows,
+            )
+            self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._db.execute("ROLLBACK")
+            logging.warning(
+                f"player directory write failed, {len(rows)} dropped: {e!r}"
+            )
+            return
+        logging.debug(f"player directory: {len(rows)} rows written")
+
+    async def _run(self, func: Callable, *args) -> list[Sighting]:
+        """先写入缓存的记录，再在名录的线程中执行查找，数据库被锁住时视为没有记录"""
+        self._submit_write()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        except sqlite3.OperationalError as e:
+            logging.warning(f"player directory busy: {e!r}")
+            return []
+
+    async def last_seen(
+        self,
+        fragment: str,
+        addrs: set[tuple[str, int]] | None = None,
+        limit: int = 5,
+    ) -> list[Sighting]:
+        """查找名称中含有 fragment 的玩家，只保留 addrs 中的服务器，最近出现的在前"""
+        return await self._run(self._last_seen, fragment, addrs, limit)
+
+    def _last_seen(
+        self, fragment: str, addrs: set[tuple[str, int]] | None, limit: int
+    ) -> list[Sighting]:
+        norm = normalize_name(fragment)
+        if not norm:
+            return []
+        columns = "name, host, port, first_seen, last_seen, duration"
+        if len(norm) >= TRIGRAM:
+            phrase = '"' + norm.replace('"', '""') + '"'
+            cursor = self._db.execute(
+                f"SELECT {columns} FROM players WHERE id IN "
+                "(SELECT rowid FROM players_fts WHERE players_fts MATCH ?) "
+                "ORDER BY last_seen DESC LIMIT ?",
+                (phrase, MAX_MATCHES),
+            )
+        else:
+            pattern = "%" + re.sub(r"([%_\\])", r"\\\1", norm) + "%"
+            cursor = self._db.execute(
+                f"SELECT {columns} FROM players WHERE norm LIKE ? ESCAPE '\\' "
+                "ORDER BY last_seen DESC LIMIT ?",
+                (pattern, MAX_MATCHES),
+            )
+        result = []
+        for row in cursor:
+            sighting = Sighting(*row)
+            if addrs is None or (sighting.host, sighting.port) in addrs:
+                result.append(sighting)
+                if len(result) >= limit:
+                    break
+        return result
+
+    async def last_seen_matching(
+        self,
+        match: Callable[[str], Any],
+        addrs: set[tuple[str, int]],
+        limit: int = 5,
+    ) -> list[Sighting]:
+        """查找名称满足 match 的玩家，只保留 addrs 中的服务器，最近出现的在前。
+        不经过全文索引，逐行扫描这些服务器最近的 MAX_SCAN 条记录，
+        用于正则表达式等无法索引的条件"""
+        if not addrs:
+            return []
+        return await self._run(self._last_seen_matching, match, addrs, limit)
+
+    def _last_seen_matching(
+        self, match: Callable[[str], Any], addrs: set[tuple[str, int]], limit: int
+    ) -> list[Sighting]:
+        values = ", ".join("(?, ?)" for _ in addrs)
+        cursor = self._db.execute(
+            "SELECT name, host, port, first_seen, last_seen, duration FROM players "
+            f"WHERE (host, port) IN (VALUES {values}) ORDER BY last_seen DESC LIMIT ?",
+            [x for addr in addrs for x in addr] + [MAX_SCAN],
+        )
+        result = []
+        for row in cursor:
+            sighting = Sighting(*row)
+            if match(sighting.name):
+                result.append(sighting)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def close(self):
+        self.flush()
+        self._executor.submit(self._db.close).result()
+        self._executor.shutdown()
@@ -0,0 +1,231 @@
+"""服务器人数和地图的历史记录
+
+每次成功查询服务器信息时记录一个采样点，分三个精度保存：
+
++ raw : 每次查询的原始采样
++ minute : 每分钟一个点
++ hour : 每小时一个点
+
+每个精度都是定长的环形缓冲区，各列由 `array` 存储，
+内存占用只与服务器数量和缓冲区长度有关，与运行时间无关。
+降采样的点记录该时间段内的平均人数、最高人数、人数上限和出现最多的地图。
+"""
+from array import array
+from time import localtime
+from typing import Iterator, NamedTuple
+
+from .infos import ServerInfo
+
+TIERS = ("raw", "minute", "hour")
+# 各精度的时间段长度（秒），raw 不做聚合
+TIER_SECONDS = {"raw": 0, "minute": 60, "hour": 3600}
+
+
+class Sample(NamedTuple):
+    "一个采样点，map 为地图代码"
+    ts: float
+    mean: float
+    peak: int
+    max_players: int
+    map: str
+
+
+class MapTable:
+    """地图代码 <=> 整数编号，使采样点只保存一个整数"""
+
+    _ids: dict[str, int]
+    _names: list[str]
+
+    def __init__(self) -> None:
+        self._ids = dict()
+        self._names = list()
+
+    def id(self, name: str) -> int:
+        i = self._ids.get(name, None)
+        if i is None:
+            i = len(self._names)
+            self._ids[name] = i
+            self._names.append(name)
+        return i
+
+    def name(self, i: int) -> str:
+        return self._names[i]
+
+
+class Ring:
+    """定长环形缓冲区，写满后覆盖最旧的点"""
+
+    capacity: int
+    size: int
+    # 最旧的点的位置
+    start: int
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.size = 0
+        self.start = 0
+        self.ts = array("d", bytes(8 * capacity))
+        self.mean = array("f", bytes(4 * capacity))
+        self.peak = array("H", bytes(2 * capacity))
+        self.max_players = array("H", bytes(2 * capacity))
+        self.map_id = array("I", bytes(4 * capacity))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, ts: float, mean: float, peak: int, max_players: int, map_id: int):
+        if self.size < self.capacity:
+            i = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.ts[i] = ts
+        self.mean[i] = mean
+        self.peak[i] = peak
+        self.max_players[i] = max_players
+        self.map_id[i] = map_id
+
+    def __iter__(self) -> Iterator[tuple[float, float, int, int, int]]:
+        """按时间顺序遍历 (ts, mean, peak, max_players, map_id)"""
+        for k in range(self.size):
+            i = (self.start + k) % self.capacity
+            yield (
+                self.ts[i],
+                self.mean[i],
+                self.peak[i],
+                self.max_players[i],
+                self.map_id[i],
+            )
+
+
+class Bucket:
+    """正在累积的降采样时间段"""
+
+    ts: float
+    total: int
+    count: int
+    peak: int
+    max_players: int
+    # map_id => 采样次数
+    maps: dict[int, int]
+
+    def __init__(self, ts: float) -> None:
+        self.ts = ts
+        self.total = 0
+        self.count = 0
+        self.peak = 0
+        self.max_players = 0
+        self.maps = dict()
+
+    def add(self, players: int, max_players: int, map_id: int):
+        self.total += players
+        self.count += 1
+        self.peak = max(self.peak, players)
+        self.max_players = max_players
+        self.maps[map_id] = self.maps.get(map_id, 0) + 1
+
+    def point(self) -> tuple[float, float, int, int, int]:
+        map_id = max(self.maps, key=self.maps.__getitem__)
+        return (self.ts, self.total / self.count, self.peak, self.max_players, map_id)
+
+
+class ServerHistory:
+    """单个服务器的三种精度的历史记录"""
+
+    rings: dict[str, Ring]
+    buckets: dict[str, Bucket | None]
+
+    def __init__(self, sizes: dict[str, int]) -> None:
+        self.rings = {tier: Ring(sizes[tier]) for tier in TIERS}
+        self.buckets = {tier: None for tier in TIERS if TIER_SECONDS[tier]}
+
+    def record(self, ts: float, players: int, max_players: int, map_id: int):
+        self.rings["raw"].append(ts, players, players, max_players, map_id)
+        for tier, bucket in self.buckets.items():
+            seconds = TIER_SECONDS[tier]
+            start = ts - ts % seconds
+            if bucket is None or bucket.ts != start:
+                if bucket is not None:
+                    self.rings[tier].append(*bucket.point())
+                bucket = self.buckets[tier] = Bucket(start)
+            bucket.add(players, max_players, map_id)
+
+    def points(self, tier: str) -> Iterator[tuple[float, float, int, int, int]]:
+        """按时间顺序遍历某精度的所有点，包括还在累积中的时间段"""
+        yield from self.rings[tier]
+        bucket = self.buckets.get(tier, None)
+        if bucket is not None:
+            yield bucket.point()
+
+
+class HistoryStore:
+    """所有服务器的历史记录
+
+    (host, port) => ServerHistory
+
+    + `record` : 记录一次服务器信息查询结果
+    + `samples` : 读取某个服务器某精度的采样点
+    + `config` : 修改各精度的缓冲区长度，只对新记录的服务器生效
+    """
+
+    sizes: dict[str, int]
+    maps: MapTable
+    servers: dict[tuple[str, int], ServerHistory]
+
+    def __init__(self) -> None:
+        # 默认：raw 360 个点，分钟 1 天，小时 8 周
+        self.sizes = {"raw": 360, "minute": 1440, "hour": 1344}
+        self.maps = MapTable()
+        self.servers = dict()
+
+    def config(self, sizes: dict[str, int] | None = None):
+        if sizes:
+            self.sizes.update(sizes)
+
+    def record(self, host: str, port: int, qtime: float, sinfo: ServerInfo):
+        history = self.servers.get((host, port), None)
+        if history is None:
+            history = self.servers[(host, port)] = ServerHistory(self.sizes)
+        map_id = self.maps.id(sinfo.map)
+        history.record(qtime, sinfo.players, sinfo.max_players, map_id)
+
+    def samples(
+        self, host: str, port: int, tier: str = "minute", since: float = 0.0
+    ) -> list[Sample]:
+        history = self.servers.get((host, port), None)
+        if history is None:
+            return []
+        return [
+            Sample(ts, mean, peak, max_players, self.maps.name(map_id))
+            for ts, mean, peak, max_players, map_id in history.points(tier)
+            if ts >= since
+        ]
+
+
+def peak_hours(samples: list[list[Sample]]) -> list[float]:
+    """根据多个服务器的小时级采样，计算每天 0~23 时的平均总人数"""
+    # 时间段 => 所有服务器的人数之和
+    totals: dict[float, float] = {}
+    for server_samples in samples:
+        for s in server_samples:
+            totals[s.ts] = totals.get(s.ts, 0.0) + s.mean
+    sums = [0.0] * 24
+    counts = [0] * 24
+    for ts, total in totals.items():
+        hour = localtime(ts).tm_hour
+        sums[hour] += total
+        counts[hour] += 1
+    return [s / c if c else 0.0 for s, c in zip(sums, counts)]
+
+
+def map_popularity(
+    samples: list[list[Sample]], seconds: int
+) -> list[tuple[str, float]]:
+    """根据多个服务器的采样计算各地图的“人·小时”数，按从多到少排序，
+    seconds 为每个采样点代表的时间长度"""
+    hours: dict[str, float] = {}
+    for server_samples in samples:
+        for s in server_samples:
+            hours[s.map] = hours.get(s.map, 0.0) + s.mean * seconds / 3600
+    return sorted(hours.items(), key=lambda x: x[1], reverse=True)
@@ -1,11 +1,17 @@
+import asyncio
 import logging
-import socket
-from typing import Any
+import sys
+from hashlib import blake2b
+from typing import Any, Awaitable, NamedTuple, TypeVar
+
 from pydantic import BaseModel
 
-from steam.game_servers import a2s_info, a2s_players, a2s_rules
+from ..exceptions import A2SProtocolError, QueryTimeout, ServerRestarting
+from .a2s import query_info, query_players, query_rules
 
-from ..exceptions import QueryTimeout, ServerRestarting
+T = TypeVar("T")
+# 单次 A2S 请求默认的超时时间（秒），查询池按配置的 timeout 传入
+A2S_TIMEOUT = 2.0
 
 
 class PlayerInfo(BaseModel):
@@ -40,6 +46,30 @@ class ServerTriple(BaseModel):
     server: ServerInfo
     players: list[PlayerInfo]
     rules: list[RuleInfo]
+    # 规则的摘要，规则不变时摘要不变
+    rules_digest: str = ""
+
+
+class RuleSet(NamedTuple):
+    "缓存中的规则：摘要和按名称排序的规则列表"
+    digest: str
+    rules: list[RuleInfo]
+
+
+class GroupResult(BaseModel):
+    "某个服务器组的汇总结果，players 为该组的总人数或匹配到的玩家数"
+    name: str
+    players: int
+    result: list[ServerPair] | list[ServerInfo]
+
+
+class SeenInfo(BaseModel):
+    "玩家名录中的记录：玩家最后一次出现的服务器和时间，duration 为累计在线时长"
+    name: str
+    server: str
+    first_seen: float
+    last_seen: float
+    duration: float
 
 
 class Overview(BaseModel):
@@ -47,7 +77,22 @@ class Overview(BaseModel):
     servers: list[ServerInfo] = list()
 
 
-async def server_info(host: str, port: int) -> ServerInfo:
+async def _checked(host: str, port: int, request: Awaitable[T]) -> T:
+    """等待一次 A2S 查询，将底层的异常转换为 QueryTimeout 或 ServerRestarting。
+    响应格式错误、网络错误与超时同样处理，一个异常的服务器不会影响同组的其它查询"""
+    try:
+        return await request
+    # Python 3.10 中 asyncio.TimeoutError 不是内置 TimeoutError 的子类
+    except (asyncio.TimeoutError, TimeoutError):
+        raise QueryTimeout({"host": host, "port": port})
+    except ConnectionRefusedError:
+        raise ServerRestarting({"host": host, "port": port})
+    except (A2SProtocolError, OSError) as e:
+        logging.warning(f"bad a2s response from {host}:{port}: {e!r}")
+        raise QueryTimeout({"host": host, "port": port}) from e
+
+
+async def server_info(host: str, port: int, timeout: float = A2S_TIMEOUT) -> ServerInfo:
     """查询服务器信息，只保留了部分感兴趣的信息：
 
     + name: 服务器名称
@@ -57,31 +102,29 @@ async def server_info(host: str, port: int) -> ServerInfo:
     + vac: 是否开启 VAC
     + ping: 本机与服务器的延迟
     """
-    try:
-        info = a2s_info(server_addr=(host, port))
-    except socket.timeout:
-        raise QueryTimeout({"host": host, "port": port})
-    except ConnectionRefusedError:
-        raise ServerRestarting({"host": host, "port": port})
-
-    info_ = {
-        "name": info["name"],
-        "players": info["players"],
-        "max_players": info["max_players"],
-        "map": info["map"],
-        "vac": True if info["vac"] == 1 else False,
-        "ping": info["_ping"],
-    }
-    if info_["name"].startswith("\ufeff"):
-        info_["name"] = info_["name"].strip("\ufeff")
-
-    info_obj = ServerInfo(**info_)
+    info, ping = await _checked(host, port, query_info(host, port, timeout))
+
+    name = info.name
+    if name.startswith("\ufeff"):
+        name = name.strip("\ufeff")
+
+    # 字段类型由解码器保证，跳过 pydantic 的校验
+    info_obj = ServerInfo.construct(
+        name=name,
+        players=info.players,
+        max_players=info.max_players,
+        map=info.map,
+        vac=info.vac,
+        ping=ping,
+    )
 
     logging.debug(f"new server info query to {host}:{port}")
     return info_obj
 
 
-async def players_info(host: str, port: int) -> list[PlayerInfo]:
+async def players_info(
+    host: str, port: int, timeout: float = A2S_TIMEOUT
+) -> list[PlayerInfo]:
     """查询服务器中的玩家信息
 
     + duration: 游玩时间（秒）
@@ -89,15 +132,33 @@ async def players_info(host: str, port: int) -> list[PlayerInfo]:
     + score: 分数
     + name: 名称
     """
-    try:
-        info = a2s_players(server_addr=(host, port))
-    except socket.timeout:
-        raise QueryTimeout({"host": host, "port": port})
-    except ConnectionRefusedError:
-        raise ServerRestarting({"host": host, "port": port})
+    players = await _checked(host, port, query_players(host, port, timeout))
 
     logging.debug(f"new players info query to {host}:{port}")
-    return sorted([PlayerInfo(**i) for i in info], key=lambda o: -o.score)
+    players.sort(key=lambda p: -p.score)
+    return [
+        PlayerInfo.construct(
+            name=p.name, score=p.score, duration=p.duration, index=p.index
+        )
+        for p in players
+    ]
+
+
+async def rules_pairs(
+    host: str, port: int, timeout: float = A2S_TIMEOUT
+) -> tuple[tuple[str, Any], ...]:
+    """查询服务器的规则，返回按名称排序的 (name, value) 元组，
+    规则名称经过 intern，多个服务器的同名规则共用同一个字符串
+    """
+    rules = await _checked(host, port, query_rules(host, port, timeout))
+
+    logging.debug(f"new rules info query to {host}:{port}")
+    return tuple(sorted((sys.intern(k), v) for k, v in rules))
+
+
+def rules_digest(pairs: tuple[tuple[str, Any], ...]) -> str:
+    """计算规则的摘要，用于判断规则是否变化"""
+    return blake2b(repr(pairs).encode(), digest_size=8).hexdigest()
 
 
 async def rules_info(host: str, port: int) -> list[RuleInfo]:
@@ -106,11 +167,5 @@ async def rules_info(host: str, port: int) -> list[RuleInfo]:
     + name: 规则名称
     + value: 值
     """
-    try:
-        info = a2s_rules(server_addr=(host, port))
-    except socket.timeout:
-        raise QueryTimeout({"host": host, "port": port})
-    except ConnectionRefusedError:
-        raise ServerRestarting({"host": host, "port": port})
-
-    return [RuleInfo(**i) for i in info]
+    pairs = await rules_pairs(host, port)
+    return [RuleInfo(name=k, value=v) for k, v in pairs]
@@ -0,0 +1,104 @@
+"""Valve 主服务器查询协议的编解码与异步 UDP 客户端
+
+协议说明见 https://developer.valvesoftware.com/wiki/Master_Server_Query_Protocol
+
++ `build_filter` / `build_request` / `parse_addresses` : 编解码，不涉及 IO
++ `query_master` : 分页查询主服务器，以上一页的最后一个地址作为下一页的起点
++ `probe` : 并发地向候选服务器发送 A2S_INFO，只保留有响应的服务器
+"""
+import asyncio
+import logging
+import socket
+import struct
+
+from ..exceptions import A2SProtocolError, MasterProtocolError
+from . import a2s
+
+MASTER_QUERY = 0x31
+RESPONSE_HEADER = a2s.SINGLE + b"\x66\x0a"
+# ip, port，端口为网络字节序
+ADDRESS = struct.Struct(">4sH")
+# 第一页的起点，也是最后一页的结束标记
+SEED = ("0.0.0.0", 0)
+REGION_ALL = 0xFF
+
+Address = tuple[str, int]
+
+
+def build_filter(gamedir: str = "", name_match: str = "", extra: str = "") -> str:
+    """生成过滤条件，name_match 支持 * 通配符，extra 为协议格式的其它条件"""
+    filter_ = ""
+    if gamedir:
+        filter_ += f"\\gamedir\\{gamedir}"
+    if name_match:
+        filter_ += f"\\name_match\\{name_match}"
+    return filter_ + extra
+
+
+def build_request(region: int, seed: Address, filter_: str) -> bytes:
+    return (
+        bytes((MASTER_QUERY, region))
+        + f"{seed[0]}:{seed[1]}".encode()
+        + b"\x00"
+        + filter_.encode()
+        + b"\x00"
+    )
+
+
+def parse_addresses(data: bytes | bytearray) -> list[Address]:
+    """解码一页响应，返回其中的地址，最后一页以 `SEED` 结尾"""
+    if data[: len(RESPONSE_HEADER)] != RESPONSE_HEADER:
+        raise MasterProtocolError("bad master response header", bytes(data[:6]))
+    body = len(data) - len(RESPONSE_HEADER)
+    if body % ADDRESS.size:
+        raise MasterProtocolError("truncated master response", len(data))
+    return [
+        (socket.inet_ntoa(ip), port)
+        for ip, port in ADDRESS.iter_unpack(memoryview(data)[len(RESPONSE_HEADER) :])
+    ]
+
+
+async def query_master(
+    host: str,
+    port: int,
+    filter_: str,
+    region: int = REGION_ALL,
+    timeout: float = 5.0,
+    limit: int = 256,
+) -> list[Address]:
+    """分页查询主服务器，返回去重后的地址，最多 limit 个"""
+    found: dict[Address, None] = dict()
+    seed = SEED
+    async with a2s.connect(host, port) as proto:
+        while len(found) < limit:
+            data = await proto.request(build_request(region, seed, filter_), timeout)
+            page = parse_addresses(data)
+            done = not page or page[-1] == SEED
+            for addr in page:
+                if addr != SEED:
+                    found[addr] = None
+            if done or page[-1] == seed:
+                break
+            seed = page[-1]
+    logging.debug(f"master {host}:{port} returned {len(found)} servers")
+    return list(found)[:limit]
+
+
+async def probe(
+    addrs: list[Address], timeout: float, concurrency: int = 64
+) -> list[tuple[Address, a2s.Info]]:
+    """并发查询候选服务器的 A2S_INFO，同时进行的查询不超过 concurrency 个，
+    按输入顺序返回有响应的服务器"""
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(addr: Address) -> a2s.Info | None:
+        async with sem:
+            try:
+                info, _ = await a2s.query_info(*addr, timeout)
+                return info
+            except (asyncio.TimeoutError, OSError, A2SProtocolError) as e:
+                logging.debug(f"probe {addr} failed: {e!r}")
+                return None
+
+    infos = await asyncio.gather(*(one(a) for a in addrs))
+    return [(a, i) for a, i in zip(addrs, infos) if i is not None]
@@ -0,0 +1,109 @@
+"""服务器主机名的异步解析与缓存
+
+配置中的 host 可以是域名。解析通过 `loop.getaddrinfo` 在线程池中进行，不阻塞事件循环；
+结果缓存 ttl 秒，过期后先返回旧地址，同时在后台重新解析，查询不会等待 DNS。
+解析失败也缓存 ttl 秒，期间直接抛出 `socket.gaierror`，不再重复等待 DNS。
+"""
+import asyncio
+import logging
+import socket
+from ipaddress import ip_address
+from time import time
+
+
+def is_ip(host: str) -> bool:
+    try:
+        ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class Resolver:
+    """主机名 => IP 地址
+
+    + `resolve`(async) : 解析主机名，优先使用缓存，缓存过期时在后台重新解析
+    + `resolve_all`(async) : 并发解析多个主机名，单个失败不影响其它
+    + `peek` : 只读取缓存，没有缓存时返回主机名本身
+    + `failed_at` : 主机名最近一次解析失败的时间
+    + `config` : 修改缓存时间
+    """
+
+    ttl: float
+    # host => (解析时间, IP)
+    _cache: dict[str, tuple[float, str]]
+    # host => 解析失败的时间，ttl 内不再重新解析
+    _failed: dict[str, float]
+    # 正在进行的解析，同一主机名同一时间只解析一次
+    _pending: dict[str, asyncio.Task]
+
+    def __init__(self, ttl: float = 300.0) -> None:
+        self.ttl = ttl
+        self._cache = dict()
+        self._failed = dict()
+        self._pending = dict()
+
+    def config(self, ttl: float | None = None):
+        if ttl:
+            logging.debug(f"reset dns ttl to {ttl!r}")
+            self.ttl = ttl
+
+    def peek(self, host: str) -> str:
+        cache = self._cache.get(host, None)
+        return cache[1] if cache is not None else host
+
+    def failed_at(self, host: str) -> float | None:
+        return self._failed.get(host, None)
+
+    async def resolve(self, host: str) -> str:
+        if is_ip(host):
+            return host
+        cache = self._cache.get(host, None)
+        if cache is None:
+            failed_at = self._failed.get(host, None)
+            if failed_at is not None and time() - failed_at <= self.ttl:
+                raise socket.gaierror(socket.EAI_NONAME, f"cannot resolve {host!r}")
+            return await self._refresh(host)
+        resolved_at, ip = cache
+        if time() - resolved_at > self.ttl:
+            self._refresh(host)
+        return ip
+
+    async def resolve_all(self, hosts: list[str]) -> dict[str, str]:
+        """返回 host => IP，解析失败的主机名不在结果中"""
+        hosts = [h for h in dict.fromkeys(hosts) if not is_ip(h)]
+        results = await asyncio.gather(
+            *(self._refresh(h) for h in hosts), return_exceptions=True
+        )
+        resolved = dict()
+        for host, r in zip(hosts, results):
+            if isinstance(r, Exception):
+                logging.warning(f"cannot resolve {host!r}: {r!r}")
+            else:
+                resolved[host] = r
+        return resolved
+
+    def _refresh(self, host: str) -> asyncio.Task:
+        task = self._pending.get(host, None)
+        if task is None:
+            task = self._pending[host] = asyncio.create_task(self._lookup(host))
+            task.add_done_callback(lambda _: self._pending.pop(host, None))
+        return task
+
+    async def _lookup(self, host: str) -> str:
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, None, type=socket.SOCK_DGRAM)
+        except OSError:
+            cache = self._cache.get(host, None)
+            if cache is None:
+                self._failed[host] = time()
+                raise
+            # 解析失败时继续使用旧地址，下次查询时再重试
+            logging.warning(f"cannot re-resolve {host!r}, keep {cache[1]!r}")
+            return cache[1]
+        ip = infos[0][4][0]
+        self._cache[host] = (time(), ip)
+        self._failed.pop(host, None)
+        logging.debug(f"resolved {host!r} => {ip!r}")
+        return ip
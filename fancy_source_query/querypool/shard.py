@@ -0,0 +1,258 @@
+"""多进程分片轮询
+
+服务器很多时，一个事件循环的大部分时间花在解包、构造结果对象和缓存维护上。
+分片模式下，服务器按 (host, port) 的一致性哈希分配给 N 个工作进程，
+每个工作进程有自己的事件循环、UDP 连接和域名解析，
+轮询结果以元组通过管道发回主进程，合并进主进程 `QueryPool` 的缓存、历史记录和玩家名录。
+
++ `HashRing` : 一致性哈希环，增删工作进程或服务器时只有少量服务器改变归属
++ `ShardPool` : 管理工作进程，`rebalance` 重新分配服务器，`poll` 并行轮询所有分片
+"""
+import asyncio
+import logging
+import multiprocessing
+from bisect import bisect
+from hashlib import blake2b
+from multiprocessing.connection import Connection
+from time import perf_counter, time
+from typing import Iterable
+
+from ..exceptions import QueryTimeout, ServerRestarting
+from .infos import A2S_TIMEOUT, PlayerInfo, ServerInfo, players_info, server_info
+from .resolver import Resolver
+
+Address = tuple[str, int]
+# 工作进程发回的一个服务器的结果：
+# (host, port, 查询时间, 服务器信息元组或 None, 玩家信息元组列表或 None)
+ShardResult = tuple[str, int, float, tuple | None, list[tuple] | None]
+# 每个工作进程在环上的虚拟节点数
+REPLICAS = 64
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """一致性哈希环，每个节点有 replicas 个虚拟节点"""
+
+    nodes: list[int]
+    _points: list[int]
+    _owners: list[int]
+
+    def __init__(self, nodes: Iterable[int], replicas: int = REPLICAS) -> None:
+        self.nodes = list(nodes)
+        ring = sorted(
+            (_hash(f"shard-{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self._points = [p for p, _ in ring]
+        self._owners = [n for _, n in ring]
+
+    def node_for(self, addr: Address) -> int:
+        i = bisect(self._points, _hash(f"{addr[0]}:{addr[1]}"))
+        return self._owners[i % len(self._owners)]
+
+    def assign(self, addrs: Iterable[Address]) -> dict[int, list[Address]]:
+        shards = {node: [] for node in self.nodes}
+        for addr in addrs:
+            shards[self.node_for(addr)].append(addr)
+        return shards
+
+
+async def _poll_one(
+    resolver: Resolver, host: str, port: int, timeout: float
+) -> ShardResult:
+    qtime = time()
+    sinfo, players = None, None
+    try:
+        ip = await resolver.resolve(host)
+    except OSError as e:
+        # 解析失败与查询超时一样返回空结果，由主进程写入占位结果
+        logging.warning(f"shard cannot resolve {host!r}: {e!r}")
+        return (host, port, qtime, sinfo, players)
+    try:
+        s = await server_info(ip, port, timeout)
+        sinfo = (s.name, s.players, s.max_players, s.map, s.vac, s.ping)
+    except (QueryTimeout, ServerRestarting):
+        pass
+    try:
+        players = [
+            (p.name, p.score, p.duration, p.index)
+            for p in await players_info(ip, port, timeout)
+        ]
+    except (QueryTimeout, ServerRestarting):
+        pass
+    return (host, port, qtime, sinfo, players)
+
+
+async def _worker_serve(conn: Connection):
+    loop = asyncio.get_running_loop()
+    resolver = Resolver()
+    closed = loop.create_future()
+
+    async def poll(addrs: list[Address], timeout: float):
+        results = await asyncio.gather(
+            *(_poll_one(resolver, h, p, timeout) for h, p in addrs),
+            return_exceptions=True,
+        )
+        for r in results:
+            if isinstance(r, BaseException):
+                logging.warning(f"shard poll failed: {r!r}")
+        conn.send([r for r in results if not isinstance(r, BaseException)])
+
+    def on_readable():
+        # 请求为 (地址列表, 超时时间)，None 表示结束
+        try:
+            request = conn.recv()
+        except EOFError:
+            request = None
+        if request is None:
+            loop.remove_reader(conn.fileno())
+            if not closed.done():
+                closed.set_result(None)
+            return
+        loop.create_task(poll(*request))
+
+    loop.add_reader(conn.fileno(), on_readable)
+    await closed
+
+
+def _worker_main(conn: Connection):
+    try:
+        asyncio.run(_worker_serve(conn))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+class ShardPool:
+    """把服务器分给多个工作进程轮询
+
+    + `rebalance` : 按一致性哈希重新分配服务器，只有服务器列表变化时才重新计算
+    + `poll` : 所有分片并行轮询一次，返回各服务器的结果
+    + `close` : 结束工作进程
+    """
+
+    workers: int
+    # 单次 A2S 请求的超时时间
+    timeout: float
+    ring: HashRing
+    shards: dict[int, list[Address]]
+    _procs: list[multiprocessing.Process]
+    _conns: list[Connection]
+    _addrs: tuple[Address, ...]
+    _lock: asyncio.Lock | None
+
+    def __init__(self, workers: int, timeout: float = A2S_TIMEOUT) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self.ring = HashRing(range(workers))
+        self.shards = {i: [] for i in range(workers)}
+        self._procs = []
+        self._conns = []
+        self._addrs = ()
+        self._lock = None
+
+    def start(self):
+        # 主进程中可能有事件循环和渲染线程，用 spawn 启动干净的子进程
+        ctx = multiprocessing.get_context("spawn")
+        for i in range(self.workers):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(
+                target=_worker_main, args=(child,), name=f"fsq-shard-{i}", daemon=True
+            )
+            proc.start()
+            child.close()
+            self._procs.append(proc)
+            self._conns.append(parent)
+        logging.info(f"started {self.workers} shard workers")
+
+    def rebalance(self, addrs: list[Address]) -> int:
+        """重新分配服务器，返回改变归属（包括新增）的服务器数量"""
+        addrs = tuple(addrs)
+        if addrs == self._addrs:
+            return 0
+        before = {a: i for i, shard in self.shards.items() for a in shard}
+        self.shards = self.ring.assign(addrs)
+        self._addrs = addrs
+        moved = sum(
+            1 for i, shard in self.shards.items() for a in shard if before.get(a) != i
+        )
+        sizes = [len(s) for s in self.shards.values()]
+        logging.info(f"rebalance shards {sizes}, {moved} servers moved")
+        return moved
+
+    async def _request(self, i: int, addrs: list[Address]) -> list[ShardResult]:
+        loop = asyncio.get_running_loop()
+        conn = self._conns[i]
+        waiter = loop.create_future()
+
+        def on_readable():
+            loop.remove_reader(conn.fileno())
+            try:
+                waiter.set_result(conn.recv())
+            except (EOFError, OSError) as e:
+                waiter.set_exception(e)
+
+        loop.add_reader(conn.fileno(), on_readable)
+        try:
+            conn.send((addrs, self.timeout))
+            return await waiter
+        finally:
+            loop.remove_reader(conn.fileno())
+
+    async def poll(self) -> list[ShardResult]:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            start = perf_counter()
+            replies = await asyncio.gather(
+                *(self._request(i, addrs) for i, addrs in self.shards.items() if addrs),
+                return_exceptions=True,
+            )
+            results = []
+            for r in replies:
+                if isinstance(r, BaseException):
+                    logging.error(f"shard worker failed: {r!r}")
+                else:
+                    results.extend(r)
+            logging.info(
+                f"polled {len(results)} servers in {len(self.shards)} shards, "
+                f"{(perf_counter() - start) * 1000:.1f}ms"
+            )
+            return results
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for proc in self._procs:
+            proc.join(timeout=1.0)
+            if proc.is_alive():
+                proc.terminate()
+        self._procs, self._conns = [], []
+
+
+def server_from_tuple(t: tuple) -> ServerInfo:
+    name, players, max_players, map_, vac, ping = t
+    return ServerInfo.construct(
+        name=name,
+        players=players,
+        max_players=max_players,
+        map=map_,
+        vac=vac,
+        ping=ping,
+    )
+
+
+def players_from_tuples(ts: list[tuple]) -> list[PlayerInfo]:
+    return [
+        PlayerInfo.construct(name=name, score=score, duration=duration, index=index)
+        for name, score, duration, index in ts
+    ]
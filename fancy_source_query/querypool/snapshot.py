@@ -0,0 +1,89 @@
+"""一组服务器的不可变快照
+
+`QueryPool.snapshot` 读取一组服务器的缓存（过期的先刷新），发布为一个 `Snapshot`：
+
++ 快照创建后不再修改（玩家列表也保存为元组），读者拿到的是同一时刻的一致数据，
+  不会读到刷新到一半的结果
++ 各服务器的缓存都没有变化时，返回上一个快照本身，不重新分配对象
++ 有变化时复制出新的快照（copy-on-write），未变化的服务器沿用原来的对象
++ 每个新快照有一个全局递增的版本号，可以作为格式化文本、图片等下游缓存的键
+
+超时的服务器的占位结果过期后会重新查询，查询时间变了但内容往往不变，
+这时沿用上一个快照的内容和版本号，只更新查询时间。
+"""
+from collections import OrderedDict
+from typing import NamedTuple
+
+from .infos import PlayerInfo, ServerInfo, ServerPair
+
+Address = tuple[str, int]
+# 最多保留的快照数量，超过时丢弃最久未使用的
+MAX_SNAPSHOTS = 256
+
+
+class Snapshot(NamedTuple):
+    "一组服务器的不可变快照，不含玩家信息时 players 和 pairs 为 None"
+    version: int
+    # 最晚查询时间
+    qtime: float
+    addrs: tuple[Address, ...]
+    # 各服务器 (服务器信息查询时间, 玩家信息查询时间)，用于判断缓存是否变化
+    stamps: tuple[tuple[float, float], ...]
+    servers: tuple[ServerInfo, ...]
+    players: tuple[tuple[PlayerInfo, ...], ...] | None
+    pairs: tuple[ServerPair, ...] | None
+
+
+class SnapshotStore:
+    """保存已发布的快照，(地址列表, 是否含玩家信息) => 最新的快照"""
+
+    version: int
+    _snapshots: OrderedDict[tuple[tuple[Address, ...], bool], Snapshot]
+
+    def __init__(self) -> None:
+        self.version = 0
+        self._snapshots = OrderedDict()
+
+    def get(self, addrs: tuple[Address, ...], players: bool) -> Snapshot | None:
+        return self._snapshots.get((addrs, players), None)
+
+    def publish(
+        self,
+        addrs: tuple[Address, ...],
+        sresults: list[tuple[float, ServerInfo]],
+        presults: list[tuple[float, list[PlayerInfo]]] | None,
+    ) -> Snapshot:
+        """根据查询结果发布快照，与上一个快照相同时直接返回上一个快照"""
+        if presults is None:
+            stamps = tuple((st, 0.0) for st, _ in sresults)
+        else:
+            stamps = tuple((st, pt) for (st, _), (pt, _) in zip(sresults, presults))
+        key = (addrs, presults is not None)
+        old = self._snapshots.get(key, None)
+        if old is not None:
+            self._snapshots.move_to_end(key)
+            if old.stamps == stamps:
+                return old
+        servers = tuple(s for _, s in sresults)
+        players, pairs = None, None
+        if presults is not None:
+            players = tuple(tuple(p) for _, p in presults)
+        qtime = max((t for stamp in stamps for t in stamp), default=0.0)
+        if old is not None and old.servers == servers and old.players == players:
+            # 只有查询时间变化（例如超时的服务器重新查询），内容不变，版本号不变
+            snapshot = old._replace(qtime=qtime, stamps=stamps)
+            self._snapshots[key] = snapshot
+            return snapshot
+        if players is not None:
+            pairs = tuple(
+                old.pairs[i]
+                if old is not None and old.stamps[i] == stamps[i]
+                else ServerPair.construct(server=servers[i], players=players[i])
+                for i in range(len(addrs))
+            )
+        self.version += 1
+        snapshot = Snapshot(self.version, qtime, addrs, stamps, servers, players, pairs)
+        self._snapshots[key] = snapshot
+        if len(self._snapshots) > MAX_SNAPSHOTS:
+            self._snapshots.popitem(last=False)
+        return snapshot
@@ -35,6 +35,12 @@ class ServerGroup:
         self.servers[server.name] = server
         server.group = self
 
+    def remove(self, name: str) -> Server | None:
+        server = self.servers.pop(name, None)
+        if server is not None:
+            server.group = None
+        return server
+
     def __str__(self) -> str:
         servers = "\n".join(str(s) for s in self.servers.values())
         return f"ServerGroup({self.name}):\n{servers}"
@@ -67,3 +73,45 @@ def build_server_group_graph(
     debugtext = "\n".join(str(g) for g in groups.values())
     logging.debug(f"build server group graph: {debugtext}")
     return groups, servers
+
+
+def merge_servers(
+    groups: dict[str, ServerGroup],
+    servers: dict[str, Server],
+    old_conf: list[ServerConfig],
+    new_conf: list[ServerConfig],
+) -> tuple[int, int]:
+    """将服务器配置从 old_conf 更新为 new_conf，只增删有变化的服务器，
+    其它服务器对象保持不变，返回 (新增数量, 删除数量)。
+
+    与已有服务器重名的新服务器不会加入，也不会删除不是由 old_conf 加入的服务器。
+    """
+    old = {(c.group, c.name, c.host, c.port) for c in old_conf}
+    new = {(c.group, c.name, c.host, c.port) for c in new_conf}
+    removed = 0
+    for gname, name, host, port in old - new:
+        server = servers.get(name, None)
+        if server is None or server.group is None or server.group.name != gname:
+            continue
+        if (server.host, server.port) != (host, port):
+            continue
+        server.group.remove(name)
+        del servers[name]
+        removed += 1
+    added = 0
+    for conf in new_conf:
+        if (conf.group, conf.name, conf.host, conf.port) in old:
+            continue
+        if conf.group not in groups:
+            logging.warning(f"orphan server, skip adding to group: {conf!r}")
+            continue
+        if conf.name in servers:
+            logging.warning(f"duplicated server name, skip: {conf!r}")
+            continue
+        server = Server(name=conf.name, host=conf.host, port=conf.port)
+        groups[conf.group].add(server)
+        servers[server.name] = server
+        added += 1
+    if added or removed:
+        logging.info(f"merge servers: {added} added, {removed} removed")
+    return added, removed
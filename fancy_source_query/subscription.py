@@ -0,0 +1,206 @@
+"""订阅服务器事件：玩家进入、服务器满人、换图
+
+所有订阅共用一个轮询器，每轮只查询被订阅的服务器（经过查询池，与用户查询共用缓存），
+对比前后两次的服务器信息和玩家名单，生成需要推送的通知。
+轮询的开销只与被订阅的服务器数量有关，与用户发送查询的频率无关。
+配置了守护进程时，通过守护进程查询，与其它客户端共用守护进程的缓存。
+"""
+import asyncio
+import logging
+import re
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel, parse_file_as
+
+from .interfaces import WHITESPACE, FancySourceQuery
+from .interfaces.daemon import DaemonClient
+from .querypool import is_placeholder
+from .querypool.infos import PlayerInfo, ServerInfo
+from .server_group import Server
+
+
+class Subscription(BaseModel):
+    """一条订阅
+
+    + kind : player 玩家进入；full 服务器满人；map 换图
+    + session : 推送目标，群号或私聊 QQ 号
+    + private : 是否私聊
+    + group : 服务器组名
+    + target : player 为玩家名正则；full / map 为服务器名，为空时表示组内所有服务器
+    """
+
+    kind: Literal["player", "full", "map"]
+    session: str
+    private: bool = False
+    group: str
+    target: str = ""
+
+
+class SubscriptionManager:
+    """管理订阅并轮询被订阅的服务器
+
+    + `add` / `remove` / `of_session` : 增删查订阅，修改后自动保存
+    + `poll`(async) : 轮询一次，返回 (session, private) => 通知文本列表
+    + `run`(async) : 持续轮询，通过 notify 回调推送通知
+    """
+
+    path: str | None
+    subs: list[Subscription]
+    # (host, port) => (上次的服务器信息, 上次的玩家名单，未跟踪玩家时为 None)
+    _last: dict[tuple[str, int], tuple[ServerInfo, set[str] | None]]
+    _patterns: dict[str, re.Pattern]
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path
+        self.subs = list()
+        self._last = dict()
+        self._patterns = dict()
+        if path and Path(path).exists():
+            self.subs = parse_file_as(list[Subscription], path)
+            logging.info(f"loaded {len(self.subs)} subscriptions from {path!r}")
+
+    def save(self):
+        if not self.path:
+            return
+        data = "[{}]".format(",".join(s.json() for s in self.subs))
+        Path(self.path).write_text(data, encoding="utf-8")
+
+    def add(self, sub: Subscription):
+        if sub.kind == "player":
+            self.pattern(sub.target)
+        self.subs.append(sub)
+        self.save()
+
+    def remove(self, session: str, index: int | None = None) -> int:
+        """删除某会话的第 index 条订阅（从 0 开始），index 为 None 时全部删除，
+        返回删除的数量"""
+        mine = self.of_session(session)
+        if index is None:
+            removed = mine
+        elif 0 <= index < len(mine):
+            removed = [mine[index]]
+        else:
+            removed = []
+        for sub in removed:
+            self.subs.remove(sub)
+        if removed:
+            self.save()
+        return len(removed)
+
+    def of_session(self, session: str) -> list[Subscription]:
+        return [s for s in self.subs if s.session == session]
+
+    def pattern(self, regex: str) -> re.Pattern:
+        pat = self._patterns.get(regex, None)
+        if pat is None:
+            pat = self._patterns[regex] = re.compile(regex, re.IGNORECASE)
+        return pat
+
+    def watched(
+        self, fsq: FancySourceQuery
+    ) -> dict[tuple[str, int], list[tuple[Server, Subscription]]]:
+        """被订阅的服务器地址 => (服务器, 订阅) 列表，
+        已解析的域名替换为 IP，指向同一服务器的不同域名共用一个地址"""
+        peek = fsq.query_pool.resolver.peek
+        watched = dict()
+        for sub in self.subs:
+            group = fsq.server_group.get(sub.group, None)
+            if group is None:
+                continue
+            if sub.kind != "player" and sub.target:
+                server = group.servers.get(sub.target, None)
+                servers = [server] if server is not None else []
+            else:
+                servers = list(group.servers.values())
+            for server in servers:
+                addr = (peek(server.host), server.port)
+                watched.setdefault(addr, []).append((server, sub))
+        return watched
+
+    async def poll(
+        self, fsq: FancySourceQuery, backend: DaemonClient | None = None
+    ) -> dict[tuple[str, bool], list[str]]:
+        """轮询一次，fsq 提供服务器组和地图名，backend 为守护进程客户端时通过其查询"""
+        watched = self.watched(fsq)
+        query = (backend if backend is not None else fsq).query_addresses
+        # 只对有玩家订阅的服务器查询玩家
+        tracked, untracked = [], []
+        for addr, subs in watched.items():
+            if any(sub.kind == "player" for _, sub in subs):
+                tracked.append(addr)
+            else:
+                untracked.append(addr)
+        results: list[tuple[tuple[str, int], ServerInfo, list[PlayerInfo] | None]] = []
+        if tracked:
+            r = await query(tracked, True)
+            results += [(a, p.server, p.players) for a, p in zip(tracked, r.result)]
+        if untracked:
+            r = await query(untracked, False)
+            results += [(a, s, None) for a, s in zip(untracked, r.result)]
+        notices: dict[tuple[str, bool], list[str]] = dict()
+        for addr, sinfo, pinfo in results:
+            if is_placeholder(sinfo):
+                # 查询失败，保留上次的状态
+                continue
+            last = self._last.get(addr, None)
+            names = None if pinfo is None else {p.name for p in pinfo}
+            if names is not None and not names and sinfo.players > 0:
+                # 服务器有人但玩家查询失败，沿用上次的名单
+                names = last[1] if last is not None else None
+            self._last[addr] = (sinfo, names)
+            if last is None:
+                continue
+            for server, sub in watched[addr]:
+                for text in self.check(fsq, server, sub, last, (sinfo, names)):
+                    notices.setdefault((sub.session, sub.private), []).append(text)
+        for addr in set(self._last) - set(watched):
+            del self._last[addr]
+        return notices
+
+    def check(
+        self,
+        fsq: FancySourceQuery,
+        server: Server,
+        sub: Subscription,
+        old: tuple[ServerInfo, set[str] | None],
+        new: tuple[ServerInfo, set[str] | None],
+    ) -> list[str]:
+        """对比前后两次状态，返回该订阅需要推送的通知"""
+        (osinfo, onames), (nsinfo, nnames) = old, new
+        if sub.kind == "player":
+            if onames is None or nnames is None:
+                return []
+            pat = self.pattern(sub.target)
+            joined = sorted(
+                n for n in nnames - onames if pat.search(WHITESPACE.sub("", n))
+            )
+            return [f"【{n}】进入了 {server.name}" for n in joined]
+        elif sub.kind == "full":
+            was_full = osinfo.max_players > 0 and osinfo.players >= osinfo.max_players
+            is_full = nsinfo.max_players > 0 and nsinfo.players >= nsinfo.max_players
+            if is_full and not was_full:
+                return [f"{server.name} 满人了({nsinfo.players}/{nsinfo.max_players})"]
+        elif sub.kind == "map":
+            if nsinfo.map != osinfo.map:
+                oname = fsq.ifmt.guess_map(osinfo.map) or osinfo.map
+                nname = fsq.ifmt.guess_map(nsinfo.map) or nsinfo.map
+                return [f"{server.name} 换图：{oname} → {nname}"]
+        return []
+
+    async def run(
+        self,
+        fsq: FancySourceQuery,
+        notify,
+        interval: float,
+        backend: DaemonClient | None = None,
+    ):
+        """每隔 interval 秒轮询一次，对每个推送目标调用 `await notify(session, private, text)`"""
+        while True:
+            try:
+                notices = await self.poll(fsq, backend)
+                for (session, private), texts in notices.items():
+                    await notify(session, private, "\n".join(texts))
+            except Exception:
+                logging.exception("subscription poll failed")
+            await asyncio.sleep(interval)
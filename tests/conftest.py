@@ -0,0 +1,15 @@
+from fancy_source_query.querypool.infos import ServerInfo
+
+
+def make_sinfo(
+    name: str = "A1", players: int = 1, map: str = "c1m1_hotel", max_players: int = 8
+) -> ServerInfo:
+    """测试用的服务器信息"""
+    return ServerInfo(
+        name=name,
+        players=players,
+        max_players=max_players,
+        map=map,
+        vac=True,
+        ping=1.0,
+    )
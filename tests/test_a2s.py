@@ -0,0 +1,207 @@
+import asyncio
+import bz2
+import random
+import struct
+from time import perf_counter
+from zlib import crc32
+
+import pytest
+
+from fancy_source_query.exceptions import A2SProtocolError
+from fancy_source_query.querypool import QueryPool, a2s
+
+
+def cstr(s: str) -> bytes:
+    return s.encode() + b"\x00"
+
+
+def info_packet(name: str, map_: str, players: int, max_players: int, vac: int):
+    return (
+        a2s.SINGLE
+        + b"I\x11"
+        + cstr(name)
+        + cstr(map_)
+        + cstr("left4dead2")
+        + cstr("Left 4 Dead 2")
+        + struct.pack("<HBBBccBB", 550, players, max_players, 0, b"d", b"l", 0, vac)
+        + b"\x00"
+    )
+
+
+def players_packet(players: list[tuple[int, str, int, float]]) -> bytes:
+    body = b"".join(
+        struct.pack("<B", i) + cstr(n) + struct.pack("<lf", s, d)
+        for i, n, s, d in players
+    )
+    return a2s.SINGLE + b"D" + struct.pack("<B", len(players)) + body
+
+
+def rules_packet(rules: list[tuple[str, str]]) -> bytes:
+    body = b"".join(cstr(k) + cstr(v) for k, v in rules)
+    return a2s.SINGLE + b"E" + struct.pack("<H", len(rules)) + body
+
+
+def split(payload: bytes, size: int, pid: int = 7) -> list[bytes]:
+    chunks = [payload[i : i + size] for i in range(0, len(payload), size)]
+    return [
+        a2s.SPLIT + struct.pack("<lBBH", pid, len(chunks), n, 1248) + c
+        for n, c in enumerate(chunks)
+    ]
+
+
+def random_rules(rng: random.Random, n: int) -> list[tuple[str, str]]:
+    return [(f"rule_{i}_{rng.random()}", "值" * rng.randint(0, 8)) for i in range(n)]
+
+
+def test_parse_roundtrip():
+    info = a2s.parse_info(info_packet("\ufeff服务器", "c1m1_hotel", 3, 8, 1))
+    assert info == a2s.Info("\ufeff服务器", "c1m1_hotel", 3, 8, True)
+
+    players = [(0, "玩家", 10, 12.5), (1, "", -3, 0.0)]
+    assert a2s.parse_players(players_packet(players)) == players
+    # 声明的人数多于实际数据时只返回完整的部分
+    truncated = bytearray(players_packet(players))
+    truncated[5] = 5
+    assert a2s.parse_players(truncated) == players
+
+    rules = [("sv_cheats", "0"), ("mp_gamemode", "coop")]
+    assert a2s.parse_rules(rules_packet(rules)) == rules
+    assert a2s.parse_challenge(a2s.SINGLE + b"A" + struct.pack("<l", -42)) == -42
+
+
+def test_split_reassembly():
+    rng = random.Random(34)
+    payload = rules_packet(random_rules(rng, 200))
+    packets = split(payload, 500)
+    rng.shuffle(packets)
+    asm = a2s.SplitAssembler()
+    results = [asm.feed(p) for p in packets]
+    assert all(r is None for r in results[:-1])
+    assert bytes(results[-1]) == payload
+
+    # GoldSrc：9 字节分片头，序号和总数共用一个字节
+    chunks = [payload[i : i + 700] for i in range(0, len(payload), 700)]
+    packets = [
+        a2s.SPLIT + struct.pack("<lB", 9, n << 4 | len(chunks)) + c
+        for n, c in enumerate(chunks)
+    ]
+    asm = a2s.SplitAssembler()
+    results = [asm.feed(p) for p in reversed(packets)]
+    assert bytes(results[-1]) == payload
+
+    # bz2 压缩
+    data = bz2.compress(payload)
+    chunks = [data[i : i + 300] for i in range(0, len(data), 300)]
+    chunks[0] = struct.pack("<lL", len(payload), crc32(payload)) + chunks[0]
+    packets = [
+        a2s.SPLIT + struct.pack("<lBBH", -5, len(chunks), n, 1248) + c
+        for n, c in enumerate(chunks)
+    ]
+    asm = a2s.SplitAssembler()
+    results = [asm.feed(p) for p in packets]
+    assert bytes(results[-1]) == payload
+
+
+def test_fuzz_parsers():
+    """任意损坏的数据只能抛出 A2SProtocolError"""
+    rng = random.Random(20231)
+    samples = [
+        info_packet("name", "map", 1, 2, 0),
+        players_packet([(i, f"p{i}", i, 1.0) for i in range(10)]),
+        rules_packet(random_rules(rng, 20)),
+    ]
+    parsers = [a2s.parse_info, a2s.parse_players, a2s.parse_rules]
+    for _ in range(3000):
+        data = bytearray(rng.choice(samples))
+        op = rng.randrange(3)
+        if op == 0:
+            data = data[: rng.randrange(len(data))]
+        elif op == 1:
+            for _ in range(rng.randint(1, 8)):
+                data[rng.randrange(len(data))] = rng.randrange(256)
+        else:
+            data = bytearray(rng.randbytes(rng.randrange(64)))
+        for parse in parsers:
+            try:
+                parse(data)
+            except A2SProtocolError:
+                pass
+
+    for _ in range(500):
+        packets = split(rules_packet(random_rules(rng, 30)), 200, pid=rng.randrange(9))
+        packets = [bytearray(p) for p in packets]
+        p = rng.choice(packets)
+        p[rng.randrange(len(p))] = rng.randrange(256)
+        asm = a2s.SplitAssembler()
+        try:
+            for p in packets:
+                asm.feed(bytes(p))
+        except A2SProtocolError:
+            pass
+
+
+class StandIn(asyncio.DatagramProtocol):
+    """本地的假服务器：先要求 challenge，然后分片返回规则"""
+
+    def __init__(self, payload: bytes) -> None:
+        self.payload = payload
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data[4:5] == b"T":
+            self.transport.sendto(info_packet("A1", "c2m1_highway", 4, 8, 1), addr)
+        elif data[5:] == struct.pack("<l", -1):
+            self.transport.sendto(a2s.SINGLE + b"A" + struct.pack("<l", 99), addr)
+        elif data[5:] == struct.pack("<l", 99):
+            for p in reversed(split(self.payload, 400)):
+                self.transport.sendto(p, addr)
+
+
+@pytest.mark.asyncio
+async def test_udp_client():
+    rules = random_rules(random.Random(1), 100)
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: StandIn(rules_packet(rules)), local_addr=("127.0.0.1", 0)
+    )
+    host, port = transport.get_extra_info("sockname")
+    try:
+        info, ping = await a2s.query_info(host, port, 1.0)
+        assert info.map == "c2m1_highway" and ping >= 0
+        assert await a2s.query_rules(host, port, 1.0) == rules
+    finally:
+        transport.close()
+
+
+class Misbehaving(asyncio.DatagramProtocol):
+    """不回应服务器信息，用玩家列表回应规则查询"""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data[4:5] == b"V":
+            self.transport.sendto(players_packet([]), addr)
+
+
+@pytest.mark.asyncio
+async def test_query_pool_failures_become_placeholders():
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        Misbehaving, local_addr=("127.0.0.1", 0)
+    )
+    host, port = transport.get_extra_info("sockname")
+    pool = QueryPool()
+    pool.config(timeout=0.2)
+    try:
+        start = perf_counter()
+        _, sinfo = await pool.server_info(host, port)
+        # 按配置的超时时间返回超时占位结果
+        assert sinfo.name == "超时"
+        assert perf_counter() - start < 1.0
+        _, ruleset = await pool.rules_info(host, port)
+        assert ruleset.digest == "" and ruleset.rules == []
+    finally:
+        transport.close()
@@ -0,0 +1,101 @@
+import asyncio
+import sqlite3
+from time import perf_counter
+
+import pytest
+
+import fancy_source_query.querypool as querypool
+from fancy_source_query.exceptions import QueryTimeout
+from fancy_source_query.querypool import QueryPool
+from fancy_source_query.querypool.cache import MemoryCache, SQLiteCache
+
+from conftest import make_sinfo
+
+KEY = ("server", "127.0.0.1", 27015)
+
+
+def test_memory_cache_lease():
+    cache = MemoryCache()
+    assert cache.get(KEY) is None
+    cache.set(KEY, 1.0, make_sinfo("a"))
+    assert cache.get(KEY)[1].name == "a"
+    assert cache.acquire(KEY, 10.0)
+    assert not cache.acquire(KEY, 10.0)
+    cache.release(KEY)
+    assert cache.acquire(KEY, 10.0)
+
+
+def test_sqlite_cache_shared(tmp_path):
+    path = (tmp_path / "cache.sqlite3").as_posix()
+    a, b = SQLiteCache(path), SQLiteCache(path)
+    a.set(KEY, 1.0, make_sinfo("a"))
+    qtime, value = b.get(KEY)
+    assert qtime == 1.0 and value == make_sinfo("a")
+    assert a.acquire(KEY, 10.0)
+    assert not b.acquire(KEY, 10.0)
+    # 只有持有者能释放租约
+    b.release(KEY)
+    assert not b.acquire(KEY, 10.0)
+    a.release(KEY)
+    assert b.acquire(KEY, 10.0)
+    # 过期的租约可以被抢占
+    assert a.acquire(("players", "127.0.0.1", 1), -1.0)
+    assert b.acquire(("players", "127.0.0.1", 1), 10.0)
+    a.close()
+    b.close()
+
+
+@pytest.mark.asyncio
+async def test_query_pool_single_flight():
+    pool = QueryPool()
+    calls = []
+
+    async def new_server_info(host: str, port: int):
+        calls.append((host, port))
+        await asyncio.sleep(0.1)
+        pool._QueryPool__cache.set(("server", host, port), 1e12, make_sinfo("new"))
+        return 1e12, make_sinfo("new")
+
+    pool.new_server_info = new_server_info
+    results = await asyncio.gather(
+        *(pool.server_info("127.0.0.1", 27015) for _ in range(5))
+    )
+    assert len(calls) == 1
+    assert all(r[1].name == "new" for r in results)
+
+
+def test_sqlite_cache_busy_does_not_block(tmp_path):
+    path = (tmp_path / "cache.sqlite3").as_posix()
+    cache = SQLiteCache(path)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    start = perf_counter()
+    # 其它进程持有写锁时，放弃写入和取得租约，而不是等待
+    cache.set(KEY, 1.0, make_sinfo("a"))
+    assert not cache.acquire(KEY, 10.0)
+    assert perf_counter() - start < 1.0
+    other.execute("ROLLBACK")
+    assert cache.acquire(KEY, 10.0)
+    other.close()
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_query_pool_caches_timeouts(monkeypatch):
+    calls = []
+
+    async def dead_server(host: str, port: int, timeout: float):
+        calls.append((host, port))
+        await asyncio.sleep(0.1)
+        raise QueryTimeout({"host": host, "port": port})
+
+    monkeypatch.setattr(querypool, "server_info", dead_server)
+    pool = QueryPool()
+    results = await asyncio.gather(
+        *(pool.server_info("127.0.0.1", 27015) for _ in range(5))
+    )
+    # 等待租约的调用者直接得到占位结果，不再重新查询
+    assert len(calls) == 1
+    assert all(r[1].name == "超时" for r in results)
+    assert await pool.server_info("127.0.0.1", 27015) == results[0]
+    assert len(calls) == 1
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from fancy_source_query.coalesce import Coalescer, RateLimiter, SessionDebouncer
+
+
+@pytest.mark.asyncio
+async def test_coalescer_shares_inflight_and_recent():
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    coalescer = Coalescer(window=10)
+    results = await asyncio.gather(*(coalescer.get("k", compute) for _ in range(5)))
+    assert results == [1] * 5
+    assert await coalescer.get("k", compute) == 1
+    assert await coalescer.get("other", compute) == 2
+
+    # 窗口为 0 时只合并进行中的计算
+    coalescer.window = 0
+    await asyncio.sleep(0.01)
+    assert await coalescer.get("k", compute) == 3
+
+
+@pytest.mark.asyncio
+async def test_coalescer_does_not_keep_errors():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def ok():
+        return "ok"
+
+    coalescer = Coalescer(window=10)
+    results = await asyncio.gather(
+        coalescer.get("k", fail), coalescer.get("k", ok), return_exceptions=True
+    )
+    assert all(isinstance(r, ValueError) for r in results)
+    assert await coalescer.get("k", ok) == "ok"
+
+
+def test_session_debouncer():
+    debouncer = SessionDebouncer()
+    assert debouncer.join("k", "1")
+    assert not debouncer.join("k", "2")
+    assert not debouncer.join("k", "1")
+    assert debouncer.finish("k") == ["1", "2"]
+    # 回复发出后的相同请求会再次得到回复
+    assert debouncer.join("k", "3")
+    debouncer.discard("k")
+    assert debouncer.join("k", "3")
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(limit=2, period=60)
+    assert limiter.allow("a") and limiter.allow("a")
+    assert not limiter.allow("a")
+    assert limiter.allow("b")
+    # 每个周期只提示一次
+    assert limiter.warn("a") and not limiter.warn("a")
+    unlimited = RateLimiter(limit=0, period=60)
+    assert all(unlimited.allow("a") for _ in range(20))
+    assert unlimited.active() == ["a"]
@@ -0,0 +1,65 @@
+import asyncio
+import re
+
+import pytest
+
+from fancy_source_query.exceptions import DaemonError, ObjectNotFound
+from fancy_source_query.interfaces import QueryResult
+from fancy_source_query.interfaces.daemon import DaemonClient, DaemonServer
+
+from conftest import make_sinfo
+
+
+class FakeFSQ:
+    async def query(self, gname: str | None, qstr: str) -> QueryResult:
+        if gname == "missing":
+            raise ObjectNotFound("server group not found", gname)
+        await asyncio.sleep(0.05 if qstr == "slow" else 0)
+        sinfo = make_sinfo(qstr)
+        return QueryResult(tag="s", qtime=1.0, result=sinfo)
+
+    async def search_player(self, player_regex: str, gname: str | None):
+        re.compile(player_regex)
+        return QueryResult(tag="p", qtime=1.0, result=None)
+
+    def unique_addresses(self):
+        return []
+
+    async def keep_discovering(self):
+        await asyncio.Event().wait()
+
+    def close_shards(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_daemon_roundtrip(tmp_path):
+    path = (tmp_path / "fsq.sock").as_posix()
+    server = DaemonServer(FakeFSQ(), path)
+    server.keep_warm = asyncio.Event().wait
+    task = asyncio.create_task(server.serve())
+    for _ in range(100):
+        if (tmp_path / "fsq.sock").exists():
+            break
+        await asyncio.sleep(0.01)
+
+    client = DaemonClient(path)
+    # 同一连接上的并发请求按 id 对应
+    slow, fast = await asyncio.gather(
+        client.query("A", "slow"), client.query("A", "fast")
+    )
+    assert slow.result.name == "slow"
+    assert fast.result.name == "fast"
+    with pytest.raises(ObjectNotFound):
+        await client.query("missing", "")
+    with pytest.raises(re.error):
+        await client.search_player("(", "A")
+    with pytest.raises(DaemonError):
+        await client.call("no_such_method")
+
+    # serve 仍在运行，没有因为异常提前结束
+    assert not task.done()
+    await client.close()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
@@ -0,0 +1,60 @@
+import re
+
+import pytest
+
+from fancy_source_query.querypool.directory import PlayerDirectory, normalize_name
+from fancy_source_query.querypool.infos import PlayerInfo
+
+
+def player(name: str, duration: float) -> PlayerInfo:
+    return PlayerInfo(name=name, score=0, duration=duration, index=0)
+
+
+def test_normalize_name():
+    assert normalize_name(" Ｃｏｆｆｅｅ  Cat ") == "coffeecat"
+
+
+@pytest.mark.asyncio
+async def test_directory_last_seen(tmp_path):
+    path = (tmp_path / "players.sqlite3").as_posix()
+    directory = PlayerDirectory(path, flush_interval=3600)
+    directory.record("127.0.0.1", 1, 100.0, [player("CoffeeCat", 60), player("", 1)])
+    directory.record("127.0.0.1", 1, 200.0, [player("CoffeeCat", 160)])
+    # 重新连接，在线时长从头计算
+    directory.record("127.0.0.1", 1, 300.0, [player("CoffeeCat", 30)])
+    directory.record("127.0.0.1", 2, 250.0, [player("咖啡猫", 10)])
+    directory.record("127.0.0.1", 3, 260.0, [player("Coffee Cat", 10)])
+
+    (seen,) = await directory.last_seen("coffee", addrs={("127.0.0.1", 1)})
+    # 与在线玩家的搜索一样忽略空格
+    assert [s.port for s in await directory.last_seen("coffeecat")] == [1, 3]
+    assert (seen.host, seen.port) == ("127.0.0.1", 1)
+    assert (seen.first_seen, seen.last_seen, seen.duration) == (100.0, 300.0, 190.0)
+    # 少于 3 个字符时不经过全文索引
+    assert [s.name for s in await directory.last_seen("咖啡")] == ["咖啡猫"]
+    assert await directory.last_seen("coffee", addrs={("127.0.0.1", 2)}) == []
+    assert await directory.last_seen("nobody") == []
+    directory.close()
+
+    # 重新打开后数据仍在，累计时长继续增加
+    directory = PlayerDirectory(path)
+    directory.record("127.0.0.1", 1, 400.0, [player("coffeecat", 50)])
+    (seen,) = await directory.last_seen("CoffeeCat", addrs={("127.0.0.1", 1)})
+    assert (seen.name, seen.last_seen, seen.duration) == ("coffeecat", 400.0, 240.0)
+    directory.close()
+
+
+@pytest.mark.asyncio
+async def test_directory_last_seen_matching(tmp_path):
+    directory = PlayerDirectory((tmp_path / "players.sqlite3").as_posix())
+    directory.record("127.0.0.1", 1, 100.0, [player("bob", 1)])
+    directory.record("127.0.0.1", 1, 150.0, [player("Bib Obb", 1)])
+    directory.record("127.0.0.1", 2, 200.0, [player("bab", 1)])
+    pat = re.compile("^b.b", re.IGNORECASE)
+    addrs = {("127.0.0.1", 1), ("127.0.0.1", 2)}
+    seen = await directory.last_seen_matching(lambda n: pat.search(n), addrs)
+    assert [s.name for s in seen] == ["bab", "Bib Obb", "bob"]
+    (seen,) = await directory.last_seen_matching(pat.search, {("127.0.0.1", 2)}, 1)
+    assert seen.port == 2
+    assert await directory.last_seen_matching(pat.search, set()) == []
+    directory.close()
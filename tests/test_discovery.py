@@ -0,0 +1,157 @@
+import asyncio
+import socket
+import struct
+
+import pytest
+
+from fancy_source_query.config import DiscoveryConfig, ServerConfig, ServerGroupConfig
+from fancy_source_query.discovery import Discovery
+from fancy_source_query.exceptions import MasterProtocolError
+from fancy_source_query.querypool import a2s, master
+from fancy_source_query.server_group import build_server_group_graph, merge_servers
+
+
+def page_packet(addrs: list[tuple[str, int]]) -> bytes:
+    return master.RESPONSE_HEADER + b"".join(
+        master.ADDRESS.pack(socket.inet_aton(h), p) for h, p in addrs
+    )
+
+
+def info_packet(name: str) -> bytes:
+    return (
+        a2s.SINGLE
+        + b"I\x11"
+        + name.encode()
+        + b"\x00c1m1_hotel\x00left4dead2\x00Left 4 Dead 2\x00"
+        + struct.pack("<HBBBccBB", 550, 1, 8, 0, b"d", b"l", 0, 0)
+        + b"\x00"
+    )
+
+
+def test_codec():
+    filter_ = master.build_filter("left4dead2", "*社区*", "\\empty\\1")
+    assert filter_ == "\\gamedir\\left4dead2\\name_match\\*社区*\\empty\\1"
+    request = master.build_request(0xFF, ("1.2.3.4", 27015), filter_)
+    assert request.startswith(b"\x31\xff1.2.3.4:27015\x00\\gamedir")
+    addrs = [("1.2.3.4", 27015), master.SEED]
+    assert master.parse_addresses(page_packet(addrs)) == addrs
+    with pytest.raises(MasterProtocolError):
+        master.parse_addresses(page_packet(addrs)[:-1])
+
+
+class MasterStandIn(asyncio.DatagramProtocol):
+    """每页返回 page_size 个地址，以请求中的起点之后的地址开始"""
+
+    def __init__(self, addrs: list[tuple[str, int]], page_size: int) -> None:
+        self.addrs = addrs
+        self.page_size = page_size
+        self.requests = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        seed, filter_ = data[2:].split(b"\x00")[:2]
+        self.requests.append((seed.decode(), filter_.decode()))
+        host, port = seed.decode().split(":")
+        seed = (host, int(port))
+        start = 0 if seed == master.SEED else self.addrs.index(seed) + 1
+        page = self.addrs[start : start + self.page_size]
+        if start + self.page_size >= len(self.addrs):
+            page = page + [master.SEED]
+        self.transport.sendto(page_packet(page), addr)
+
+
+class A2SStandIn(asyncio.DatagramProtocol):
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(info_packet(self.name), addr)
+
+
+@pytest.mark.asyncio
+async def test_discover_from_local_master():
+    loop = asyncio.get_running_loop()
+    transports = []
+    live = []
+    for name in ("社区一服", "社区二服", "社区三服"):
+        t, _ = await loop.create_datagram_endpoint(
+            lambda name=name: A2SStandIn(name), local_addr=("127.0.0.1", 0)
+        )
+        transports.append(t)
+        live.append(t.get_extra_info("sockname")[:2])
+    # 没有响应的地址在探测后被排除
+    dead = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    dead.bind(("127.0.0.1", 0))
+    addrs = [live[0], dead.getsockname(), live[1], live[2]]
+    stand_in = MasterStandIn(addrs, page_size=2)
+    t, _ = await loop.create_datagram_endpoint(
+        lambda: stand_in, local_addr=("127.0.0.1", 0)
+    )
+    transports.append(t)
+    mhost, mport = t.get_extra_info("sockname")[:2]
+    try:
+        found = await master.query_master(mhost, mport, "\\gamedir\\left4dead2")
+        assert found == addrs
+        assert [s for s, _ in stand_in.requests] == [
+            "0.0.0.0:0",
+            f"{addrs[1][0]}:{addrs[1][1]}",
+        ]
+        assert await master.query_master(mhost, mport, "", limit=3) == addrs[:3]
+
+        conf = DiscoveryConfig(
+            group="B", name_prefix="B社区", master=f"{mhost}:{mport}", max_servers=8
+        )
+        discovery = Discovery()
+        servers = await discovery.discover_all([conf], timeout=0.3, concurrency=2)
+        assert [(s.name, s.host, s.port) for s in servers] == [
+            ("B社区1", *live[0]),
+            ("B社区2", *live[1]),
+            ("B社区3", *live[2]),
+        ]
+        # 主服务器查询失败时沿用上一次的结果，名称保持不变
+        transports.pop().close()
+        assert await discovery.discover_all([conf], 0.2, 2) == servers
+    finally:
+        dead.close()
+        for t in transports:
+            t.close()
+
+
+def test_merge_servers_incremental():
+    groups, servers = build_server_group_graph(
+        [ServerGroupConfig(name="A", related_sessions=[])],
+        [ServerConfig(group="A", name="A1", host="127.0.0.1", port=1)],
+    )
+    a1 = servers["A1"]
+    old = [
+        ServerConfig(group="A", name="A2", host="127.0.0.1", port=2),
+        ServerConfig(group="A", name="A3", host="127.0.0.1", port=3),
+    ]
+    assert merge_servers(groups, servers, [], old) == (2, 0)
+    a2 = servers["A2"]
+    new = [
+        old[0],
+        ServerConfig(group="A", name="A4", host="127.0.0.1", port=4),
+        # 与已有服务器重名，不加入
+        ServerConfig(group="A", name="A1", host="127.0.0.1", port=5),
+    ]
+    assert merge_servers(groups, servers, old, new) == (1, 1)
+    assert list(servers) == ["A1", "A2", "A4"]
+    assert list(groups["A"].servers) == ["A1", "A2", "A4"]
+    # 未变化的服务器对象保持不变
+    assert servers["A1"] is a1 and servers["A2"] is a2
+    assert servers["A1"].port == 1
+
+
+def test_discovered_names_skip_taken():
+    conf = DiscoveryConfig(group="A", master="127.0.0.1:27010")
+    discovery = Discovery()
+    taken = {"A1", "A3"}
+    names = [discovery.name_of(conf, "10.0.0.1", p, taken) for p in (1, 2, 3)]
+    assert names == ["A2", "A4", "A5"]
+    assert discovery.name_of(conf, "10.0.0.1", 1, taken) == "A2"
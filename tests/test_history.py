@@ -0,0 +1,50 @@
+from fancy_source_query.querypool.history import (
+    HistoryStore,
+    Ring,
+    map_popularity,
+    peak_hours,
+)
+
+from conftest import make_sinfo
+
+
+def test_ring_overwrites_oldest():
+    ring = Ring(3)
+    for i in range(5):
+        ring.append(float(i), i, i, 8, 0)
+    assert len(ring) == 3
+    assert [p[0] for p in ring] == [2.0, 3.0, 4.0]
+
+
+def test_downsampling():
+    store = HistoryStore()
+    store.config({"raw": 4})
+    # 两分钟，每 20 秒一个点
+    for i, (players, map) in enumerate(
+        [(1, "a"), (3, "a"), (2, "b"), (4, "b"), (6, "b"), (8, "b")]
+    ):
+        store.record(
+            "127.0.0.1", 27015, 1200.0 + i * 20, make_sinfo(players=players, map=map)
+        )
+
+    assert [s.peak for s in store.samples("127.0.0.1", 27015, "raw")] == [2, 4, 6, 8]
+    minutes = store.samples("127.0.0.1", 27015, "minute")
+    assert [(s.ts, s.mean, s.peak, s.map) for s in minutes] == [
+        (1200.0, 2.0, 3, "a"),
+        (1260.0, 6.0, 8, "b"),
+    ]
+    hours = store.samples("127.0.0.1", 27015, "hour")
+    assert len(hours) == 1 and hours[0].peak == 8 and hours[0].map == "b"
+    assert store.samples("127.0.0.1", 1) == []
+
+
+def test_group_statistics():
+    store = HistoryStore()
+    for port in (1, 2):
+        store.record(
+            "127.0.0.1", port, 3600.0, make_sinfo(players=port, map=f"m{port}")
+        )
+    samples = [store.samples("127.0.0.1", p, "hour") for p in (1, 2)]
+    hours = peak_hours(samples)
+    assert len(hours) == 24 and sum(hours) == 3.0
+    assert map_popularity(samples, 3600) == [("m2", 2.0), ("m1", 1.0)]
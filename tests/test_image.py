@@ -0,0 +1,109 @@
+import os
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageDraw
+
+from impaper import SimpleTextDrawer
+
+from fancy_source_query.config import ImageConfig
+from fancy_source_query.interfaces.image import (
+    CachedTextDrawer,
+    ImageEncoder,
+    ImageStore,
+    LineCache,
+    paginate,
+)
+
+
+def text_image() -> Image.Image:
+    im = Image.new("RGB", (400, 200), "white")
+    draw = ImageDraw.Draw(im)
+    for i in range(10):
+        draw.text((10, i * 18), f"[{i}](12.5min) player {i}", fill="black")
+    return im
+
+
+def test_encoder_modes():
+    im = text_image()
+    palette = ImageEncoder(ImageConfig(mode="palette", colors=16)).encode(im)
+    with BytesIO() as buf:
+        im.save(buf, format="png", optimize=True)
+        assert len(palette) < len(buf.getvalue())
+    assert Image.open(BytesIO(palette)).mode == "P"
+
+    bilevel = ImageEncoder(ImageConfig(mode="1bit")).encode(im)
+    assert Image.open(BytesIO(bilevel)).mode == "1"
+
+    encoder = ImageEncoder(ImageConfig(format="webp", mode="rgb"))
+    webp = encoder.encode(im)
+    assert encoder.suffix == ".webp"
+    assert Image.open(BytesIO(webp)).format == "WEBP"
+
+
+def test_image_store(tmp_path):
+    store = ImageStore((tmp_path / "images").as_posix(), keep_seconds=60)
+    name = store.save(b"png data", ".png")
+    assert store.save(b"png data", ".png") == name
+    assert store.path(name).read_bytes() == b"png data"
+    assert store.path("../" + name) is None
+    assert store.path("0" * 32 + ".png") is None
+
+    # 超过保留时间的图片在清理间隔过后的下次保存时删除
+    os.utime(store.path(name), (0, 0))
+    store.save(b"other", ".png")
+    assert store.path(name) is not None
+    store.pruned_at = 0.0
+    store.save(b"other", ".png")
+    assert store.path(name) is None
+
+    # 再次保存同一图片时刷新修改时间，不会被清理
+    name = store.save(b"png data", ".png")
+    os.utime(store.path(name), (0, 0))
+    store.save(b"png data", ".png")
+    store.pruned_at = 0.0
+    store.save(b"other", ".png")
+    assert store.path(name) is not None
+    assert list(store.directory.glob("*.tmp")) == []
+
+
+def test_paginate():
+    lines = [f"line {i}" for i in range(25)]
+    assert paginate(lines, 10, 5) == [
+        "\n".join(lines[:10]),
+        "\n".join(lines[10:20]),
+        "\n".join(lines[20:]),
+    ]
+    pages = paginate(lines, 10, 2)
+    assert len(pages) == 2
+    assert pages[-1].endswith("还有 5 行未显示")
+
+
+def test_cached_text_drawer():
+    text = "\n".join(
+        f"服务器：A{i % 3}\n概况：({i % 8:>2d}/ 8)[c1m1_hotel]\n>>[{i}](1.5min)玩家{i}"
+        for i in range(10)
+    )
+    simple, cached = SimpleTextDrawer(), CachedTextDrawer()
+    # 输出与 SimpleTextDrawer 逐像素相同
+    assert ImageChops.difference(simple.draw(text), cached.draw(text)).getbbox() is None
+    misses = cached.cache.misses
+    cached.draw(text)
+    assert cached.cache.misses == misses and cached.cache.hits > 0
+
+    # 字号变化时缓存失效
+    simple.fontsize = cached.fontsize = 20
+    assert ImageChops.difference(simple.draw(text), cached.draw(text)).getbbox() is None
+    assert cached.cache.font == (cached.conf.font.path, 20)
+
+
+def test_glyph_cache_font_switch():
+    cache = LineCache()
+
+    def render(char: str):
+        # 渲染期间其它线程换了字体
+        cache.get(("b.ttf", 12), "x", lambda line: (None, 0, 0))
+        return (None, 0, 0, 1.0)
+
+    cache.glyph(("a.ttf", 12), "字", render)
+    assert cache.font == ("b.ttf", 12)
+    assert "字" not in cache.glyphs
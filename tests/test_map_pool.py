@@ -0,0 +1,55 @@
+import random
+from collections import Counter
+
+from fancy_source_query.config import Mapname
+from fancy_source_query.map_pool import CUSTOM, OFFICIAL, MapChooser, MapPool
+
+
+def maps(n: int, official: bool = False, **weights: float) -> list[Mapname]:
+    return [
+        Mapname(
+            name=f"m{i}",
+            official=official,
+            maps=[f"m{i}_1"],
+            weight=weights.get(f"m{i}", 1.0),
+        )
+        for i in range(n)
+    ]
+
+
+def test_sample_excludes_and_never_repeats():
+    pool = MapPool(maps(50))
+    rng = random.Random(1)
+    for _ in range(100):
+        picked = [m.name for m in pool.sample(5, {"m0", "m1"}, rng)]
+        assert len(set(picked)) == 5
+        assert not {"m0", "m1"} & set(picked)
+    # 可选的地图不足时返回全部可选的地图
+    assert {m.name for m in pool.sample(5, {f"m{i}" for i in range(48)}, rng)} == {
+        "m48",
+        "m49",
+    }
+
+
+def test_weighted_sample():
+    pool = MapPool(maps(3, m0=8.0, m2=0.0))
+    assert len(pool) == 2
+    rng = random.Random(2)
+    counts = Counter(pool.sample(1, rng=rng)[0].name for _ in range(2000))
+    assert set(counts) == {"m0", "m1"}
+    assert counts["m0"] > counts["m1"] * 5
+
+
+def test_chooser_history_and_running():
+    chooser = MapChooser(history_size=4)
+    chooser.update(maps(2, official=True) + maps(6))
+    assert len(chooser.pools[OFFICIAL]) == 2
+    rng = random.Random(3)
+    first = {m.name for m in chooser.choose("A", 2, CUSTOM, {"m5"}, rng)}
+    assert "m5" not in first
+    # 最近抽过的和正在运行的都不会再抽到
+    second = {m.name for m in chooser.choose("A", 3, CUSTOM, {"m5"}, rng)}
+    assert not second & (first | {"m5"})
+    # 其它组不受影响；可选的不够时放宽限制
+    assert len(chooser.choose("B", 6, CUSTOM, {"m5"}, rng)) == 6
+    assert len(chooser.choose("A", 6, CUSTOM, {"m5"}, rng)) == 6
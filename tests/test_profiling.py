@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from fancy_source_query.fmt import InfoFormatter
+from fancy_source_query.profiling import MemoryTracer, sample_for
+
+
+@pytest.mark.asyncio
+async def test_sample_for_reports_focus():
+    ifmt = InfoFormatter()
+
+    def busy():
+        for _ in range(200000):
+            ifmt.fmt_time(0.0)
+
+    task = asyncio.get_running_loop().run_in_executor(None, busy)
+    report = await sample_for(0.2)
+    await task
+    # Python 3.10 中只有函数名，没有类名
+    assert "fmt_time" in report.split("== 自身耗时最多的函数 ==")[0]
+
+
+def test_memory_tracer():
+    tracer = MemoryTracer()
+    tracer.start()
+    try:
+        assert tracer.tracing
+        first = tracer.snapshot()
+        assert "与上次快照相比" not in first
+        data = [bytearray(1024) for _ in range(100)]
+        second = tracer.snapshot()
+        assert "与上次快照相比增长最多" in second and data
+    finally:
+        tracer.stop()
+    assert not tracer.tracing
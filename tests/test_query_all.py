@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import pytest
+
+from fancy_source_query.config import ServerConfig, ServerGroupConfig
+from fancy_source_query.interfaces import FancySourceQuery, GroupResult
+from fancy_source_query.querypool import TIMEOUT_NAME, placeholder
+from fancy_source_query.querypool.infos import PlayerInfo
+from fancy_source_query.querypool.resolver import Resolver
+from fancy_source_query.server_group import build_server_group_graph
+
+from conftest import make_sinfo
+
+
+class CountingPool:
+    """记录每个地址被查询次数的假查询池"""
+
+    def __init__(self) -> None:
+        self.calls: dict[tuple[str, int], int] = {}
+        self.resolver = Resolver()
+        # 这些端口的服务器查询超时
+        self.dead: set[int] = set()
+        self.player_calls: list[int] = []
+
+    async def server_info(self, host: str, port: int):
+        host = await self.resolver.resolve(host)
+        self.calls[(host, port)] = self.calls.get((host, port), 0) + 1
+        if port in self.dead:
+            return 1.0, placeholder(TIMEOUT_NAME)
+        return 1.0, make_sinfo(f"{host}:{port}", players=port % 10)
+
+    async def players_info(self, host: str, port: int):
+        host = await self.resolver.resolve(host)
+        self.player_calls.append(port)
+        return 2.0, [PlayerInfo(name=f"p{port}", score=0, duration=1.0, index=0)]
+
+
+@pytest.fixture()
+def fsq():
+    groups = [
+        ServerGroupConfig(name="A", related_sessions=[]),
+        ServerGroupConfig(name="B", related_sessions=[]),
+    ]
+    servers = [
+        ServerConfig(group="A", name="A1", host="127.0.0.1", port=27011),
+        ServerConfig(group="A", name="A2", host="127.0.0.1", port=27012),
+        ServerConfig(group="B", name="B1", host="127.0.0.1", port=27011),
+    ]
+    x = FancySourceQuery()
+    x.server_group, x.servers = build_server_group_graph(groups, servers)
+    x.query_pool = CountingPool()
+    return x
+
+
+@pytest.mark.asyncio
+async def test_query_all_overview_dedup(fsq: FancySourceQuery):
+    r = await fsq.query_all_overview()
+    assert r.tag == "ao"
+    assert all(n == 1 for n in fsq.query_pool.calls.values())
+    assert len(fsq.query_pool.calls) == 2
+    assert [g.name for g in r.result] == ["A", "B"]
+    assert isinstance(r.result[0], GroupResult)
+    assert [g.players for g in r.result] == [3, 1]
+
+
+@pytest.mark.asyncio
+async def test_search_player_all(fsq: FancySourceQuery):
+    r = await fsq.search_player_all("p27011")
+    assert r.tag == "ap"
+    assert [(g.name, g.players) for g in r.result] == [("A", 1), ("B", 1)]
+    r = await fsq.search_player_all("nobody")
+    assert r.result is None
+
+
+@pytest.mark.asyncio
+async def test_query_all_with_hostnames(fsq: FancySourceQuery):
+    fsq.server_group["B"].servers["B1"].host = "localhost"
+    # 第一次查询时才解析域名，第二次查询时地址已替换为 IP
+    for _ in range(2):
+        r = await fsq.query_all_overview()
+        assert [len(g.result) for g in r.result] == [2, 1]
+        r = await fsq.search_player_all("p27011")
+        assert [g.name for g in r.result] == ["A", "B"]
+
+
+@pytest.mark.asyncio
+async def test_warm_up_active_groups_first(fsq: FancySourceQuery):
+    fsq.config = SimpleNamespace(
+        default_server_group="A",
+        warmup_rate=0.0,
+        warmup_concurrency=1,
+    )
+    fsq.session_group = {"100": "B"}
+    assert fsq.warmup_order() == [("127.0.0.1", 27011), ("127.0.0.1", 27012)]
+    # B 组有活跃的会话，先预热 B 组的服务器
+    assert fsq.warmup_order(["100", "100"])[0] == ("127.0.0.1", 27011)
+    fsq.server_group["B"].servers["B1"].port = 27013
+    assert fsq.warmup_order(["100"])[0] == ("127.0.0.1", 27013)
+    fsq.query_pool.dead = {27012}
+    servers, failed, _ = await fsq.warm_up(["100"])
+    assert (servers, failed) == (3, 1)
+    assert fsq.query_pool.calls == {
+        ("127.0.0.1", 27011): 1,
+        ("127.0.0.1", 27012): 1,
+        ("127.0.0.1", 27013): 1,
+    }
+    # 超时的服务器不再查询玩家
+    assert sorted(fsq.query_pool.player_calls) == [27011, 27013]
@@ -0,0 +1,84 @@
+import asyncio
+import socket
+
+import pytest
+
+from fancy_source_query.querypool import TIMEOUT_NAME, QueryPool
+from fancy_source_query.querypool.resolver import Resolver
+
+from conftest import make_sinfo
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    """假的 DNS：host => IP，记录每次解析"""
+    answers = {"a.example": "10.0.0.1", "b.example": "10.0.0.1"}
+    calls = []
+
+    async def getaddrinfo(loop, host, port, **kwargs):
+        calls.append(host)
+        await asyncio.sleep(0)
+        if host not in answers:
+            raise socket.gaierror(host)
+        return [(socket.AF_INET, socket.SOCK_DGRAM, 17, "", (answers[host], 0))]
+
+    monkeypatch.setattr(asyncio.BaseEventLoop, "getaddrinfo", getaddrinfo)
+    return answers, calls
+
+
+@pytest.mark.asyncio
+async def test_resolver_stale_while_revalidate(dns):
+    answers, calls = dns
+    r = Resolver(ttl=60)
+    assert await r.resolve("127.0.0.1") == "127.0.0.1"
+    results = await asyncio.gather(*(r.resolve("a.example") for _ in range(3)))
+    assert results == ["10.0.0.1"] * 3 and calls == ["a.example"]
+
+    # 过期后先返回旧地址，后台解析完成后更新
+    r._cache["a.example"] = (0.0, "10.0.0.1")
+    answers["a.example"] = "10.0.0.2"
+    assert await r.resolve("a.example") == "10.0.0.1"
+    await asyncio.sleep(0.01)
+    assert r.peek("a.example") == "10.0.0.2"
+
+    # 重新解析失败时保留旧地址
+    r._cache["a.example"] = (0.0, "10.0.0.2")
+    del answers["a.example"]
+    assert await r.resolve("a.example") == "10.0.0.2"
+    await asyncio.sleep(0.01)
+    assert r.peek("a.example") == "10.0.0.2"
+    assert await r.resolve_all(["b.example", "c.example"]) == {"b.example": "10.0.0.1"}
+
+
+@pytest.mark.asyncio
+async def test_query_pool_shares_aliases(dns):
+    pool = QueryPool()
+    calls = []
+
+    async def new_server_info(host: str, port: int):
+        calls.append(host)
+        sinfo = make_sinfo("A1")
+        pool._QueryPool__cache.set(("server", host, port), 1e12, sinfo)
+        return 1e12, sinfo
+
+    pool.new_server_info = new_server_info
+    await pool.server_info("a.example", 27015)
+    await pool.server_info("b.example", 27015)
+    assert calls == ["10.0.0.1"]
+
+
+@pytest.mark.asyncio
+async def test_unresolvable_host_placeholder(dns):
+    _, calls = dns
+    pool = QueryPool()
+    sinfo = make_sinfo("A1")
+    pool.merge("127.0.0.1", 1, 1e12, sinfo, [])
+    addrs = [("127.0.0.1", 1), ("no-such-host.invalid", 27015)]
+    snap = await pool.snapshot(addrs, players=True)
+    assert [s.name for s in snap.servers] == ["A1", TIMEOUT_NAME]
+    assert snap.players[1] == ()
+    # 解析失败也缓存，再次查询不等待 DNS
+    assert await pool.snapshot(addrs, players=True) is snap
+    _, ruleset = await pool.rules_info("no-such-host.invalid", 27015)
+    assert ruleset.digest == ""
+    assert calls == ["no-such-host.invalid"]
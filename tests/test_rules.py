@@ -0,0 +1,48 @@
+import pytest
+
+import fancy_source_query.querypool as querypool
+from fancy_source_query.fmt import InfoFormatter
+from fancy_source_query.interfaces import QueryResult
+from fancy_source_query.querypool import QueryPool
+from fancy_source_query.querypool.infos import RuleInfo, ServerTriple, rules_digest
+
+from conftest import make_sinfo
+
+
+@pytest.mark.asyncio
+async def test_unchanged_rules_reused(monkeypatch):
+    rules = {"sv_cheats": "0", "mp_gamemode": "coop"}
+
+    async def rules_pairs(host: str, port: int, timeout: float):
+        return tuple(sorted(rules.items()))
+
+    monkeypatch.setattr(querypool, "rules_pairs", rules_pairs)
+    pool = QueryPool()
+    _, first = await pool.new_rules_info("127.0.0.1", 27015)
+    _, second = await pool.new_rules_info("127.0.0.1", 27015)
+    assert first.digest == second.digest
+    assert first.rules is second.rules
+    rules["sv_cheats"] = "1"
+    _, third = await pool.new_rules_info("127.0.0.1", 27015)
+    assert third.digest != first.digest
+    assert [r.value for r in third.rules] == ["coop", "1"]
+
+
+def test_server_triple_result_and_fmt():
+    sinfo = make_sinfo(players=0)
+    pairs = (("a", "1"), ("b", "2"))
+    triple = ServerTriple(
+        server=sinfo,
+        players=[],
+        rules=[RuleInfo(name=k, value=v) for k, v in pairs],
+        rules_digest=rules_digest(pairs),
+    )
+    r = QueryResult(tag="spr", qtime=1.0, result=triple)
+    assert isinstance(r.result, ServerTriple)
+    assert isinstance(QueryResult.parse_raw(r.json()).result, ServerTriple)
+
+    ifmt = InfoFormatter()
+    text = ifmt.fmt_rules(triple.rules, triple.rules_digest)
+    assert text == "(a = 1)\n(b = 2)"
+    # 摘要相同时直接使用缓存的文本
+    assert ifmt.fmt_rules([], triple.rules_digest) == text
@@ -0,0 +1,116 @@
+import asyncio
+import struct
+from time import time
+
+import pytest
+
+from fancy_source_query.querypool import TIMEOUT_NAME, QueryPool, a2s
+from fancy_source_query.querypool.shard import (
+    HashRing,
+    ShardPool,
+    players_from_tuples,
+    server_from_tuple,
+)
+
+
+def test_ring_balance_and_stability():
+    addrs = [(f"10.0.{i // 250}.{i % 250}", 27015) for i in range(4000)]
+    ring = HashRing(range(4))
+    shards = ring.assign(addrs)
+    sizes = [len(s) for s in shards.values()]
+    assert sum(sizes) == len(addrs)
+    assert min(sizes) > len(addrs) / 4 * 0.6
+    assert ring.node_for(addrs[0]) == HashRing(range(4)).node_for(addrs[0])
+
+    # 增加一个工作进程时，只有归属新进程的服务器改变归属
+    bigger = HashRing(range(5))
+    moved = [a for a in addrs if ring.node_for(a) != bigger.node_for(a)]
+    assert all(bigger.node_for(a) == 4 for a in moved)
+    assert len(moved) < len(addrs) / 5 * 1.5
+
+
+def test_rebalance_counts_moves():
+    pool = ShardPool(3)
+    addrs = [("127.0.0.1", 27000 + i) for i in range(30)]
+    assert pool.rebalance(addrs) == 30
+    assert pool.rebalance(addrs) == 0
+    assert pool.rebalance(addrs + [("127.0.0.1", 28000)]) == 1
+    assert sum(len(s) for s in pool.shards.values()) == 31
+
+
+class StandIn(asyncio.DatagramProtocol):
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data == a2s.A2S_INFO:
+            payload = (
+                a2s.SINGLE
+                + b"I\x11"
+                + self.name.encode()
+                + b"\x00c1m1_hotel\x00left4dead2\x00L4D2\x00"
+                + struct.pack("<HBBBccBB", 550, 1, 8, 0, b"d", b"l", 0, 0)
+                + b"\x00"
+            )
+        else:
+            payload = (
+                a2s.SINGLE
+                + b"D\x01\x00"
+                + self.name.encode()
+                + b"-player\x00"
+                + struct.pack("<lf", 3, 60.0)
+            )
+        self.transport.sendto(payload, addr)
+
+
+@pytest.mark.asyncio
+async def test_shard_pool_polls_in_workers():
+    loop = asyncio.get_running_loop()
+    transports, addrs = [], []
+    for i in range(4):
+        t, _ = await loop.create_datagram_endpoint(
+            lambda i=i: StandIn(f"S{i}"), local_addr=("127.0.0.1", 0)
+        )
+        transports.append(t)
+        addrs.append(t.get_extra_info("sockname")[:2])
+    shards = ShardPool(2)
+    shards.start()
+    try:
+        shards.rebalance(addrs)
+        results = await shards.poll()
+    finally:
+        shards.close()
+        for t in transports:
+            t.close()
+    assert sorted((h, p) for h, p, *_ in results) == sorted(addrs)
+
+    # 合并进主进程的缓存后，读取不产生查询
+    pool = QueryPool()
+    for host, port, qtime, sinfo, pinfo in results:
+        pool.merge(
+            host, port, qtime, server_from_tuple(sinfo), players_from_tuples(pinfo)
+        )
+    host, port = addrs[2]
+    _, sinfo = await pool.server_info(host, port)
+    _, players = await pool.players_info(host, port)
+    assert sinfo.name == "S2" and sinfo.map == "c1m1_hotel"
+    assert [p.name for p in players] == ["S2-player"]
+
+
+@pytest.mark.asyncio
+async def test_merge_failed_shard_result_caches_placeholder():
+    pool = QueryPool()
+
+    async def unexpected(host: str, port: int):
+        raise AssertionError("should read the placeholder from cache")
+
+    pool.new_server_info = unexpected
+    pool.new_players_info = unexpected
+    pool.merge("127.0.0.1", 27015, time(), None, None)
+    _, sinfo = await pool.server_info("127.0.0.1", 27015)
+    _, players = await pool.players_info("127.0.0.1", 27015)
+    assert sinfo.name == TIMEOUT_NAME and players == []
+    assert pool.history.servers == {}
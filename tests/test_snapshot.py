@@ -0,0 +1,60 @@
+from time import time
+
+import pytest
+
+from fancy_source_query.querypool import QueryPool
+from fancy_source_query.querypool.snapshot import SnapshotStore
+from fancy_source_query.querypool.infos import PlayerInfo
+
+from conftest import make_sinfo
+
+
+def pinfo(name: str) -> list[PlayerInfo]:
+    return [PlayerInfo(name=name, score=0, duration=1.0, index=0)]
+
+
+@pytest.mark.asyncio
+async def test_snapshot_copy_on_write():
+    pool = QueryPool()
+    addrs = [("127.0.0.1", 27011), ("127.0.0.1", 27012)]
+    now = time()
+    for host, port in addrs:
+        pool.merge(host, port, now, make_sinfo(f"S{port}"), pinfo(f"p{port}"))
+
+    snap = await pool.snapshot(addrs, players=True)
+    assert [s.name for s in snap.servers] == ["S27011", "S27012"]
+    assert [p.server.name for p in snap.pairs] == ["S27011", "S27012"]
+    # 缓存没有变化时返回同一个快照
+    assert await pool.snapshot(addrs, players=True) is snap
+
+    # 只有一个服务器刷新时，发布新版本，未变化的服务器沿用原来的对象
+    pool.merge("127.0.0.1", 27012, now + 1, make_sinfo("S2-new"), pinfo("p2-new"))
+    new = await pool.snapshot(addrs, players=True)
+    assert new.version > snap.version
+    assert new.qtime == now + 1
+    assert new.pairs[0] is snap.pairs[0]
+    assert new.pairs[1].server.name == "S2-new"
+    assert snap.pairs[1].server.name == "S27012"
+
+
+def test_snapshot_same_content_keeps_version():
+    store = SnapshotStore()
+    addrs = (("127.0.0.1", 27011), ("127.0.0.1", 27012))
+    alive, dead = make_sinfo("S1"), make_sinfo("超时")
+    snap = store.publish(
+        addrs, [(1.0, alive), (1.0, dead)], [(1.0, pinfo("p")), (1.0, [])]
+    )
+    assert isinstance(snap.players[0], tuple)
+    # 超时的服务器重新查询，只有查询时间变化
+    again = store.publish(
+        addrs, [(1.0, alive), (30.0, make_sinfo("超时"))], [(1.0, pinfo("p")), (30.0, [])]
+    )
+    assert again.version == snap.version
+    assert again.qtime == 30.0
+    assert again.pairs is snap.pairs
+    assert store.get(addrs, True).stamps == ((1.0, 1.0), (30.0, 30.0))
+    # 内容变化时发布新版本
+    new = store.publish(
+        addrs, [(1.0, alive), (50.0, make_sinfo("S2"))], [(1.0, pinfo("p")), (50.0, [])]
+    )
+    assert new.version > snap.version
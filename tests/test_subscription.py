@@ -0,0 +1,88 @@
+import pytest
+
+from fancy_source_query.config import ServerConfig, ServerGroupConfig
+from fancy_source_query.interfaces import FancySourceQuery
+from fancy_source_query.querypool import QueryPool
+from fancy_source_query.querypool.infos import PlayerInfo
+from fancy_source_query.server_group import build_server_group_graph
+from fancy_source_query.subscription import Subscription, SubscriptionManager
+
+from conftest import make_sinfo
+
+
+class ScriptedPool(QueryPool):
+    """按顺序返回预设状态的假查询池"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.state = (0, "c1m1_hotel", [])
+        self.queries = 0
+
+    async def server_info(self, host: str, port: int):
+        self.queries += 1
+        players, map, _ = self.state
+        sinfo = make_sinfo(players=players, map=map, max_players=4)
+        return float(self.queries), sinfo
+
+    async def players_info(self, host: str, port: int):
+        names = self.state[2]
+        players = [PlayerInfo(name=n, score=0, duration=1.0, index=0) for n in names]
+        return float(self.queries), players
+
+
+@pytest.fixture()
+def fsq():
+    x = FancySourceQuery()
+    x.server_group, x.servers = build_server_group_graph(
+        [ServerGroupConfig(name="A", related_sessions=[])],
+        [
+            ServerConfig(group="A", name="A1", host="127.0.0.1", port=1),
+            ServerConfig(group="B", name="B1", host="127.0.0.1", port=2),
+        ],
+    )
+    x.query_pool = ScriptedPool()
+    x.ifmt.config(rlookup={"c1m1_hotel": None})
+    return x
+
+
+@pytest.mark.asyncio
+async def test_poll_events(fsq: FancySourceQuery):
+    manager = SubscriptionManager()
+    manager.add(Subscription(kind="player", session="1", group="A", target="bob"))
+    manager.add(Subscription(kind="full", session="1", group="A", target="A1"))
+    manager.add(Subscription(kind="map", session="2", group="A"))
+
+    # 第一次轮询只记录状态
+    assert await manager.poll(fsq) == {}
+    fsq.query_pool.state = (4, "c2m1_highway", ["alice", "Bob Smith"])
+    notices = await manager.poll(fsq)
+    assert notices[("1", False)] == ["【Bob Smith】进入了 A1", "A1 满人了(4/4)"]
+    assert notices[("2", False)] == ["A1 换图：c1m1_hotel → c2m1_highway"]
+    # 状态不变时不推送，同一个服务器每轮只查询一次
+    queries = fsq.query_pool.queries
+    assert await manager.poll(fsq) == {}
+    assert fsq.query_pool.queries == queries + 1
+
+    assert manager.remove("1", 0) == 1
+    assert [s.kind for s in manager.of_session("1")] == ["full"]
+    assert manager.remove("1") == 1
+
+
+@pytest.mark.asyncio
+async def test_watched_dedups_aliases(fsq: FancySourceQuery):
+    ip = (await fsq.query_pool.resolver.resolve_all(["localhost"]))["localhost"]
+    fsq.server_group, fsq.servers = build_server_group_graph(
+        [
+            ServerGroupConfig(name="A", related_sessions=[]),
+            ServerGroupConfig(name="B", related_sessions=[]),
+        ],
+        [
+            ServerConfig(group="A", name="A1", host="localhost", port=1),
+            ServerConfig(group="B", name="B1", host=ip, port=1),
+        ],
+    )
+    manager = SubscriptionManager()
+    manager.add(Subscription(kind="map", session="1", group="A"))
+    manager.add(Subscription(kind="map", session="1", group="B", target="B1"))
+    # 指向同一服务器的域名和 IP 只查询一次
+    assert list(manager.watched(fsq)) == [(ip, 1)]
@@ -0,0 +1,103 @@
+import json
+from email.utils import formatdate
+from time import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from fancy_source_query.config import ServerConfig, ServerGroupConfig
+from fancy_source_query.interfaces import FancySourceQuery, QueryResult
+from fancy_source_query.interfaces.web import not_modified, qresult_etag, setup_web
+from fancy_source_query.querypool.infos import PlayerInfo
+from fancy_source_query.server_group import build_server_group_graph
+
+from conftest import make_sinfo
+
+
+def test_etag_follows_qtime():
+    r1 = QueryResult(tag="o", qtime=100.5, result=[])
+    r2 = QueryResult(tag="o", qtime=120.5, result=[])
+    assert qresult_etag(r1) == qresult_etag(r1.copy())
+    assert qresult_etag(r1) != qresult_etag(r2)
+
+
+def test_not_modified():
+    etag = 'W/"o-100.5"'
+    assert not_modified({"if-none-match": etag}, etag, 100.5)
+    assert not_modified({"if-none-match": f'"x", {etag}'}, etag, 100.5)
+    assert not not_modified({"if-none-match": 'W/"o-90.0"'}, etag, 100.5)
+    since = formatdate(100, usegmt=True)
+    assert not_modified({"if-modified-since": since}, etag, 100.5)
+    assert not not_modified({"if-modified-since": since}, etag, 200.0)
+    assert not not_modified({}, etag, 100.5)
+
+
+@pytest.fixture()
+def client():
+    groups = [ServerGroupConfig(name="A", related_sessions=[])]
+    servers = [
+        ServerConfig(group="A", name="A1", host="127.0.0.1", port=27011),
+        ServerConfig(group="A", name="A2", host="127.0.0.1", port=27012),
+    ]
+    fsq = FancySourceQuery()
+    fsq.config = SimpleNamespace(cache_delay=20, default_server_group="A")
+    fsq.server_group, fsq.servers = build_server_group_graph(groups, servers)
+    now = time()
+    for s in servers:
+        sinfo = make_sinfo(s.name)
+        players = [PlayerInfo(name=f"bob{s.port}", score=0, duration=1.0, index=0)]
+        fsq.query_pool.merge(s.host, s.port, now, sinfo, players)
+    app = FastAPI()
+    setup_web(fsq, app, "/fsq")
+    return TestClient(app)
+
+
+def test_routes_etag_and_304(client: TestClient):
+    r = client.get("/fsq/overview", params={"group": "A"})
+    assert r.status_code == 200
+    assert r.json()["tag"] == "o"
+    assert [s["name"] for s in r.json()["result"]] == ["A1", "A2"]
+    etag = r.headers["etag"]
+    r = client.get(
+        "/fsq/overview", params={"group": "A"}, headers={"If-None-Match": etag}
+    )
+    assert r.status_code == 304
+    assert r.headers["etag"] == etag
+
+    r = client.get("/fsq/server/A1", params={"group": "A"})
+    assert r.status_code == 200
+    assert r.json()["result"]["players"][0]["name"] == "bob27011"
+
+
+def test_routes_stream(client: TestClient):
+    r = client.get("/fsq/player", params={"q": "bob", "group": "A", "stream": "true"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines[0]["tag"] == "p"
+    assert [line["server"]["name"] for line in lines[1:]] == ["A1", "A2"]
+
+
+def test_routes_errors(client: TestClient):
+    assert client.get("/fsq/player", params={"q": "(", "group": "A"}).status_code == 400
+    assert client.get("/fsq/overview", params={"group": "X"}).status_code == 404
+    assert client.get("/fsq/server/X1", params={"group": "A"}).status_code == 404
+
+
+def test_routes_use_backend():
+    fsq = FancySourceQuery()
+    fsq.config = SimpleNamespace(cache_delay=20, default_server_group="A")
+    calls = []
+
+    class Backend:
+        async def query_server_full(self, sname: str, gname: str | None):
+            calls.append((sname, gname))
+            return QueryResult(tag="spr", qtime=time(), result=None)
+
+    app = FastAPI()
+    setup_web(fsq, app, "/fsq", Backend())
+    r = TestClient(app).get("/fsq/server/A1", params={"group": "A", "rules": "true"})
+    assert r.status_code == 200 and r.json()["tag"] == "spr"
+    assert calls == [("A1", "A")]